@@ -0,0 +1,69 @@
+"""Measures how long it takes to analyze every module in the standard
+library.
+
+Usage:
+  python benchmarks/analyzer.py [ROOT] [--repeat N]
+"""
+import argparse
+import ast
+import os
+import sys
+import sysconfig
+import time
+import warnings
+
+from kawa.analyzer import Analyzer
+from kawa.common import find_python_files
+
+
+def load_corpus(root):
+    corpus = []
+    for filename in find_python_files(root):
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                source = f.read()
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                ast.parse(source)
+        except (SyntaxError, UnicodeDecodeError, ValueError):
+            continue
+
+        corpus.append((filename, os.path.relpath(filename, root)[:-3].replace(os.sep, "."), source))
+
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", nargs="?", default=sysconfig.get_paths()["stdlib"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.root)
+    total_bytes = sum(len(source) for _, _, source in corpus)
+    timings = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for filename, module_name, source in corpus:
+                Analyzer(filename, module_name, source).analyze()
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _, _, source in corpus:
+        ast.parse(source)
+    parse_time = time.perf_counter() - start
+
+    best = min(timings)
+    print(
+        f"Analyzed {len(corpus)} modules ({total_bytes / 1024 / 1024:.1f} MB) "
+        f"in {best:.2f}s (best of {args.repeat}): {len(corpus) / best:.0f} modules/s, "
+        f"{total_bytes / 1024 / 1024 / best:.2f} MB/s ({parse_time:.2f}s parsing, {best - parse_time:.2f}s walking)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
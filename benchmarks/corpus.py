@@ -0,0 +1,144 @@
+"""Generates synthetic Python corpora for the benchmarks.
+
+Usage:
+  python benchmarks/corpus.py DEST [--modules N] [--width N] [--depth N] [--references N]
+"""
+import argparse
+import os
+import random
+import sys
+
+from collections import namedtuple
+
+
+class CorpusShape(namedtuple("CorpusShape", ("modules", "width", "depth", "references", "seed"))):
+    """Describes the shape of a synthetic corpus.
+
+    Attributes:
+      modules(int): The number of modules to generate.
+      width(int): The number of classes and of functions per module.
+      depth(int): How deeply functions nest inside one another.
+      references(int): The number of statements in every function body.
+      seed(int): Seeds the random choice of referenced names.
+    """
+
+    def __new__(cls, modules=100, width=10, depth=3, references=5, seed=0):
+        return super().__new__(cls, modules, width, depth, references, seed)
+
+
+def generate_corpus(root, shape):
+    """Write a synthetic package to root.  A .git directory is created
+    alongside it so that kawa can derive module names from filenames.
+
+    Parameters:
+      root(str)
+      shape(CorpusShape)
+
+    Returns:
+      list[tuple[str, str]]: The filename and module name of every
+      generated module.
+    """
+    rng = random.Random(shape.seed)
+    package = os.path.join(root, "synthetic")
+    os.makedirs(os.path.join(root, ".git"), exist_ok=True)
+    os.makedirs(package, exist_ok=True)
+    with open(os.path.join(package, "__init__.py"), "w") as f:
+        f.write('"""A synthetic package."""\n')
+
+    modules = [(os.path.join(package, "__init__.py"), "synthetic")]
+    for i in range(shape.modules):
+        filename = os.path.join(package, f"module_{i}.py")
+        with open(filename, "w") as f:
+            f.write(generate_module(i, shape, rng))
+
+        modules.append((filename, f"synthetic.module_{i}"))
+
+    return modules
+
+
+def generate_module(index, shape, rng):
+    """Generate the source code of a single module.
+
+    Returns:
+      str
+    """
+    lines = [f'"""Synthetic module number {index}."""', ""]
+    names = []
+    for i in range(shape.width):
+        lines.append(f"CONSTANT_{i} = {i}")
+        names.append(f"CONSTANT_{i}")
+
+    for i in range(shape.width):
+        lines += ["", ""]
+        lines += _generate_class(f"Class{i}", shape, rng, names)
+        names.append(f"Class{i}")
+
+    for i in range(shape.width):
+        lines += ["", ""]
+        lines += _generate_function(f"function_{i}", 0, shape, rng, names)
+        names.append(f"function_{i}")
+
+    lines += ["", "", f"result = function_0({', '.join(names[:3])})", ""]
+    return "\n".join(lines)
+
+
+def _generate_class(name, shape, rng, names):
+    lines = [f"class {name}:", f'    """The {name} class."""', f"    attribute = {rng.choice(names)}"]
+    for i in range(max(1, shape.width // 2)):
+        lines.append("")
+        lines += _indent(_generate_function(f"method_{i}", shape.depth, shape, rng, names, ["self"]))
+
+    return lines
+
+
+def _generate_function(name, level, shape, rng, names, arguments=()):
+    arguments = list(arguments) + ["a", "b"]
+    lines = [f"def {name}({', '.join(arguments)}):", f'    """The {name} function."""']
+    local_names = names + arguments
+    for i in range(shape.references):
+        target = rng.choice(local_names)
+        lines.append(f"    value_{i} = {target}(a, {rng.choice(local_names)}, key={rng.choice(local_names)}.attribute)")
+        local_names = local_names + [f"value_{i}"]
+
+    if level < shape.depth:
+        lines.append("")
+        lines += _indent(_generate_function(f"nested_{level + 1}", level + 1, shape, rng, local_names))
+        lines.append(f"    return nested_{level + 1}(a, b)")
+    else:
+        lines.append(f"    return {rng.choice(local_names)}")
+
+    return lines
+
+
+def _indent(lines):
+    return [f"    {line}" if line else line for line in lines]
+
+
+def add_shape_arguments(parser):
+    """Add command line arguments for every CorpusShape field.
+    """
+    defaults = CorpusShape()
+    parser.add_argument("--modules", type=int, default=defaults.modules, help="number of modules")
+    parser.add_argument("--width", type=int, default=defaults.width, help="classes and functions per module")
+    parser.add_argument("--depth", type=int, default=defaults.depth, help="levels of nested functions")
+    parser.add_argument("--references", type=int, default=defaults.references, help="statements per function")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def shape_from_arguments(args):
+    return CorpusShape(*(getattr(args, field) for field in CorpusShape._fields))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dest")
+    add_shape_arguments(parser)
+    args = parser.parse_args()
+
+    modules = generate_corpus(args.dest, shape_from_arguments(args))
+    print(f"Generated {len(modules)} modules in {args.dest}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
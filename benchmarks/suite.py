@@ -0,0 +1,202 @@
+"""Times the analyzer, the indexer and lookups against a synthetic
+corpus and reports throughput, latency percentiles and peak memory.
+
+Usage:
+  python benchmarks/suite.py [--modules N] [--width N] [--depth N] [--references N]
+                             [--lookups N] [--output FILE] [--compare FILE]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+from corpus import add_shape_arguments, generate_corpus, shape_from_arguments
+
+from kawa.analyzer import Analyzer, Reference
+from kawa.indexer import Indexer
+
+PERCENTILES = (50, 90, 99)
+
+
+def measure(operations, run):
+    """Time every operation individually.
+
+    Parameters:
+      operations(list): The arguments of every operation.
+      run(callable): Runs a single operation.
+
+    Returns:
+      dict: Throughput and latency percentiles.
+    """
+    latencies = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        start = time.perf_counter()
+        for operation in operations:
+            operation_start = time.perf_counter_ns()
+            run(*operation)
+            latencies.append(time.perf_counter_ns() - operation_start)
+        total = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        "operations": len(operations),
+        "seconds": total,
+        "operations_per_second": len(operations) / total if total else None,
+    }
+    for percentile in PERCENTILES:
+        index = min(len(latencies) - 1, len(latencies) * percentile // 100)
+        result[f"p{percentile}_us"] = latencies[index] / 1000 if latencies else None
+    result["max_us"] = latencies[-1] / 1000 if latencies else None
+    return result
+
+
+def peak_memory(run):
+    """Run a function under tracemalloc.
+
+    Returns:
+      tuple[float, object]: The peak memory allocated, in megabytes,
+      and the function's result.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            result = run()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024, result
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(modules, lookups, seed=0):
+    sources = []
+    for filename, module_name in modules:
+        with open(filename, "r", encoding="utf-8") as f:
+            sources.append((filename, module_name, f.read()))
+
+    results = {}
+    results["analyze"] = measure(sources, lambda *args: Analyzer(*args).analyze())
+    results["analyze"]["megabytes_per_second"] = \
+        sum(len(source) for _, _, source in sources) / 1024 / 1024 / results["analyze"]["seconds"]
+    results["analyze"]["peak_memory_mb"], _ = peak_memory(
+        lambda: [Analyzer(*args).analyze() for args in sources]
+    )
+
+    indexer = Indexer()
+    results["index_file"] = measure(modules, indexer.index_file)
+    results["index_file"]["peak_memory_mb"], indexer = peak_memory(lambda: _index(modules))
+
+    rng = random.Random(seed)
+    references, definitions = [], []
+    for filename, module_name in modules:
+        for entity in indexer.modules[module_name].flatten():
+            position = (filename, *entity.source_location.start)
+            if isinstance(entity, Reference):
+                references.append(position)
+            else:
+                definitions.append(position)
+
+    positions = rng.choices(references + definitions, k=lookups)
+    reference_positions = rng.choices(references, k=lookups)
+    results["lookup_entity"] = measure(positions, indexer.lookup_entity)
+    results["lookup_definition"] = measure(reference_positions, _ignoring_unresolved(indexer.lookup_definition))
+    results["lookup_references"] = measure(reference_positions, _ignoring_unresolved(indexer.lookup_references))
+    return results
+
+
+def _index(modules):
+    indexer = Indexer()
+    for filename, module_name in modules:
+        indexer.index_file(filename, module_name)
+    return indexer
+
+
+def _ignoring_unresolved(lookup):
+    def run(*args):
+        try:
+            return lookup(*args)
+        except KeyError:
+            return None
+    return run
+
+
+def compare(results, baseline):
+    """Print how results changed relative to a baseline.
+    """
+    print(f"\nCompared to {baseline.get('commit') or 'baseline'}:", file=sys.stderr)
+    if baseline.get("corpus") != results["corpus"]:
+        print("  (warning: the baseline was run against a different corpus)", file=sys.stderr)
+
+    for name, result in results["results"].items():
+        previous = baseline["results"].get(name)
+        if not previous:
+            continue
+
+        changes = []
+        for key in ("operations_per_second", "p50_us", "p99_us", "peak_memory_mb"):
+            if result.get(key) and previous.get(key):
+                changes.append(f"{key} {(result[key] - previous[key]) / previous[key] * 100:+.1f}%")
+        print(f"  {name:<20} {', '.join(changes)}", file=sys.stderr)
+
+
+def _current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, check=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_shape_arguments(parser)
+    parser.add_argument("--lookups", type=int, default=10000, help="number of lookups of each kind")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results with a previous JSON file")
+    args = parser.parse_args()
+
+    shape = shape_from_arguments(args)
+    with tempfile.TemporaryDirectory() as root:
+        modules = generate_corpus(root, shape)
+        results = {
+            "commit": _current_commit(),
+            "python": platform.python_version(),
+            "corpus": shape._asdict(),
+            "results": run_benchmarks(modules, args.lookups, shape.seed),
+        }
+
+    for name, result in results["results"].items():
+        memory = f", {result['peak_memory_mb']:.1f} MB peak" if "peak_memory_mb" in result else ""
+        print(
+            f"{name:<20} {result['operations']:>7} ops in {result['seconds']:.2f}s: "
+            f"{result['operations_per_second']:.0f} ops/s, "
+            f"p50 {result['p50_us']:.1f}us, p90 {result['p90_us']:.1f}us, p99 {result['p99_us']:.1f}us{memory}",
+            file=sys.stderr,
+        )
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
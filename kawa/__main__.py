@@ -1,52 +1,480 @@
 import argparse
 import json
+import os
 import sys
 
-from .indexer import Indexer
+from heapq import merge
+from itertools import groupby, islice
 
-indexer = Indexer()
+from . import daemon
+from .common import add_source_root, find_vc_root
+
+# Everything else is imported by the commands that need it so that
+# lookups forwarded to a daemon don't pay for importing the indexer.
+indexer = None
 
 
 def describe(args):
-    indexer.index_file(args.filename)
     return indexer.lookup_metadata(args.filename, args.line, args.column)
 
 
 def find_definition(args):
-    indexer.index_file(args.filename)
     return indexer.lookup_definition(args.filename, args.line, args.column)
 
 
 def find_usages(args):
-    indexer.index_file(args.filename)
-    return indexer.lookup_references(args.filename, args.line, args.column)
+    references = indexer.iter_references(args.filename, args.line, args.column, args.group_by_file)
+    return islice(references, args.limit)
+
+
+def find_callers(args):
+    from .project import index_project
+
+    # Callers may live anywhere in the project.
+    index_project(find_vc_root(args.filename), indexer, jobs=args.jobs)
+    return indexer.lookup_callers(args.filename, args.line, args.column, args.depth or None)
+
+
+def find_callees(args):
+    from .project import index_project
+
+    index_project(find_vc_root(args.filename), indexer, jobs=args.jobs)
+    return indexer.lookup_callees(args.filename, args.line, args.column, args.depth or None)
+
+
+def search(args):
+    from .project import index_project
+
+    index_project(args.root, indexer, jobs=args.jobs)
+    return indexer.search_symbols(args.query, args.limit)
+
+
+def index(args):
+    from .project import index_project
+
+    def progress(done, total):
+        sys.stderr.write(f"\r{done}/{total}")
+        sys.stderr.flush()
+
+    # Modules loaded from a previous run are only re-indexed if their
+    # files changed, in parallel, by index_project.
+    for module_name, stamp in list(indexer.stamps.items()):
+        if not os.path.exists(stamp.filename):
+            indexer.remove_module(module_name)
+
+    _, report = index_project(args.root, indexer, jobs=args.jobs, progress=progress if sys.stderr.isatty() else None)
+    if sys.stderr.isatty():
+        sys.stderr.write("\n")
+
+    for filename, error in report.failures:
+        sys.stderr.write(f"Failed to index {filename}: {error}\n")
+
+    sys.stderr.write(f"{report}\n")
+
+
+def index_env(args):
+    from .environment import index_environment
+
+    def progress(distribution, missing):
+        status = "indexing" if missing else "up to date"
+        sys.stderr.write(f"{distribution.name} {distribution.version}: {status}\n")
+        sys.stderr.flush()
+
+    indexed = index_environment(args.cache_dir, jobs=args.jobs, rebuild=args.rebuild, progress=progress)
+    sys.stderr.write(f"Indexed {len(indexed)} distributions.\n")
+
+
+def index_shards(args):
+    from .shards import index_shards
+
+    def progress(key, report):
+        if report is None:
+            sys.stderr.write(f"{key}: up to date\n")
+            return
+
+        for filename, error in report.failures:
+            sys.stderr.write(f"Failed to index {filename}: {error}\n")
+
+        sys.stderr.write(f"{key}: {report}\n")
+        sys.stderr.flush()
+
+    directory = args.shards
+    if directory is None:
+        directory = os.path.join(find_vc_root(os.path.join(os.path.abspath(args.root), "__init__.py")), ".kawa-shards")
+
+    reports = index_shards(
+        directory, args.root, args.prefix, jobs=args.jobs, rebuild=args.rebuild, lazy=args.lazy, progress=progress,
+    )
+    sys.stderr.write(f"Indexed {len(reports)} shards into {directory}.\n")
+
+
+def batch(args):
+    from .batch import run_batch
+
+    run_batch(indexer, sys.stdin, sys.stdout, jobs=args.jobs)
+
+
+def serve(args):
+    import threading
+
+    from .server import serve_stdio
+    from .watcher import ProjectWatcher, make_watcher
+
+    if args.http:
+        from .http_server import serve_http
+
+        host, port = args.http
+        serve_http(indexer, host, port, watch=args.watch, poll=args.poll)
+        return
+
+    lock = threading.Lock()
+
+    def update_files(analyzed_modules, removed_paths):
+        with lock:
+            indexer.update_files(analyzed_modules, removed_paths)
+
+    watcher = None
+    if args.watch:
+        watcher = ProjectWatcher(args.watch, update_files, make_watcher(args.watch, args.poll), lazy=indexer.lazy)
+        watcher.start()
+
+    try:
+        serve_stdio(indexer, sys.stdin, sys.stdout, lock)
+    finally:
+        if watcher is not None:
+            watcher.stop()
+
+
+def serve_daemon(args):
+    daemon.serve_daemon(indexer, os.path.abspath(args.root), args.idle_timeout)
+
+
+def forward(args):
+    """Send a lookup to the daemon for the project it's about,
+    spawning one in the background if none is running.
+
+    Returns:
+      dict: The daemon's JSON-RPC response or None if the lookup has
+      to be done in-process.
+    """
+    try:
+        root = find_vc_root(args.filename)
+    except ValueError:
+        return None
+
+    params = {"filename": os.path.abspath(args.filename), "line": args.line, "column": args.column}
+    if args.func is find_usages:
+        params.update(limit=args.limit, by_file=args.group_by_file)
+
+    try:
+        return daemon.request(daemon.socket_path(root), args.func.__name__, params)
+    except (OSError, ValueError):
+        daemon.spawn(root)
+        return None
+
+
+def write_result(result, args):
+    """Write the result of a command to stdout.  The references found
+    by find_usages are written as they are produced when the output
+    format is ndjson, one per line (or one file per line when grouped
+    by file).
+    """
+    if args.func is not find_usages:
+        sys.stdout.write(json.dumps(result, indent=4))
+        return
+
+    if args.group_by_file:
+        result = group_by_file(result)
+
+    if args.format == "json":
+        sys.stdout.write(json.dumps(list(result), indent=4))
+        return
+
+    for item in result:
+        sys.stdout.write(json.dumps(item))
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
+
+def group_by_file(references):
+    """Group the definition and references produced by find_usages
+    by file.  The definition comes first, so it's merged into the
+    references (which are ordered by file and position) in order for
+    every file to end up in a single group.
+
+    Returns:
+      generator[dict]
+    """
+    def position(reference):
+        location = reference["location"]
+        return location["filename"], location["line_number"], location["column_offset"]
+
+    references = iter(references)
+    definition = next(references, None)
+    references = merge([definition] if definition is not None else [], references, key=position)
+    for filename, group in groupby(references, key=lambda reference: reference["location"]["filename"]):
+        yield {"filename": filename, "references": list(group)}
+
+
+def host_and_port(value):
+    host, _, port = value.rpartition(":")
+    try:
+        return host or "127.0.0.1", int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not a valid HOST:PORT pair")
+
+
+def load_indexer(path, refresh=True):
+    """Load a previously-saved index from disk, falling back to an
+    empty one if the file is missing or unusable.
+    """
+    from .indexer import Indexer
+
+    if path and os.path.exists(path):
+        try:
+            return Indexer.load(path, refresh)
+        except (OSError, ValueError, EOFError):
+            pass
+
+    return Indexer()
+
+
+def check_args(parser, args):
+    """Exit with a usage error if args combine options that can't be
+    used together.
+    """
+    if args.database and (args.index or args.lazy):
+        parser.error("--database can't be combined with --index or --lazy")
+    if args.database and (getattr(args, "http", None) or args.func in (search, find_callers, find_callees)):
+        parser.error("serve --http, search, find_callers and find_callees need an in-memory index")
+    if args.shards and (args.index or args.database):
+        parser.error("--shards can't be combined with --index or --database")
+    if args.shards and args.func not in (describe, find_definition, find_usages, index_shards):
+        parser.error("--shards only supports describe, find_definition, find_usages and index-shards")
+
+
+def should_forward(args):
+    """Check whether a command should be forwarded to the project's
+    daemon rather than be answered in this process.
+    """
+    # Anything that changes how the index is built or reported on is
+    # only honoured in-process.
+    local_only = (
+        args.no_daemon, args.no_env, args.index, args.database, args.shards, args.source_root, args.lazy,
+        args.stats, args.profile,
+    )
+    return getattr(args, "forward", False) and daemon.is_supported() and not any(local_only)
+
+
+def make_indexer(args):
+    """Build the index a command runs against: a SQLite or sharded
+    index, or else an in-memory one loaded from --index, with the
+    environment's index attached unless --no-env is given.
+    """
+    if args.database:
+        from .database import SQLiteIndex
+
+        result = SQLiteIndex(args.database)
+    elif args.shards and args.func is not index_shards:
+        from .shards import ShardedIndex
+
+        result = ShardedIndex(args.shards)
+    else:
+        if args.func is index and not args.index:
+            # index persists to the project's .kawa-index by default and
+            # picks up from there on the next run.
+            root = find_vc_root(os.path.join(os.path.abspath(args.root), "__init__.py"))
+            args.index = os.path.join(root, ".kawa-index")
+
+        result = load_indexer(args.index, refresh=args.func is not index)
+        result.lazy = result.lazy or args.lazy
+
+    if not args.no_env and args.func not in (index_env, index_shards):
+        from .environment import Environment
+
+        result.attach(Environment.load())
+    return result
 
 
 def main():
+    global indexer
+
     parser = argparse.ArgumentParser()
+    parser.add_argument("--index", help="Load the index from and persist it to this file.")
+    parser.add_argument(
+        "--database", metavar="FILE",
+        help="Keep the index in this SQLite database instead of in memory.  It can be shared between processes.",
+    )
+    parser.add_argument(
+        "--shards", metavar="DIR",
+        help="Answer lookups from the sharded index in this directory.  See index-shards.",
+    )
+    parser.add_argument(
+        "--source-root", action="append", default=[],
+        help="A directory that module names should be relative to.  May be given multiple times.",
+    )
+    parser.add_argument(
+        "--lazy", action="store_true",
+        help="Only index the outline of new modules up front and analyze function bodies on demand.",
+    )
+    parser.add_argument(
+        "--no-daemon", action="store_true",
+        help="Always answer lookups in this process rather than forwarding them to the project's daemon.",
+    )
+    parser.add_argument(
+        "--no-env", action="store_true",
+        help="Don't look imported names up in the prebuilt index of the interpreter's environment.  See index-env.",
+    )
+    parser.add_argument("--stats", action="store_true", help="Print instrumentation counters to stderr when done.")
+    parser.add_argument("--profile", metavar="FILE", help="Run the command under cProfile and dump the results here.")
     subparsers = parser.add_subparsers()
 
     describe_parser = subparsers.add_parser("describe", help="Describe the thing at point.")
-    describe_parser.set_defaults(func=describe)
+    describe_parser.set_defaults(func=describe, forward=True)
 
     find_definition_parser = subparsers.add_parser("find_definition", help="Find where the thing at point is defined.")
-    find_definition_parser.set_defaults(func=find_definition)
+    find_definition_parser.set_defaults(func=find_definition, forward=True)
 
     find_usages_parser = subparsers.add_parser("find_usages", help="Find where the thing at point is defined.")
-    find_usages_parser.set_defaults(func=find_usages)
+    find_usages_parser.set_defaults(func=find_usages, forward=True)
+
+    find_callers_parser = subparsers.add_parser("find_callers", help="Find the functions that call the thing at point.")
+    find_callers_parser.set_defaults(func=find_callers)
+
+    find_callees_parser = subparsers.add_parser("find_callees", help="Find the functions the thing at point calls.")
+    find_callees_parser.set_defaults(func=find_callees)
 
-    for p in (describe_parser, find_definition_parser, find_usages_parser):
+    call_parsers = (find_callers_parser, find_callees_parser)
+    for p in (describe_parser, find_definition_parser, find_usages_parser) + call_parsers:
         p.add_argument("filename", help="The name of the file to analyze.")
         p.add_argument("line", type=int)
         p.add_argument("column", type=int)
 
+    find_usages_parser.add_argument(
+        "--format", choices=("json", "ndjson"), default="json",
+        help="Write a JSON array or stream one JSON object per line as usages are found.",
+    )
+    find_usages_parser.add_argument("--limit", "-n", type=int, help="The maximum number of usages to write.")
+    find_usages_parser.add_argument(
+        "--group-by-file", action="store_true",
+        help="Order usages by file and position and group them per file.",
+    )
+
+    for p in call_parsers:
+        p.add_argument(
+            "--depth", "-d", type=int, default=1,
+            help="Also find indirect callers or callees up to this many calls away.  0 means there is no limit.",
+        )
+        p.add_argument("--jobs", "-j", type=int, help="The number of worker processes to index the project with.")
+
+    index_parser = subparsers.add_parser("index", help="Index every module in a project.")
+    index_parser.set_defaults(func=index, output=False)
+    index_parser.add_argument("root", help="The directory to index.")
+    index_parser.add_argument("--jobs", "-j", type=int, help="The number of worker processes to use.")
+
+    index_env_parser = subparsers.add_parser(
+        "index-env", help="Build a shared index of the standard library and of every installed distribution.",
+    )
+    index_env_parser.set_defaults(func=index_env, output=False)
+    index_env_parser.add_argument("--cache-dir", help="Where to keep the indexes.  Defaults to ~/.cache/kawa/env.")
+    index_env_parser.add_argument("--rebuild", action="store_true", help="Rebuild indexes that already exist.")
+    index_env_parser.add_argument("--jobs", "-j", type=int, help="The number of worker processes to use.")
+
+    index_shards_parser = subparsers.add_parser(
+        "index-shards", help="Index a project into shards that can be rebuilt independently of each other.",
+    )
+    index_shards_parser.set_defaults(func=index_shards, output=False)
+    index_shards_parser.add_argument("root", help="The directory to index.")
+    index_shards_parser.add_argument(
+        "--prefix", action="append", default=[],
+        help="A path prefix under root that gets its own shard.  May be given multiple times.  "
+        "Every other top-level package gets a shard of its own.",
+    )
+    index_shards_parser.add_argument("--rebuild", action="store_true", help="Rebuild shards that are up to date.")
+    index_shards_parser.add_argument("--jobs", "-j", type=int, help="The number of worker processes to use.")
+
+    search_parser = subparsers.add_parser("search", help="Find definitions by name across a project.")
+    search_parser.set_defaults(func=search)
+    search_parser.add_argument("query", help="A prefix, substring or camel/snake case abbreviation of the name.")
+    search_parser.add_argument("--limit", "-n", type=int, default=20, help="The maximum number of results.")
+    search_parser.add_argument("--root", default=".", help="The directory whose modules should be searched.")
+    search_parser.add_argument("--jobs", "-j", type=int, help="The number of worker processes to use.")
+
+    batch_parser = subparsers.add_parser("batch", help="Answer newline-delimited JSON queries read from stdin.")
+    batch_parser.set_defaults(func=batch, output=False)
+    batch_parser.add_argument("--jobs", "-j", type=int, help="The number of worker processes to index files with.")
+
+    daemon_parser = subparsers.add_parser("daemon", help="Answer lookups for a project over a Unix socket.")
+    daemon_parser.set_defaults(func=serve_daemon, output=False)
+    daemon_parser.add_argument("root", help="The project's version control root.")
+    daemon_parser.add_argument(
+        "--idle-timeout", type=float, default=daemon.IDLE_TIMEOUT,
+        help="The number of seconds to wait for new connections before exiting.",
+    )
+
+    serve_parser = subparsers.add_parser("serve", help="Answer requests from a long-running process.")
+    serve_parser.set_defaults(func=serve, output=False)
+    serve_mode = serve_parser.add_mutually_exclusive_group(required=True)
+    serve_mode.add_argument(
+        "--stdio", action="store_true",
+        help="Read newline-delimited JSON-RPC requests from stdin and write responses to stdout.",
+    )
+    serve_mode.add_argument(
+        "--http", metavar="HOST:PORT", type=host_and_port,
+        help="Answer lookups over HTTP on the given address.",
+    )
+    serve_parser.add_argument(
+        "--watch", metavar="ROOT", nargs="?", const=".",
+        help="Re-index the files that change under ROOT (the current directory by default) in the background.",
+    )
+    serve_parser.add_argument("--poll", action="store_true", help="Poll for changes rather than using inotify.")
+
     args = parser.parse_args()
     if not hasattr(args, "func"):
         parser.print_usage()
         return 1
 
-    res = args.func(args)
-    sys.stdout.write(json.dumps(res, indent=4))
+    check_args(parser, args)
+    if should_forward(args):
+        response = forward(args)
+        if response is not None:
+            if "error" in response:
+                sys.stderr.write(f"{response['error']['message']}\n")
+                return 1
+
+            write_result(response["result"], args)
+            return 0
+
+    for source_root in args.source_root:
+        add_source_root(source_root)
+
+    indexer = make_indexer(args)
+
+    def run():
+        # Results may be produced lazily, so they're written out before
+        # the index is saved.
+        res = args.func(args)
+        if getattr(args, "output", True):
+            write_result(res, args)
+
+    if args.profile:
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            profile.runcall(run)
+        finally:
+            profile.dump_stats(args.profile)
+    else:
+        run()
+
+    if args.index:
+        indexer.save(args.index)
+        if args.func is index:
+            sys.stderr.write(f"Saved index to {args.index}.\n")
+
+    if args.stats:
+        sys.stderr.write(f"{indexer.stats}\n")
     return 0
 
 
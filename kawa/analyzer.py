@@ -3,17 +3,29 @@ all its FQNs along with some metadata about each one (source location,
 docstring, outgoing references, etc.).
 """
 import ast
-import multipledispatch
-import types
+import io
+import os
+import sys
+import time
 import warnings
 
-from collections import namedtuple
+from collections import Counter, namedtuple
 
 
 class SourceLocation(namedtuple("SourceLocation", (
-        "filename", "line_number", "column_offset",
+        "filename", "line_number", "column_offset", "end_line_number", "end_column_offset",
 ))):
-    pass
+    """Represents the span of source code an entity covers.  The end
+    position is exclusive.  Column offsets are UTF-8 byte offsets.
+    """
+
+    @property
+    def start(self):
+        return self.line_number, self.column_offset
+
+    @property
+    def end(self):
+        return self.end_line_number, self.end_column_offset
 
 
 class Variable(namedtuple("Variable", ("name", "source_location"))):
@@ -48,6 +60,51 @@ class Reference(namedtuple("Reference", ("name", "source_location"))):
         }
 
 
+class Call(Reference):
+    """Represents a reference to the function (or class) a call
+    expression calls by name, eg. "f" in "f(x)".  Calls through
+    attributes, like "a.f(x)", only produce references to their
+    receivers.
+    """
+
+    __slots__ = ()
+
+    # Calls are never equal to plain references to the same name at
+    # the same location, so turning a reference into a call (or back)
+    # is seen as a change when a module is re-indexed.
+    def __eq__(self, other):
+        return type(other) is Call and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = Reference.__hash__
+
+
+class Import(namedtuple("Import", ("name", "target", "source_location"))):
+    """Represents a name bound by an import statement.  The target is
+    the FQN of the module or module member the name is an alias for.
+    """
+
+    def flatten(self):
+        yield self
+
+    @property
+    def metadata(self):
+        return {
+            "type": "import",
+            "name": self.name,
+            "target": self.target,
+            "location": self.source_location._asdict(),
+        }
+
+
+class RelativeImport(namedtuple("RelativeImport", ("level", "module", "name"))):
+    """The target of a relative import in a module template.  It is
+    resolved when the template is bound to a module name.
+    """
+
+
 class Scope(namedtuple("Scope", (
         "name", "arguments", "docstring", "source_location", "definitions", "references",
 ))):
@@ -113,14 +170,42 @@ class Function(Scope):
         }
 
 
+class LazyFunction(Function):
+    """Represents a function whose body hasn't been analyzed yet.  Its
+    definitions and references are always empty.
+    """
+
+
 class Analyzer:
     """Find all the definitions and references inside a module.
+
+    Every statement is visited exactly once.  Handlers are looked up
+    by the exact type of each node in the STATEMENT_HANDLERS and
+    EXPRESSION_HANDLERS tables and they append the definitions and
+    references they find to the lists they are given.  FQNs are
+    interned so the entities and references that share one also share
+    a single string.
+
+    Parameters:
+      filename(str)
+      module_name(str): None to analyze the module as a template that
+        isn't tied to a module name or a filename.  See bind_template.
+      module_source(str)
+      stats(Stats): Optional.  Receives the time spent parsing and
+        walking the module, the number of nodes visited per type and
+        the number of entities produced.
+      lazy(bool): Whether or not to skip the bodies of module- and
+        class-level functions, producing LazyFunctions for them.  Use
+        analyze_function to analyze those bodies later.
     """
 
-    def __init__(self, filename, module_name, module_source):
+    def __init__(self, filename, module_name, module_source, stats=None, lazy=False):
         self.filename = filename
         self.module_name = module_name
         self.module_source = module_source
+        self.stats = stats
+        self.lazy = lazy
+        self.nodes_visited = Counter()
 
     def analyze(self):
         """Return a tree representing all the definitions and references
@@ -129,144 +214,317 @@ class Analyzer:
         Returns:
           Module
         """
+        start = time.perf_counter()
         module = ast.parse(self.module_source)
-        return Module(
-            name=self.module_name,
+        parsed = time.perf_counter()
+        definitions, references = [], []
+        self._analyze_body(self.module_name or "", module.body, definitions, references)
+        module = Module(
+            name=self.module_name or "",
             docstring=_get_docstring(module),
-            source_location=SourceLocation(self.filename, 0, 0),
-            definitions=self._find_definitions(self.module_name, module.body),
-            references=self._find_references(self.module_name, module.body),
+            source_location=SourceLocation(self.filename, 0, 0, *_get_end_of_source(self.module_source)),
+            definitions=definitions,
+            references=references,
         )
 
-    @multipledispatch.dispatch(str, ast.arg)
-    def _analyze_definition(self, parent_name, arg_node):
-        return Variable(
-            name=f"{parent_name}.{arg_node.arg}",
-            source_location=self._get_source_location(arg_node),
-        )
+        if self.stats is not None:
+            self._record_stats(module, parsed - start, time.perf_counter() - parsed)
+        return module
 
-    @multipledispatch.dispatch(str, ast.Name)
-    def _analyze_definition(self, parent_name, name_node):
-        return Variable(
-            name=f"{parent_name}.{name_node.id}",
-            source_location=self._get_source_location(name_node),
-        )
+    def analyze_function(self, name, line_number, end_line_number):
+        """Analyze a single function without parsing the rest of the
+        module.  Only the function's own lines are parsed.
 
-    @multipledispatch.dispatch(str, ast.Assign)
-    def _analyze_definition(self, parent_name, assign_node):
+        Parameters:
+          name(str): The function's FQN.
+          line_number(int): The line its "def" is on.
+          end_line_number(int): The last line of its body.
+
+        Returns:
+          Function
+        """
+        lines = _split_lines(self.module_source)[line_number - 1:end_line_number]
+        source, first_line = "".join(lines), line_number
+        if lines and lines[0][:1].isspace():
+            # Wrapping indented code in a block lets it be parsed with
+            # its original column offsets.
+            source, first_line = f"if 1:\n{source}", line_number - 1
+
+        node = ast.parse(source).body[0]
+        if isinstance(node, ast.If):
+            node = node.body[0]
+
+        ast.increment_lineno(node, first_line - 1)
+        definitions = []
+        self._analyze_function(name.rpartition(".")[0], node, definitions, [])
+        return definitions[0]
+
+    def _record_stats(self, module, parse_time, walk_time):
+        stats = self.stats
+        stats.add_time("parse", parse_time)
+        stats.add_time("walk", walk_time)
+        stats.count("analyzer.modules")
+        for node_type, count in self.nodes_visited.items():
+            stats.count(f"analyzer.nodes.{node_type.__name__}", count)
+
+        entities = Counter(isinstance(entity, Reference) for entity in module.flatten())
+        stats.count("analyzer.definitions", entities[False])
+        stats.count("analyzer.references", entities[True])
+
+    def _analyze_body(self, parent_name, node_list, definitions, references):
+        handlers, visited = self.STATEMENT_HANDLERS, self.nodes_visited
+        for node in node_list:
+            visited[type(node)] += 1
+            try:
+                handler = handlers[type(node)]
+            except KeyError:
+                warnings.warn(f"Cannot analyze {type(node).__name__} nodes.")
+                continue
+
+            handler(self, parent_name, node, definitions, references)
+
+    def _analyze_assign(self, parent_name, assign_node, definitions, references):
         for target in assign_node.targets:
             if isinstance(target, ast.Name):
-                yield self._analyze_definition(parent_name, target)
+                definitions.append(self._make_variable(parent_name, target.id, target))
 
             elif isinstance(target, ast.Tuple):
                 for tuple_target in target.elts:
-                    yield self._analyze_definition(parent_name, tuple_target)
+                    if isinstance(tuple_target, ast.Name):
+                        definitions.append(self._make_variable(parent_name, tuple_target.id, tuple_target))
 
-    @multipledispatch.dispatch(str, ast.ClassDef)
-    def _analyze_definition(self, parent_name, class_node):
-        name = f"{parent_name}.{class_node.name}"
-        return Class(
-            name=name,
-            docstring=_get_docstring(class_node),
-            source_location=self._get_source_location(class_node),
-            definitions=self._find_definitions(name, class_node.body),
-            references=self._find_references(name, class_node.body),
-        )
+        self._analyze_expression(parent_name, assign_node.value, references)
 
-    @multipledispatch.dispatch(str, ast.FunctionDef)
-    def _analyze_definition(self, parent_name, func_node):
-        name = f"{parent_name}.{func_node.name}"
+    def _analyze_expr(self, parent_name, node, definitions, references):
+        if node.value is not None:
+            self._analyze_expression(parent_name, node.value, references)
 
-        children = []
-        for field in ("args", "vararg", "kwonlyargs", "kwarg"):
-            field_value = getattr(func_node.args, field, None)
-            if not field_value:
-                continue
+    def _analyze_nothing(self, parent_name, node, definitions, references):
+        pass
 
-            if isinstance(field_value, list):
-                children.extend(field_value)
+    def _analyze_import(self, parent_name, import_node, definitions, references):
+        for alias in import_node.names:
+            # "import a.b.c" binds "a" whereas "import a.b.c as d" binds
+            # "d" to the "a.b.c" module.
+            if alias.asname:
+                name, target = alias.asname, alias.name
             else:
-                children.append(field_value)
+                name = target = alias.name.partition(".")[0]
+
+            definitions.append(self._make_import(parent_name, name, target, alias, import_node))
+
+    def _analyze_import_from(self, parent_name, import_node, definitions, references):
+        if self.module_name is None and import_node.level:
+            # Templates don't know what package they're in yet.
+            module_name = None
+        else:
+            module_name = _resolve_relative_import(
+                self.module_name, self.filename, import_node.module, import_node.level,
+            )
+            if module_name is None:
+                return
+
+        for alias in import_node.names:
+            if alias.name == "*":
+                continue
 
-        children += func_node.body
-        arguments = [arg.arg for arg in func_node.args.args]
-        if func_node.args.vararg:
-            arguments.append(f"*{func_node.args.vararg.arg}")
+            if module_name is None:
+                target = RelativeImport(import_node.level, import_node.module, alias.name)
+            else:
+                target = sys.intern(f"{module_name}.{alias.name}")
 
-        if func_node.args.kwarg:
-            arguments.append(f"**{func_node.args.kwarg.arg}")
+            name = alias.asname or alias.name
+            definitions.append(self._make_import(parent_name, name, target, alias, import_node))
 
-        return Function(
+    def _analyze_class(self, parent_name, class_node, definitions, references):
+        name = sys.intern(f"{parent_name}.{class_node.name}")
+        class_definitions, class_references = [], []
+        self._analyze_body(name, class_node.body, class_definitions, class_references)
+        definitions.append(Class(
+            name=name,
+            docstring=_get_docstring(class_node),
+            source_location=self._get_source_location(class_node),
+            definitions=class_definitions,
+            references=class_references,
+        ))
+
+    def _analyze_function(self, parent_name, func_node, definitions, references):
+        name = sys.intern(f"{parent_name}.{func_node.name}")
+        args = func_node.args
+
+        arguments = [arg.arg for arg in args.args]
+        if args.vararg:
+            arguments.append(f"*{args.vararg.arg}")
+
+        if args.kwarg:
+            arguments.append(f"**{args.kwarg.arg}")
+
+        if self.lazy:
+            definitions.append(LazyFunction(
+                name=name,
+                docstring=_get_docstring(func_node),
+                arguments=arguments,
+                source_location=self._get_source_location(func_node),
+            ))
+            return
+
+        function_definitions = []
+        for arg in args.args:
+            function_definitions.append(self._make_variable(name, arg.arg, arg))
+
+        if args.vararg:
+            function_definitions.append(self._make_variable(name, args.vararg.arg, args.vararg))
+
+        for arg in args.kwonlyargs:
+            function_definitions.append(self._make_variable(name, arg.arg, arg))
+
+        if args.kwarg:
+            function_definitions.append(self._make_variable(name, args.kwarg.arg, args.kwarg))
+
+        function_references = []
+        self._analyze_body(name, func_node.body, function_definitions, function_references)
+        definitions.append(Function(
             name=name,
             docstring=_get_docstring(func_node),
             arguments=arguments,
             source_location=self._get_source_location(func_node),
-            definitions=self._find_definitions(name, children),
-            references=self._find_references(name, func_node.body),
-        )
-
-    @multipledispatch.dispatch(str, ast.Call)
-    def _analyze_reference(self, parent_name, call_node):
-        yield from self._analyze_reference(parent_name, call_node.func)
+            definitions=function_definitions,
+            references=function_references,
+        ))
+
+    #: Maps statement types to the methods that analyze them.
+    STATEMENT_HANDLERS = {
+        ast.Assign: _analyze_assign,
+        ast.Expr: _analyze_expr,
+        ast.Return: _analyze_expr,
+        ast.Pass: _analyze_nothing,
+        ast.Raise: _analyze_nothing,
+        ast.Import: _analyze_import,
+        ast.ImportFrom: _analyze_import_from,
+        ast.ClassDef: _analyze_class,
+        ast.FunctionDef: _analyze_function,
+    }
+
+    def _analyze_expression(self, parent_name, node, references):
+        self.nodes_visited[type(node)] += 1
+        handler = self.EXPRESSION_HANDLERS.get(type(node))
+        if handler is not None:
+            handler(self, parent_name, node, references)
+
+    def _analyze_name(self, parent_name, name_node, references):
+        references.append(Reference(
+            name=sys.intern(f"{parent_name}.{name_node.id}"),
+            source_location=self._get_source_location(name_node),
+        ))
+
+    def _analyze_attribute(self, parent_name, node, references):
+        self._analyze_expression(parent_name, node.value, references)
+
+    def _analyze_call(self, parent_name, call_node, references):
+        func = call_node.func
+        if type(func) is ast.Name:
+            self.nodes_visited[ast.Name] += 1
+            references.append(Call(
+                name=sys.intern(f"{parent_name}.{func.id}"),
+                source_location=self._get_source_location(func),
+            ))
+        else:
+            self._analyze_expression(parent_name, func, references)
 
         for arg in call_node.args:
-            yield from self._analyze_reference(parent_name, arg)
+            self._analyze_expression(parent_name, arg, references)
 
         for keyword in call_node.keywords:
-            yield from self._analyze_reference(parent_name, keyword.arg)
-
-    @multipledispatch.dispatch(str, (ast.Assign, ast.Expr, ast.Return))
-    def _analyze_reference(self, parent_name, node):
-        try:
-            yield from self._analyze_reference(parent_name, node.value)
-        except NotImplementedError:
-            pass
-
-    @multipledispatch.dispatch(str, ast.Attribute)
-    def _analyze_reference(self, parent_name, node):
-        try:
-            yield from self._analyze_reference(parent_name, node.value)
-        except NotImplementedError:
-            pass
-
-    @multipledispatch.dispatch(str, ast.Name)
-    def _analyze_reference(self, parent_name, name_node):
-        yield Reference(
-            name=f"{parent_name}.{name_node.id}",
-            source_location=self._get_source_location(name_node),
+            self._analyze_expression(parent_name, keyword.value, references)
+
+    #: Maps expression types to the methods that find references in them.
+    EXPRESSION_HANDLERS = {
+        ast.Name: _analyze_name,
+        ast.Attribute: _analyze_attribute,
+        ast.Call: _analyze_call,
+    }
+
+    def _make_variable(self, parent_name, name, node):
+        return Variable(
+            name=sys.intern(f"{parent_name}.{name}"),
+            source_location=self._get_source_location(node),
+        )
+
+    def _make_import(self, parent_name, name, target, alias, import_node):
+        # Aliases only carry positions on Python 3.10 and up.
+        return Import(
+            name=sys.intern(f"{parent_name}.{name}"),
+            target=target,
+            source_location=self._get_source_location(alias if hasattr(alias, "lineno") else import_node),
         )
 
     def _get_source_location(self, node):
-        return SourceLocation(self.filename, node.lineno, node.col_offset)
+        end_lineno = getattr(node, "end_lineno", None)
+        if end_lineno is None:
+            return SourceLocation(self.filename, node.lineno, node.col_offset, node.lineno, node.col_offset)
+        return SourceLocation(self.filename, node.lineno, node.col_offset, end_lineno, node.end_col_offset)
+
 
-    def _find_definitions(self, parent_name, node_list):
+def bind_template(template, module_name, filename):
+    """Bind a module template (a module analyzed without a module
+    name) to a module name and a filename.  The result is the same as
+    that of analyzing the module under that name.
+
+    Parameters:
+      template(Module)
+      module_name(str)
+      filename(str)
+
+    Returns:
+      Module
+    """
+    return _bind(template, module_name, filename)
+
+
+def _bind(entity, module_name, filename):
+    name, source_location = sys.intern(module_name + entity.name), entity.source_location._replace(filename=filename)
+    if isinstance(entity, Scope):
         definitions = []
-        for node in node_list:
-            try:
-                if not isinstance(node, (ast.Expr, ast.Pass, ast.Raise, ast.Return)):
-                    res = self._analyze_definition(parent_name, node)
-                    if isinstance(res, (list, types.GeneratorType)):
-                        definitions.extend(res)
-                    else:
-                        definitions.append(res)
-            except NotImplementedError:
-                warnings.warn(f"Cannot analyze {type(node).__name__} nodes.")
+        for definition in entity.definitions:
+            definition = _bind(definition, module_name, filename)
+            if definition is not None:
+                definitions.append(definition)
+
+        return type(entity)(
+            name, entity.arguments, entity.docstring, source_location, definitions,
+            [_bind(reference, module_name, filename) for reference in entity.references],
+        )
 
-        return definitions
+    if isinstance(entity, Import):
+        target = entity.target
+        if isinstance(target, RelativeImport):
+            package = _resolve_relative_import(module_name, filename, target.module, target.level)
+            if package is None:
+                return None
 
-    def _find_references(self, parent_name, node_list):
-        references = []
-        for node in node_list:
-            try:
-                res = self._analyze_reference(parent_name, node)
-                if isinstance(res, (list, types.GeneratorType)):
-                    references.extend(res)
-                else:
-                    references.append(res)
-            except NotImplementedError:
-                pass
+            target = sys.intern(f"{package}.{target.name}")
+        return Import(name, target, source_location)
 
-        return references
+    return type(entity)(name, source_location)
+
+
+def _resolve_relative_import(module_name, filename, module, level):
+    if not level:
+        return module
+
+    package = module_name
+    if os.path.basename(filename) != "__init__.py":
+        package = package.rpartition(".")[0]
+
+    for _ in range(level - 1):
+        package = package.rpartition(".")[0]
+
+    if not package:
+        return module
+
+    if module:
+        return f"{package}.{module}"
+    return package
 
 
 def _get_docstring(node):
@@ -274,3 +532,19 @@ def _get_docstring(node):
     if docstring:
         return docstring.rstrip()
     return None
+
+
+def _split_lines(source):
+    # Unlike str.splitlines, only split on the line endings Python
+    # itself recognizes so that line numbers match the parser's.
+    return io.StringIO(source, newline="").readlines()
+
+
+def _get_end_of_source(source):
+    if isinstance(source, bytes):
+        source = source.decode("utf-8", "replace")
+
+    lines = source.splitlines()
+    if not lines:
+        return 1, 0
+    return len(lines), len(lines[-1].encode("utf-8"))
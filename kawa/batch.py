@@ -0,0 +1,150 @@
+"""Batch mode answers many lookups in a single process so that tools
+that need thousands of them (eg. CI jobs annotating diffs) only pay
+for startup and indexing once.
+
+Every query is a JSON object on its own line:
+
+  {"id": 1, "op": "find_usages", "filename": "foo.py", "line": 1, "column": 0}
+
+Queries take the same parameters as the server's methods.  Every file
+the queries refer to (and, for find_callers and find_callees, every
+file in its project) is indexed at most once, in parallel, before any
+query is answered.  Queries are then answered grouped by the file they
+refer to and one result is written per query, on its own line and in
+the order the queries were read:
+
+  {"id": 1, "result": [...]}
+  {"id": 2, "error": {"code": -32602, "message": "..."}}
+"""
+import json
+import os
+
+from .common import find_vc_root
+from .project import analyze_modules, find_project_modules
+from .server import INTERNAL_ERROR, INVALID_REQUEST, PARSE_ERROR, RequestError, dispatch
+
+#: Calls can come from anywhere in a project, so the whole project of
+#: the file these queries refer to is indexed, like the CLI does.
+PROJECT_OPS = ("find_callers", "find_callees")
+
+
+def run_batch(indexer, infile, outfile, jobs=None):
+    """Answer every query read from infile.
+
+    Parameters:
+      indexer(Indexer)
+      infile(file): A text file to read queries from.
+      outfile(file): A text file to write results to.
+      jobs(int): The number of worker processes to index files with.
+        Defaults to the number of CPUs.
+
+    Returns:
+      int: The number of queries that failed.
+    """
+    queries = []
+    for line in infile:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            queries.append(json.loads(line))
+        except ValueError as e:
+            queries.append(RequestError(PARSE_ERROR, str(e)))
+
+    filenames = {}
+    for i, query in enumerate(queries):
+        filenames.setdefault(_filename_of(query), []).append(i)
+
+    paths = [filename for filename in filenames if filename is not None]
+    failures = index_files(indexer, list(dict.fromkeys(paths + _project_files(queries))), jobs)
+    results = [None] * len(queries)
+    for filename, indices in filenames.items():
+        for i in indices:
+            results[i] = _answer(indexer, queries[i], failures.get(filename))
+
+    for result in results:
+        outfile.write(json.dumps(result))
+        outfile.write("\n")
+    outfile.flush()
+    return sum(1 for result in results if "error" in result)
+
+
+def index_files(indexer, filenames, jobs=None):
+    """Index the files that are missing from an index or that changed
+    on disk since they were indexed, in parallel and in a single
+    update.
+
+    Parameters:
+      indexer(Indexer)
+      filenames(list[str])
+      jobs(int): The number of worker processes to use.  Defaults to
+        the number of CPUs.
+
+    Returns:
+      dict[str, Exception]: The errors of the files that couldn't be
+      indexed, by filename.
+    """
+    modules, failures = [], {}
+    for filename in filenames:
+        try:
+            module_name = indexer.module_name_of(filename)
+        except ValueError as e:
+            failures[filename] = e
+            continue
+
+        if indexer.needs_indexing(filename, module_name):
+            modules.append((filename, module_name, indexer.lazy))
+
+    analyzed = []
+    for filename, result, stats in analyze_modules(modules, jobs or os.cpu_count() or 1, indexer.templates):
+        indexer.stats.merge(stats)
+        if isinstance(result, Exception):
+            failures[filename] = result
+        else:
+            analyzed.append(result)
+
+    indexer.add_modules(analyzed)
+    return failures
+
+
+def _answer(indexer, query, failure):
+    if isinstance(query, RequestError):
+        return _error(None, query.code, query.message)
+
+    query_id = query.get("id") if isinstance(query, dict) else None
+    if not isinstance(query, dict) or not isinstance(query.get("op"), str):
+        return _error(query_id, INVALID_REQUEST, "Queries must be objects with an 'op'.")
+
+    if failure is not None:
+        return _error(query_id, INTERNAL_ERROR, f"{type(failure).__name__}: {failure}")
+
+    params = {name: value for name, value in query.items() if name not in ("id", "op")}
+    try:
+        return {"id": query_id, "result": dispatch(indexer, {"method": query["op"], "params": params})}
+    except RequestError as e:
+        return _error(query_id, e.code, e.message)
+    except Exception as e:
+        return _error(query_id, INTERNAL_ERROR, f"{type(e).__name__}: {e}")
+
+
+def _project_files(queries):
+    roots = set()
+    for query in queries:
+        filename = _filename_of(query)
+        if filename is not None and query.get("op") in PROJECT_OPS:
+            try:
+                roots.add(find_vc_root(filename))
+            except ValueError:
+                continue
+
+    return [filename for root in sorted(roots) for filename, _ in find_project_modules(root)]
+
+
+def _filename_of(query):
+    filename = query.get("filename") if isinstance(query, dict) else None
+    return os.path.abspath(filename) if isinstance(filename, str) else None
+
+
+def _error(query_id, code, message):
+    return {"id": query_id, "error": {"code": code, "message": message}}
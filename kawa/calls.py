@@ -0,0 +1,203 @@
+"""A call graph derived from the calls found by the analyzer.
+
+Every call is an edge from the scope it appears in (a function, or a
+class or module for calls made in their bodies) to the name it
+resolves to.  That name may be bound by an import, so imports are
+edges too, from the names they bind to the names they import.  Names
+are interned into integer ids and edges are kept in adjacency maps in
+both directions, so that the graph can be updated one call at a time
+as modules are re-indexed and walked in either direction without
+touching any strings.  The ids of names that lose their last edge are
+released and reused, so the graph doesn't grow as modules change.
+"""
+from .columnar import StringTable
+from .common import CopyOnWrite
+
+
+class CallGraph(CopyOnWrite):
+    """Maps the scopes calls are made from to the names they call and
+    back.
+
+    Attributes:
+      names(StringTable): Every caller, callee and import.
+      callees(dict[int, dict[int, int]]): Maps callers to the names
+        they call and the number of calls they make to each one.
+      callers(dict[int, dict[int, int]]): The same edges, by callee.
+      imports(dict[int, set[int]]): Maps the names imports bind to
+        the names they import.
+      importers(dict[int, set[int]]): The same edges, by imported name.
+    """
+
+    def __init__(self):
+        self.names = StringTable()
+        self.callees = {}
+        self.callers = {}
+        self.imports = {}
+        self.importers = {}
+        self._free = []
+        self._owned = set()
+
+    def add(self, caller, callee):
+        """Record a call.
+
+        Parameters:
+          caller(str): The FQN of the scope the call is made from.
+          callee(str): The FQN the call resolves to.
+        """
+        caller_id, callee_id = self._intern(caller), self._intern(callee)
+        callees = self._writable(self.callees, caller_id, dict)
+        callees[callee_id] = callees.get(callee_id, 0) + 1
+        callers = self._writable(self.callers, callee_id, dict)
+        callers[caller_id] = callers.get(caller_id, 0) + 1
+
+    def remove(self, caller, callee):
+        """Forget a call previously recorded with add.
+
+        Parameters:
+          caller(str)
+          callee(str)
+        """
+        caller_id, callee_id = self.names.ids.get(caller), self.names.ids.get(callee)
+        if callee_id not in self.callees.get(caller_id, ()):
+            return
+
+        for edges, source, target in ((self.callees, caller_id, callee_id), (self.callers, callee_id, caller_id)):
+            targets = self._writable(edges, source, dict)
+            if targets[target] > 1:
+                targets[target] -= 1
+                continue
+
+            del targets[target]
+            if not targets:
+                del edges[source]
+
+        self._release(caller_id)
+        self._release(callee_id)
+
+    def add_import(self, name, target):
+        """Record that an import binds name to target.
+
+        Parameters:
+          name(str)
+          target(str)
+        """
+        name_id, target_id = self._intern(name), self._intern(target)
+        self._writable(self.imports, name_id, set).add(target_id)
+        self._writable(self.importers, target_id, set).add(name_id)
+
+    def remove_import(self, name, target):
+        """Forget an import previously recorded with add_import.
+
+        Parameters:
+          name(str)
+          target(str)
+        """
+        name_id, target_id = self.names.ids.get(name), self.names.ids.get(target)
+        if target_id not in self.imports.get(name_id, ()):
+            return
+
+        for edges, source, other in ((self.imports, name_id, target_id), (self.importers, target_id, name_id)):
+            targets = self._writable(edges, source, set)
+            targets.discard(other)
+            if not targets:
+                del edges[source]
+
+        self._release(name_id)
+        self._release(target_id)
+
+    def walk(self, names, callers=False, depth=1):
+        """Find every name reachable from a set of names by following
+        calls, breadth first.  Imports are followed transparently:
+        callers of a name include the callers of every name an import
+        binds it to and callees that are bound by imports are followed
+        to the names they import.
+
+        Parameters:
+          names(iterable[str]): The names to start from.
+          callers(bool): Whether to follow calls backwards, from callees
+            to their callers, rather than from callers to callees.
+          depth(int): The maximum number of calls to follow from the
+            starting names.  None means there is no limit.
+
+        Returns:
+          list[tuple[str, int]]: Every reached name along with the
+          number of calls it is away from the starting names, closest
+          first.  Callees are the names calls resolve to, which may be
+          bound by imports.
+        """
+        ids, strings = self.names.ids, self.names.strings
+        edges, aliases = (self.callers, self.importers) if callers else (self.callees, self.imports)
+        frontier = [ids[name] for name in names if name in ids]
+        seen, reached, distance = set(frontier), [], 0
+        while frontier and (depth is None or distance < depth):
+            distance += 1
+            next_frontier = []
+            for name_id in frontier:
+                sources = _closure(name_id, aliases) if name_id in aliases else (name_id,)
+                for source_id in sources:
+                    for neighbor_id in edges.get(source_id, ()):
+                        if neighbor_id not in seen:
+                            seen.add(neighbor_id)
+                            next_frontier.append(neighbor_id)
+
+            reached.extend((strings[name_id], distance) for name_id in next_frontier)
+            frontier = next_frontier
+
+        return reached
+
+    def copy(self):
+        """Returns:
+          CallGraph: A copy of this graph that can be updated without
+          affecting it.
+        """
+        self._owned = set()
+        graph = type(self)()
+        graph.names.strings = self.names.strings.copy()
+        graph.names.ids = self.names.ids.copy()
+        graph.callees = self.callees.copy()
+        graph.callers = self.callers.copy()
+        graph.imports = self.imports.copy()
+        graph.importers = self.importers.copy()
+        graph._free = self._free.copy()
+        return graph
+
+    def _intern(self, name):
+        name_id = self.names.ids.get(name)
+        if name_id is not None:
+            return name_id
+
+        if not self._free:
+            return self.names.intern(name)
+
+        name_id = self._free.pop()
+        self.names.ids[name] = name_id
+        self.names.strings[name_id] = name
+        return name_id
+
+    def _release(self, name_id):
+        # Ids that have no edges left are freed for _intern to reuse.  A
+        # recursive call's caller and callee share an id.
+        name = self.names.strings[name_id]
+        if name is None:
+            return
+
+        for edges in (self.callees, self.callers, self.imports, self.importers):
+            if name_id in edges:
+                return
+
+        del self.names.ids[name]
+        self.names.strings[name_id] = None
+        self._free.append(name_id)
+
+
+def _closure(name_id, edges):
+    # name_id along with every id reachable from it through edges, eg.
+    # every name an import binds it to, directly or through re-exports.
+    closure, pending = [name_id], [name_id]
+    while pending:
+        for other_id in edges.get(pending.pop(), ()):
+            if other_id not in closure:
+                closure.append(other_id)
+                pending.append(other_id)
+
+    return closure
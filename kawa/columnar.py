@@ -0,0 +1,372 @@
+"""A compact, read-only representation of an Indexer.
+
+Rather than keeping millions of small entity objects around, every
+entity becomes a row in a handful of array-backed columns.  Names and
+filenames are interned into a string table and referred to by id.
+Entity objects (and their metadata dicts) are only materialized for
+the rows that lookups return.
+
+Rows are grouped by module and, within a module, sorted by start
+position (outer spans first), so position lookups can bisect the start
+column the same way PositionIndex does.
+"""
+import pickle
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+from .analyzer import Call, Class, Function, Import, LazyFunction, Module, Reference, SourceLocation, Variable
+from .common import find_qualified_name, load_data
+from .positions import _COLUMN_BITS, _pack
+
+COMPACT_FORMAT_VERSION = 1
+COMPACT_FORMAT_MAGIC = b"KAWC"
+
+#: The classes saved compact indexes may contain.  See load_data.
+COMPACT_CLASSES = frozenset([("array", "array"), ("array", "_array_reconstructor"), ("kawa.columnar", "StringTable")])
+
+KIND_MODULE, KIND_CLASS, KIND_FUNCTION, KIND_VARIABLE, KIND_REFERENCE, KIND_IMPORT = range(6)
+KIND_TYPES = {
+    KIND_MODULE: Module, KIND_CLASS: Class, KIND_FUNCTION: Function,
+    KIND_VARIABLE: Variable, KIND_REFERENCE: Reference, KIND_IMPORT: Import,
+}
+KINDS = {entity_type: kind for kind, entity_type in KIND_TYPES.items()}
+
+#: Function bodies that were never analyzed are stored as plain functions
+#: and calls are stored as plain references.
+KINDS[LazyFunction] = KIND_FUNCTION
+KINDS[Call] = KIND_REFERENCE
+
+_COLUMN_MASK = (1 << _COLUMN_BITS) - 1
+
+
+class StringTable:
+    """Interns strings into consecutive integer ids.
+    """
+
+    __slots__ = ("strings", "ids")
+
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, string):
+        try:
+            return self.ids[string]
+        except KeyError:
+            self.ids[string] = string_id = len(self.strings)
+            self.strings.append(string)
+            return string_id
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+    def __getstate__(self):
+        return self.strings
+
+    def __setstate__(self, strings):
+        self.strings = strings
+        self.ids = {string: i for i, string in enumerate(strings)}
+
+
+class CompactIndex:
+    """A read-only index with the same lookup API as Indexer.  Build
+    one from an Indexer with CompactIndex.from_indexer.
+
+    Attributes:
+      strings(StringTable): Every name and filename.
+      modules(dict[str, int]): Maps module names to their ids.
+      module_filenames(array): The filename id of every module.
+      module_rows(array): The first row of every module followed by
+        one past the last row of the last module.
+      kinds, names, starts, ends, parents, targets(array): One entry
+        per row.  targets holds the id of the name a reference resolves
+        to or that an import aliases and -1 for other definitions.
+      details(dict[int, tuple]): The docstring and arguments of every
+        module, class and function row.
+      definition_names, definition_rows(array): The rows of the
+        definitions that names resolve to sorted by name id.
+      reference_targets, reference_rows(array): Reference rows sorted
+        by target id.
+    """
+
+    def __init__(self):
+        self.strings = StringTable()
+        self.modules = {}
+        self.module_filenames = array("q")
+        self.module_rows = array("q", [0])
+        self.kinds = array("b")
+        self.names = array("q")
+        self.starts = array("q")
+        self.ends = array("q")
+        self.parents = array("q")
+        self.targets = array("q")
+        self.details = {}
+        self.definition_names = array("q")
+        self.definition_rows = array("q")
+        self.reference_targets = array("q")
+        self.reference_rows = array("q")
+
+    @classmethod
+    def from_indexer(cls, indexer):
+        """Build a compact copy of an Indexer.
+
+        Parameters:
+          indexer(Indexer)
+
+        Returns:
+          CompactIndex
+        """
+        index = cls()
+        intern = index.strings.intern
+        definitions, references = [], []
+        for module_name in sorted(indexer.modules):
+            module = indexer.modules[module_name]
+            resolved = indexer.references_by_module.get(module_name, {})
+            index.modules[module_name] = len(index.module_filenames)
+            index.module_filenames.append(intern(module.source_location.filename))
+
+            first_row = len(index.kinds)
+            spans = sorted(
+                (_pack(*entity.source_location.start), -_pack(*entity.source_location.end), i, entity)
+                for i, entity in enumerate(module.flatten())
+            )
+
+            stack = []
+            for start, negative_end, _, entity in spans:
+                row, end = len(index.kinds), -negative_end
+                while stack and index.ends[stack[-1]] <= start:
+                    stack.pop()
+
+                kind = KINDS[type(entity)]
+                name_id = intern(entity.name)
+                index.kinds.append(kind)
+                index.names.append(name_id)
+                index.starts.append(start)
+                index.ends.append(end)
+                index.parents.append(stack[-1] - first_row if stack else -1)
+                if kind == KIND_REFERENCE:
+                    target_id = intern(resolved.get(entity) or indexer._resolve_reference(entity))
+                    index.targets.append(target_id)
+                    references.append((target_id, row))
+                else:
+                    index.targets.append(intern(entity.target) if kind == KIND_IMPORT else -1)
+                    if indexer.entities_by_fqn.get(entity.name) is entity:
+                        definitions.append((name_id, row))
+                    if kind not in (KIND_VARIABLE, KIND_IMPORT):
+                        index.details[row] = (entity.docstring, entity.arguments)
+
+                stack.append(row)
+
+            index.module_rows.append(len(index.kinds))
+
+        definitions.sort()
+        index.definition_names.extend(name_id for name_id, _ in definitions)
+        index.definition_rows.extend(row for _, row in definitions)
+        references.sort()
+        index.reference_targets.extend(target_id for target_id, _ in references)
+        index.reference_rows.extend(row for _, row in references)
+        return index
+
+    def save(self, path):
+        """Serialize the index to disk.
+
+        Parameters:
+          path(str)
+        """
+        with open(path, "wb") as f:
+            f.write(COMPACT_FORMAT_MAGIC)
+            f.write(COMPACT_FORMAT_VERSION.to_bytes(4, "big"))
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index previously written by save.
+
+        Raises:
+          ValueError: If the file is not a compact index, if it was
+            written by an incompatible version of kawa or if it can't
+            be trusted.  See load_data.
+
+        Returns:
+          CompactIndex
+        """
+        with open(path, "rb") as f:
+            if f.read(len(COMPACT_FORMAT_MAGIC)) != COMPACT_FORMAT_MAGIC:
+                raise ValueError(f"{path} is not a compact kawa index.")
+
+            version = int.from_bytes(f.read(4), "big")
+            if version != COMPACT_FORMAT_VERSION:
+                raise ValueError(f"{path} uses compact format {version} but {COMPACT_FORMAT_VERSION} is required.")
+
+            index = cls.__new__(cls)
+            index.__dict__.update(load_data(f, COMPACT_CLASSES))
+            return index
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def lookup_row(self, filename, line_number, column_offset):
+        """Look up the row of the innermost entity at a given location.
+
+        Returns:
+          int or None
+        """
+        module_id = self._module_id(filename)
+        if module_id is None:
+            return None
+
+        first_row, last_row = self.module_rows[module_id], self.module_rows[module_id + 1]
+        position = _pack(line_number, column_offset)
+        i = bisect_right(self.starts, position, first_row, last_row) - 1 - first_row
+        while i != -1:
+            if position < self.ends[first_row + i]:
+                return first_row + i
+
+            i = self.parents[first_row + i]
+
+        return None
+
+    def lookup_entity(self, filename, line_number, column_offset):
+        """Look up the innermost entity at a given location.
+
+        Returns:
+          An object representing the entity or None.
+        """
+        row = self.lookup_row(filename, line_number, column_offset)
+        if row is None:
+            return None
+        return self.materialize(row)
+
+    def lookup_entities_between(self, filename, first_line, last_line):
+        """Look up every entity that overlaps a range of lines along
+        with the entities that enclose them.
+
+        Returns:
+          A list of entities in source order.
+        """
+        module_id = self._module_id(filename)
+        if module_id is None:
+            return []
+
+        first_row, last_row = self.module_rows[module_id], self.module_rows[module_id + 1]
+        lo, hi = _pack(first_line, 0), _pack(last_line + 1, 0)
+        start = bisect_left(self.starts, lo, first_row, last_row)
+
+        enclosing = []
+        i = start - 1 - first_row
+        while i != -1:
+            if lo < self.ends[first_row + i]:
+                enclosing.append(first_row + i)
+            i = self.parents[first_row + i]
+
+        rows = enclosing[::-1] + list(range(start, bisect_left(self.starts, hi, first_row, last_row)))
+        return [self.materialize(row) for row in rows]
+
+    def lookup_metadata(self, filename, line_number, column_offset):
+        """Look up the metadata of an entity.
+
+        Returns:
+          A dictionary describing the entity or None.
+        """
+        entity = self.lookup_entity(filename, line_number, column_offset)
+        if not entity:
+            return None
+        return entity.metadata
+
+    def lookup_definition(self, filename, line_number, column_offset):
+        """Look up the definition of an entity.
+
+        Returns:
+          A dictionary describing where the entity is defined or None.
+        """
+        row = self._lookup_definition_row(filename, line_number, column_offset)
+        if row is None:
+            return None
+        return self.materialize(row).metadata
+
+    def lookup_references(self, filename, line_number, column_offset):
+        """Look up the list of references of an entity.
+
+        Returns:
+          A list of dictionaries describing the references to the entity.
+        """
+        return list(self.iter_references(filename, line_number, column_offset))
+
+    def iter_references(self, filename, line_number, column_offset, by_file=False):
+        """Like lookup_references, but only build the entities of the
+        references as they are consumed.  See Indexer.iter_references.
+
+        Returns:
+          generator[dict]
+        """
+        row = self._lookup_definition_row(filename, line_number, column_offset, follow_imports=False)
+        if row is None:
+            return
+
+        name_id = self.names[row]
+        lo = bisect_left(self.reference_targets, name_id)
+        hi = bisect_right(self.reference_targets, name_id, lo)
+        rows = sorted(self.reference_rows[lo:hi])
+        if by_file:
+            rows.sort(key=lambda row: (self._filename(row), self.starts[row], self.ends[row]))
+
+        yield self.materialize(row).metadata
+        for reference_row in rows:
+            yield self.materialize(reference_row).metadata
+
+    def materialize(self, row):
+        """Build the entity object stored at a row.  Scopes are built
+        without their children.
+
+        Returns:
+          Module, Class, Function, Variable, Reference or Import
+        """
+        kind = self.kinds[row]
+        name = self.strings[self.names[row]]
+        source_location = SourceLocation(self._filename(row), *_unpack(self.starts[row]), *_unpack(self.ends[row]))
+        if kind in (KIND_VARIABLE, KIND_REFERENCE):
+            return KIND_TYPES[kind](name, source_location)
+
+        if kind == KIND_IMPORT:
+            return Import(name, self.strings[self.targets[row]], source_location)
+
+        docstring, arguments = self.details[row]
+        return KIND_TYPES[kind](name, arguments, docstring, source_location)
+
+    def _lookup_definition_row(self, filename, line_number, column_offset, follow_imports=True):
+        row = self.lookup_row(filename, line_number, column_offset)
+        if row is not None and self.kinds[row] == KIND_REFERENCE:
+            row = self._find_definition_row(self.targets[row])
+
+        # Follow imports for as long as their targets are in the index.
+        seen = set()
+        while follow_imports and row is not None and self.kinds[row] == KIND_IMPORT and row not in seen:
+            seen.add(row)
+            target_row = self._find_definition_row(self.targets[row])
+            if target_row is None:
+                break
+
+            row = target_row
+
+        return row
+
+    def _module_id(self, filename):
+        return self.modules.get(find_qualified_name(filename))
+
+    def _find_definition_row(self, name_id):
+        i = bisect_left(self.definition_names, name_id)
+        if i == len(self.definition_names) or self.definition_names[i] != name_id:
+            return None
+        return self.definition_rows[i]
+
+    def _filename(self, row):
+        module_id = bisect_right(self.module_rows, row) - 1
+        return self.strings[self.module_filenames[module_id]]
+
+
+def _unpack(position):
+    return position >> _COLUMN_BITS, position & _COLUMN_MASK
@@ -1,15 +1,105 @@
 import os
+import pickle
+import sys
 
 
 VCS_DIRNAMES = (".git", ".hg")
 
+#: Directories that never contain project sources.
+IGNORED_DIRNAMES = frozenset(("__pycache__", "node_modules", "venv", "site-packages"))
 
-def find_vc_root(filename, max_iterations=5):
+#: Subdirectories of a vc root that are automatically treated as
+#: source roots when they exist (eg. for "src" layouts).
+SOURCE_DIRNAMES = ("src",)
+
+#: Maps directories to their vc roots (or to None if they don't have one).
+_vc_roots = {}
+
+#: Maps module filenames to their fully qualified names.
+_qualified_names = {}
+
+#: Additional source roots registered through add_source_root.
+_source_roots = []
+
+
+class CopyOnWrite:
+    """A base for indexes made up of containers of containers that can
+    be copied cheaply: a copy shares every container with the original
+    and each of them copies a shared container before it first mutates
+    it.  Subclasses keep the ids of the containers they created since
+    they were last copied in `_owned` and reset it when they're copied.
+    """
+
+    def _writable(self, mapping, key, factory):
+        # Containers created since the last copy are tracked in _owned
+        # and may be mutated in place.  Any other container may be
+        # shared, so it's replaced by a private copy before it is
+        # mutated.
+        container = mapping.get(key)
+        if container is None:
+            container = mapping[key] = factory()
+        elif id(container) in self._owned:
+            return container
+        else:
+            container = mapping[key] = factory(container)
+
+        self._owned.add(id(container))
+        return container
+
+
+def add_source_root(path):
+    """Register a directory as a source root.  Modules under a source
+    root are named relative to it rather than to their vc root.
+
+    Parameters:
+      path(str)
+    """
+    path = os.path.abspath(path)
+    if path not in _source_roots:
+        _source_roots.append(path)
+        _qualified_names.clear()
+
+
+def remove_source_root(path):
+    """Unregister a directory registered through add_source_root.
+
+    Parameters:
+      path(str)
+    """
+    path = os.path.abspath(path)
+    if path in _source_roots:
+        _source_roots.remove(path)
+        _qualified_names.clear()
+
+
+def invalidate_caches(path=None):
+    """Forget the cached vc roots and qualified names of everything
+    under path, or of everything if path is not provided.  Call this
+    after creating or removing vc roots, source roots or packages.
+
+    Parameters:
+      path(str)
+    """
+    if path is None:
+        _vc_roots.clear()
+        _qualified_names.clear()
+        return
+
+    path = os.path.abspath(path)
+    prefix = os.path.join(path, "")
+    for cache in (_vc_roots, _qualified_names):
+        for key in [key for key in cache if key == path or key.startswith(prefix)]:
+            cache.pop(key, None)
+
+
+def find_vc_root(filename, max_iterations=None):
     """Given the filename of a Python module, find its version control root.
+    Results are cached per directory.
 
     Parameters:
       filename(str)
-      max_iterations(int)
+      max_iterations(int): The maximum number of directories to look
+        at.  There is no limit by default.
 
     Raises:
       ValueError: If no vc root can be found.
@@ -17,26 +107,84 @@ def find_vc_root(filename, max_iterations=5):
     Returns:
       str
     """
-    current_dir = os.path.dirname(filename)
-    while True:
-        files = os.listdir(current_dir)
-        for dirname in VCS_DIRNAMES:
-            if dirname in files:
-                return current_dir
+    current_dir = os.path.dirname(os.path.abspath(filename))
+    try:
+        vc_root = _vc_roots[current_dir]
+    except KeyError:
+        vc_root = _find_vc_root(current_dir, max_iterations)
+
+    if vc_root is None:
+        raise ValueError("Could not find version control root.")
+    return vc_root
+
+
+def _find_vc_root(start_dir, max_iterations):
+    visited, current_dir, vc_root = [], start_dir, None
+    while max_iterations is None or len(visited) < max_iterations:
+        try:
+            vc_root = _vc_roots[current_dir]
+            break
+        except KeyError:
+            pass
+
+        visited.append(current_dir)
+        if any(os.path.exists(os.path.join(current_dir, dirname)) for dirname in VCS_DIRNAMES):
+            vc_root = current_dir
+            break
+
+        parent_dir = os.path.dirname(current_dir)
+        if parent_dir == current_dir:
+            break
+
+        current_dir = parent_dir
+    else:
+        # Giving up early says nothing about the directories that
+        # weren't looked at so nothing is cached.
+        return None
+
+    for directory in visited:
+        _vc_roots[directory] = vc_root
+
+    return vc_root
+
+
+def find_source_root(filename, max_iterations=None):
+    """Given the filename of a Python module, find the directory its
+    fully qualified name is relative to.  That is the innermost source
+    root containing the file, which is either one registered through
+    add_source_root, a "src" directory directly under the vc root or
+    the vc root itself.
+
+    Parameters:
+      filename(str)
+      max_iterations(int): See find_vc_root.
+
+    Raises:
+      ValueError: If no source root can be found.
+
+    Returns:
+      str
+    """
+    filename = os.path.abspath(filename)
+    candidates = [root for root in _source_roots if filename.startswith(os.path.join(root, ""))]
+    if not candidates:
+        vc_root = find_vc_root(filename, max_iterations)
+        candidates.append(vc_root)
+        for dirname in SOURCE_DIRNAMES:
+            source_dir = os.path.join(vc_root, dirname)
+            if filename.startswith(os.path.join(source_dir, "")):
+                candidates.append(source_dir)
 
-        current_dir = os.path.dirname(current_dir)
-        max_iterations -= 1
-        if max_iterations == 0:
-            raise ValueError("Could not find version control root.")
+    return max(candidates, key=len)
 
 
-def find_qualified_name(filename, max_iterations=5):
+def find_qualified_name(filename, max_iterations=None):
     """Given the filename of a Python module, find its fully qualified
-    module name.
+    module name.  Results are cached per filename.
 
     Parameters:
       filename(str)
-      max_iterations(int)
+      max_iterations(int): See find_vc_root.
 
     Raises:
       ValueError: If no vc root can be found.
@@ -45,8 +193,157 @@ def find_qualified_name(filename, max_iterations=5):
       str
     """
     filename = os.path.abspath(filename)
-    vc_root = find_vc_root(filename, max_iterations)
-    _, name = filename.split(f"{vc_root}/")
+    try:
+        return _qualified_names[filename]
+    except KeyError:
+        root = find_source_root(filename, max_iterations)
+        name = _qualified_names[filename] = qualified_name_from_root(root, filename)
+        return name
+
+
+def qualified_name_from_root(root, filename):
+    """Given a source root and the filename of a Python module under
+    it, find the module's fully qualified name.  Package modules
+    (__init__.py files) are named after their package.
+
+    Parameters:
+      root(str)
+      filename(str)
+
+    Returns:
+      str
+    """
+    name = os.path.relpath(filename, root)
     if name.endswith(".py"):
         name = name[:-3]
-    return name.replace("/", ".")
+
+    name = name.replace(os.sep, ".")
+    if name.endswith(".__init__"):
+        name = name[:-len(".__init__")]
+    return name
+
+
+def find_module_search_path(filename):
+    """Given the filename of a Python module, find the directories
+    that the modules it imports should be looked up in: its own source
+    root, every registered source root and then sys.path.
+
+    Parameters:
+      filename(str)
+
+    Returns:
+      list[str]
+    """
+    search_path = []
+    try:
+        search_path.append(find_source_root(filename))
+    except ValueError:
+        pass
+
+    for path in _source_roots + sys.path:
+        path = os.path.abspath(path or os.curdir)
+        if path not in search_path and os.path.isdir(path):
+            search_path.append(path)
+
+    return search_path
+
+
+def find_module_file(module_name, search_path):
+    """Find the file that defines a module by looking for it in each
+    directory on a search path, the way the import system would.
+
+    Parameters:
+      module_name(str)
+      search_path(list[str])
+
+    Returns:
+      str: The module's filename or None if it can't be found.
+    """
+    relative_path = os.path.join(*module_name.split("."))
+    for path in search_path:
+        for candidate in (f"{relative_path}.py", os.path.join(relative_path, "__init__.py")):
+            filename = os.path.join(path, candidate)
+            if os.path.isfile(filename):
+                return filename
+
+    return None
+
+
+def is_source_dirname(dirname):
+    """Check whether a directory may contain project sources, ie. that
+    it is neither hidden nor one of IGNORED_DIRNAMES.
+
+    Parameters:
+      dirname(str): The name of the directory, without its parent.
+
+    Returns:
+      bool
+    """
+    return not dirname.startswith(".") and dirname not in IGNORED_DIRNAMES
+
+
+def find_python_files(root):
+    """Find all the Python files under a directory, skipping hidden
+    directories and directories that never contain project sources.
+
+    Parameters:
+      root(str)
+
+    Returns:
+      generator[str]: Absolute filenames, in a stable order.
+    """
+    for dirpath, dirnames, filenames in os.walk(os.path.abspath(root)):
+        dirnames[:] = sorted(dirname for dirname in dirnames if is_source_dirname(dirname))
+
+        for filename in sorted(filenames):
+            if filename.endswith(".py"):
+                yield os.path.join(dirpath, filename)
+
+
+def load_data(f, allowed):
+    """Unpickle the data kawa saved to an index file.  Unlike
+    pickle.load, this refuses files other users own and only loads
+    the classes in allowed, so that an index file planted in an
+    untrusted checkout can't run code when it's loaded.
+
+    Parameters:
+      f(file): A file opened in binary mode.
+      allowed(set[tuple[str, str]]): The (module, name) pairs of the
+        classes the data may contain.
+
+    Raises:
+      ValueError: If the file belongs to another user or refers to a
+        class that isn't allowed.
+
+    Returns:
+      object
+    """
+    if hasattr(os, "getuid") and os.fstat(f.fileno()).st_uid != os.getuid():
+        raise ValueError(f"{f.name} belongs to another user.")
+    return _DataUnpickler(f, allowed).load()
+
+
+def write_atomically(path, data):
+    """Write data to path such that readers either see the previous
+    contents of the file or all of data, never a partial write.
+
+    Parameters:
+      path(str)
+      data(bytes)
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+
+    os.replace(temp_path, path)
+
+
+class _DataUnpickler(pickle.Unpickler):
+    def __init__(self, f, allowed):
+        super().__init__(f)
+        self.allowed = allowed
+
+    def find_class(self, module, name):
+        if (module, name) not in self.allowed:
+            raise ValueError(f"{module}.{name} can't be loaded from an index.")
+        return super().find_class(module, name)
@@ -0,0 +1,243 @@
+"""A resident process that keeps a project's index in memory and
+answers lookups from short-lived CLI processes over a Unix socket.
+
+Every project (ie. every vc root) gets its own daemon, listening on a
+socket whose path is derived from the project's root.  Connections
+speak the same newline-delimited JSON-RPC protocol as `serve --stdio`.
+The CLI spawns a daemon the first time it's needed and answers that
+first lookup itself; later lookups are forwarded to the daemon so
+they don't pay for imports and indexing.  Daemons exit after they've
+been idle for a while.
+
+The CLI imports this module before anything else so it must stay
+cheap to import.  The indexer and the server are only imported by
+the daemon itself.
+"""
+import errno
+import json
+import os
+import socket
+import stat
+import sys
+import time
+import zlib
+
+#: The number of seconds a daemon waits for new connections before
+#: it exits.
+IDLE_TIMEOUT = 15 * 60
+
+
+def is_supported():
+    """Check whether daemons can be used on this platform.
+
+    Returns:
+      bool
+    """
+    return hasattr(socket, "AF_UNIX")
+
+
+def socket_path(root):
+    """Find the path of the socket the daemon for a project listens on.
+    Sockets live in a per-user directory under $XDG_RUNTIME_DIR or the
+    temporary directory that only its owner may access.  See
+    ensure_private_dir.
+
+    Parameters:
+      root(str): The project's vc root.
+
+    Returns:
+      str
+    """
+    root = os.path.abspath(root)
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp"
+    name = f"{os.path.basename(root)[:32]}-{zlib.crc32(os.fsencode(root)):08x}.sock"
+    return os.path.join(runtime_dir, f"kawa-{os.getuid()}", name)
+
+
+def request(path, method, params, connect_timeout=1.0):
+    """Send a single request to a daemon and wait for its response.
+
+    Parameters:
+      path(str): The daemon's socket.
+      method(str)
+      params(dict)
+      connect_timeout(float): The number of seconds to wait for the
+        daemon to accept the connection.  There's no limit on how long
+        the daemon may take to answer.
+
+    Raises:
+      OSError: If no daemon is listening on path, if it went away
+        before answering or if the socket's directory could have been
+        tampered with by another user.
+
+    Returns:
+      dict: The JSON-RPC response.
+    """
+    _check_private_dir(os.path.dirname(path))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(connect_timeout)
+        sock.connect(path)
+        sock.settimeout(None)
+        sock.sendall(json.dumps({"jsonrpc": "2.0", "id": 1, "method": method, "params": params}).encode() + b"\n")
+        with sock.makefile("rb") as infile:
+            line = infile.readline()
+
+    if not line:
+        raise ConnectionResetError(errno.ECONNRESET, "The daemon closed the connection.")
+    return json.loads(line)
+
+
+def spawn(root):
+    """Start a daemon for a project in the background.  The daemon
+    exits right away if another one is already listening.
+
+    Parameters:
+      root(str): The project's vc root.
+    """
+    import subprocess
+
+    subprocess.Popen(
+        [sys.executable, "-m", "kawa", "daemon", root],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def serve_daemon(indexer, root, idle_timeout=IDLE_TIMEOUT):
+    """Answer requests for a project on its socket until no new
+    connections or requests have come in for idle_timeout seconds.
+
+    Parameters:
+      indexer(Indexer)
+      root(str): The project's vc root.
+      idle_timeout(float)
+
+    Raises:
+      PermissionError: If the socket's directory isn't private.  See
+        ensure_private_dir.
+
+    Returns:
+      bool: False if another daemon is already serving the project.
+    """
+    import threading
+
+    from .server import serve_stdio
+
+    path = socket_path(root)
+    ensure_private_dir(os.path.dirname(path))
+    listener = _listen(path)
+    if listener is None:
+        return False
+
+    def serve_connection(connection):
+        with connection, \
+                connection.makefile("r", encoding="utf-8") as infile, \
+                connection.makefile("w", encoding="utf-8") as outfile:
+            serve_stdio(indexer, infile, outfile, lock)
+
+    lock = _ActivityLock(threading.Lock())
+    inode = os.stat(path).st_ino
+    try:
+        listener.settimeout(min(1.0, idle_timeout))
+        while lock.is_busy() or time.monotonic() - lock.last_activity < idle_timeout:
+            try:
+                connection, _ = listener.accept()
+            except socket.timeout:
+                continue
+
+            lock.last_activity = time.monotonic()
+            threading.Thread(target=serve_connection, args=(connection,), daemon=True).start()
+    finally:
+        listener.close()
+        # A daemon that replaced this one's socket file owns it now.
+        if _inode_of(path) == inode:
+            os.unlink(path)
+
+    return True
+
+
+def ensure_private_dir(path):
+    """Create the directory sockets live in unless it exists and make
+    sure that no other user could have created or altered it: since
+    the directory lives somewhere everybody can write to, another user
+    may have created it first in order to listen in on or answer
+    lookups.
+
+    Parameters:
+      path(str)
+
+    Raises:
+      PermissionError: If the directory is a symlink or not a
+        directory, if it's owned by another user or if anybody else
+        has access to it.
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    except FileExistsError:
+        pass  # It's not a directory, which _check_private_dir reports.
+
+    _check_private_dir(path)
+
+
+def _check_private_dir(path):
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) != 0o700:
+        raise PermissionError(errno.EACCES, "Refusing to use a socket directory that isn't private (mode 0700).", path)
+
+
+def _listen(path):
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            listener.bind(path)
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE or _is_listening(path):
+                listener.close()
+                return None
+
+            # The daemon that created the socket file died without
+            # removing it.
+            os.unlink(path)
+            listener.bind(path)
+
+        listener.listen()
+        return listener
+    except OSError:
+        listener.close()
+        raise
+
+
+def _is_listening(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+def _inode_of(path):
+    try:
+        return os.stat(path).st_ino
+    except OSError:
+        return None
+
+
+class _ActivityLock:
+    # Serializes requests like a plain lock and records when the last
+    # one was handled, so that clients that keep a connection open and
+    # send requests over it keep the daemon from going idle.
+    def __init__(self, lock):
+        self.lock = lock
+        self.last_activity = time.monotonic()
+
+    def is_busy(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.last_activity = time.monotonic()
+
+    def __exit__(self, *exc_info):
+        self.last_activity = time.monotonic()
+        self.lock.release()
@@ -0,0 +1,637 @@
+"""An index stored in a SQLite database.
+
+Every entity in every module is a row in a single table that is
+indexed by name, by module and by position, so lookups only ever touch
+the rows they need and the index doesn't have to fit in memory.  The
+database is opened in WAL mode: any number of kawa processes (eg. an
+editor's server and a command line run) can read from it while one of
+them updates it, and every file is updated in its own transaction.
+
+References store the names they resolve to.  Whenever a module's
+definitions change, the references that could resolve to the names
+that appeared or went away are resolved again in the same transaction.
+"""
+import json
+import os
+import sqlite3
+import warnings
+
+from contextlib import contextmanager
+
+from .analyzer import Import, Reference, Scope, SourceLocation
+from .columnar import KIND_CLASS, KIND_IMPORT, KIND_MODULE, KIND_REFERENCE, KIND_TYPES, KINDS, KIND_VARIABLE
+from .common import find_module_file, find_module_search_path, find_qualified_name
+from .indexer import FileStamp, TemplateCache, _modules_under, analyze_file, timed
+from .stats import Stats
+
+#: The version of the database schema.  Bump this whenever the schema
+#: or the meaning of its columns changes.
+SCHEMA_VERSION = 1
+
+SCHEMA = f"""
+CREATE TABLE modules (
+    name TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+
+CREATE INDEX modules_by_filename ON modules (filename);
+
+CREATE TABLE entities (
+    id INTEGER PRIMARY KEY,
+    module TEXT NOT NULL,
+    kind INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    basename TEXT NOT NULL,
+    target TEXT,
+    arguments TEXT,
+    docstring TEXT,
+    line INTEGER NOT NULL,
+    "column" INTEGER NOT NULL,
+    end_line INTEGER NOT NULL,
+    end_column INTEGER NOT NULL
+);
+
+CREATE INDEX entities_by_name ON entities (name);
+CREATE INDEX entities_by_module ON entities (module);
+CREATE INDEX entities_by_position ON entities (module, line, "column", end_line DESC, end_column DESC);
+CREATE INDEX references_by_target ON entities (target) WHERE kind = {KIND_REFERENCE};
+CREATE INDEX references_by_basename ON entities (basename, name) WHERE kind = {KIND_REFERENCE};
+
+PRAGMA user_version = {SCHEMA_VERSION};
+"""
+
+_SELECT_ENTITIES = (
+    'SELECT e.id, m.filename, e.kind, e.name, e.target, e.arguments, e.docstring,'
+    ' e.line, e."column", e.end_line, e.end_column'
+    " FROM entities AS e JOIN modules AS m ON m.name = e.module"
+)
+_SCOPE_KINDS = tuple(kind for kind, entity_type in KIND_TYPES.items() if issubclass(entity_type, Scope))
+
+
+class SQLiteIndex:
+    """An index backed by a SQLite database with the same lookup API
+    as Indexer.  Function bodies are always analyzed up front.
+
+    Attributes:
+      path(str)
+      connection(sqlite3.Connection)
+      stats(Stats): Instrumentation for this process' use of the index.
+      templates(TemplateCache): The analyses of duplicated sources.
+
+    Parameters:
+      path(str): The database file.  It is created if it doesn't exist.
+      timeout(float): How long to wait, in seconds, for another
+        process to finish updating the database.
+
+    Raises:
+      ValueError: If the file was written by an incompatible version
+        of kawa.
+    """
+
+    lazy = False
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.stats = Stats()
+        self.templates = TemplateCache()
+        self.environments = []
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        with self._transaction():
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0:
+                for statement in SCHEMA.split(";"):
+                    self.connection.execute(statement)
+            elif version != SCHEMA_VERSION:
+                raise ValueError(f"{path} uses schema version {version} but {SCHEMA_VERSION} is required.")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def module_names(self):
+        """list[str]: The names of every indexed module.
+        """
+        return [name for name, in self.connection.execute("SELECT name FROM modules ORDER BY name")]
+
+    def attach(self, environment):
+        """Attach a prebuilt environment index.  See Indexer.attach.
+
+        Parameters:
+          environment(Environment)
+        """
+        self.environments.append(environment)
+
+    def index_file(self, filename, module_name=None):
+        """Add a file to the index.
+
+        Parameters:
+          filename(str)
+        """
+        self.add_module(*analyze_file(filename, module_name, self.stats, templates=self.templates))
+
+    def add_module(self, module, stamp):
+        """Add an analyzed module to the index.
+
+        Parameters:
+          module(Module)
+          stamp(FileStamp)
+        """
+        self.add_modules([(module, stamp)])
+
+    def add_modules(self, analyzed_modules):
+        """Add many analyzed modules to the index.  Every module is
+        replaced in its own transaction.
+
+        Parameters:
+          analyzed_modules(iterable[tuple[Module, FileStamp]])
+        """
+        for module, stamp in analyzed_modules:
+            self._update_module(module.name, module, stamp)
+
+    def remove_module(self, module_name):
+        """Remove a module and everything it defines from the index.
+
+        Parameters:
+          module_name(str)
+        """
+        self._update_module(module_name, None, None)
+
+    def update_files(self, analyzed_modules, removed_paths=()):
+        """Add or replace the analyzed modules and drop every module
+        whose file was, or was under, one of the removed paths and no
+        longer exists.  See Indexer.update_files.
+
+        Parameters:
+          analyzed_modules(iterable[tuple[Module, FileStamp]])
+          removed_paths(iterable[str]): Files or directories.
+        """
+        self.add_modules(analyzed_modules)
+        stamps = {
+            name: FileStamp(*stamp)
+            for name, *stamp in self.connection.execute("SELECT name, filename, mtime, size, digest FROM modules")
+        }
+        for module_name in _modules_under(stamps, removed_paths):
+            self.remove_module(module_name)
+
+    def stamp_of(self, module_name):
+        """Returns:
+          FileStamp: The stamp of an indexed module or None.
+        """
+        row = self.connection.execute(
+            "SELECT filename, mtime, size, digest FROM modules WHERE name = ?", (module_name,),
+        ).fetchone()
+        return row and FileStamp(*row)
+
+    def needs_indexing(self, filename, module_name=None):
+        """Check whether a file is missing from the index or has
+        changed on disk since it was indexed.
+
+        Parameters:
+          filename(str)
+
+        Returns:
+          bool
+        """
+        filename = os.path.abspath(filename)
+        module_name = module_name or self.module_name_of(filename)
+        stamp = self.stamp_of(module_name)
+        return stamp is None or stamp.filename != filename or self._refresh_stamp(module_name, stamp) is None
+
+    def ensure_indexed(self, filename, module_name=None):
+        """Index a file unless it is already indexed and hasn't changed
+        on disk since.
+
+        Parameters:
+          filename(str)
+
+        Returns:
+          bool: True if the file had to be (re)indexed.
+        """
+        filename = os.path.abspath(filename)
+        module_name = module_name or self.module_name_of(filename)
+        if not self.needs_indexing(filename, module_name):
+            self.stats.hit("stamps")
+            return False
+
+        self.stats.miss("stamps")
+        self.index_file(filename, module_name)
+        return True
+
+    def refresh(self):
+        """Re-index every module whose file changed on disk since it
+        was indexed and drop the ones whose files were removed.
+
+        Returns:
+          list[str]: The names of the modules that were updated.
+        """
+        updated = []
+        rows = self.connection.execute("SELECT name, filename, mtime, size, digest FROM modules").fetchall()
+        for name, *stamp in rows:
+            if self._refresh_stamp(name, FileStamp(*stamp)) is not None:
+                continue
+
+            if os.path.exists(stamp.filename):
+                self.index_file(stamp.filename, name)
+            else:
+                self.remove_module(name)
+
+            updated.append(name)
+
+        return updated
+
+    def _refresh_stamp(self, module_name, stamp):
+        fresh = stamp.refreshed()
+        if fresh is not None and fresh is not stamp and not self.connection.in_transaction:
+            self.connection.execute(
+                "UPDATE modules SET mtime = ?, size = ? WHERE name = ? AND digest = ?",
+                (fresh.mtime, fresh.size, module_name, fresh.digest),
+            )
+        return fresh
+
+    def module_name_of(self, filename):
+        """Find the name of the module a file defines.  Files that are
+        already indexed keep the name they were indexed under.
+
+        Returns:
+          str
+        """
+        filename = os.path.abspath(filename)
+        row = self.connection.execute("SELECT name FROM modules WHERE filename = ? LIMIT 1", (filename,)).fetchone()
+        return row[0] if row else find_qualified_name(filename)
+
+    def lookup_entity(self, filename, line_number, column_offset):
+        """Look up the innermost entity at a given location.
+
+        Returns:
+          An object representing the entity or None.
+        """
+        module_name = self._ensure_module(filename)
+        row = self.connection.execute(
+            f"{_SELECT_ENTITIES}"
+            ' WHERE e.module = ? AND (e.line, e."column") <= (?, ?) AND (e.end_line, e.end_column) > (?, ?)'
+            ' ORDER BY e.line DESC, e."column" DESC, e.end_line, e.end_column LIMIT 1',
+            (module_name, line_number, column_offset, line_number, column_offset),
+        ).fetchone()
+        return row and self._materialize(row)
+
+    @timed("lookup.range")
+    def lookup_entities_between(self, filename, first_line, last_line):
+        """Look up every entity that overlaps a range of lines along
+        with the entities that enclose them.
+
+        Returns:
+          A list of entities in source order.
+        """
+        module_name = self._ensure_module(filename)
+        rows = self.connection.execute(
+            f"{_SELECT_ENTITIES}"
+            ' WHERE e.module = ? AND e.line <= ? AND (e.line >= ? OR (e.end_line, e.end_column) > (?, 0))'
+            ' ORDER BY e.line, e."column", e.end_line DESC, e.end_column DESC, e.id',
+            (module_name, last_line, first_line, first_line),
+        )
+        return [self._materialize(row) for row in rows]
+
+    @timed("lookup.metadata")
+    def lookup_metadata(self, filename, line_number, column_offset):
+        """Look up the metadata of an entity.
+
+        Returns:
+          A dictionary describing the entity or None.
+        """
+        entity = self.lookup_entity(filename, line_number, column_offset)
+        if not entity:
+            return None
+        return entity.metadata
+
+    @timed("lookup.definition")
+    def lookup_definition(self, filename, line_number, column_offset, locate_imports=True):
+        """Look up the definition of an entity.  Imported names are
+        followed to the definitions they import.
+
+        Parameters:
+          locate_imports(bool): Whether or not to find and index the
+            modules imported names come from when they aren't indexed
+            yet.
+
+        Returns:
+          A dictionary describing where the entity is defined or None.
+        """
+        entity = self.lookup_entity(filename, line_number, column_offset)
+        with self._reading():
+            entity = self._follow_imports(self._definition_of(entity))
+
+        attempted = set()
+        while locate_imports and isinstance(entity, Import):
+            located = self.locate_import(entity)
+            if located is None or located in attempted:
+                break
+
+            attempted.add(located)
+            if self.index_located_module(*located):
+                with self._reading():
+                    entity = self._follow_imports(entity)
+
+        return entity and entity.metadata
+
+    def locate_import(self, entity):
+        """Find the module that defines the target of an import, unless
+        it is already indexed.
+
+        Parameters:
+          entity(Import)
+
+        Returns:
+          tuple[str, str]: The module's filename and name or None.
+        """
+        search_path = None
+        module_name = entity.target
+        while module_name:
+            if self.stamp_of(module_name) is not None:
+                return None
+
+            search_path = search_path or find_module_search_path(entity.source_location.filename)
+            filename = find_module_file(module_name, search_path)
+            if filename is not None:
+                return filename, module_name
+
+            module_name = module_name.rpartition(".")[0]
+
+        return None
+
+    def index_located_module(self, filename, module_name):
+        """Index a module found by locate_import.  Modules that can't be
+        analyzed are skipped.
+
+        Returns:
+          bool: True if the module was indexed.
+        """
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                self.index_file(filename, module_name)
+        except (OSError, SyntaxError, UnicodeDecodeError, ValueError, RecursionError):
+            return False
+
+        self.stats.count("imports.located")
+        return True
+
+    @timed("lookup.references")
+    def lookup_references(self, filename, line_number, column_offset):
+        """Look up the list of references of an entity.
+
+        Returns:
+          A list of dictionaries describing the references to the entity.
+        """
+        return list(self.iter_references(filename, line_number, column_offset))
+
+    def iter_references(self, filename, line_number, column_offset, by_file=False):
+        """Like lookup_references, but describe the references one at
+        a time.  The references are read from a single snapshot of the
+        database, which is closed before the first one is produced.
+        See Indexer.iter_references.
+
+        Returns:
+          generator[dict]
+        """
+        entity = self.lookup_entity(filename, line_number, column_offset)
+        with self._reading():
+            entity = self._definition_of(entity)
+            if entity is None:
+                return
+
+            # The connection is shared with writers, so the snapshot is
+            # read in full rather than kept open for as long as the
+            # caller takes to consume the references.
+            order = 'm.filename, e.line, e."column"' if by_file else "e.id"
+            rows = self.connection.execute(
+                f"{_SELECT_ENTITIES} WHERE e.kind = ? AND e.target = ? ORDER BY {order}",
+                (KIND_REFERENCE, entity.name),
+            ).fetchall()
+
+        yield entity.metadata
+        for row in rows:
+            yield self._materialize(row).metadata
+
+    def _ensure_module(self, filename):
+        module_name = self.module_name_of(filename)
+        if self.stamp_of(module_name) is None:
+            self.index_file(filename, module_name)
+        return module_name
+
+    def _definition_of(self, entity):
+        if not isinstance(entity, Reference):
+            return entity
+
+        module_name = self.module_name_of(entity.source_location.filename)
+        row = self.connection.execute(
+            f"{_SELECT_ENTITIES} WHERE e.name = ? AND e.module = ? AND e.kind != ? ORDER BY e.id DESC LIMIT 1",
+            (entity.name, module_name, KIND_REFERENCE),
+        ).fetchone()
+        if row is None:
+            target, = self.connection.execute(
+                "SELECT target FROM entities WHERE module = ? AND kind = ? AND name = ? LIMIT 1",
+                (module_name, KIND_REFERENCE, entity.name),
+            ).fetchone()
+            return self._find_definition(target)
+        return self._materialize(row)
+
+    def _follow_imports(self, entity):
+        # Follow chains of re-exports for as long as their targets are
+        # indexed, stopping at the first cycle.
+        seen = set()
+        while isinstance(entity, Import) and entity.name not in seen:
+            seen.add(entity.name)
+            target = self._find_definition(entity.target)
+            if target is None:
+                break
+
+            entity = target
+
+        if isinstance(entity, Import):
+            for environment in self.environments:
+                target = environment.lookup_name(entity.target)
+                if target is not None:
+                    self.stats.count("imports.environment")
+                    return target
+
+        return entity
+
+    def _find_definition(self, name):
+        # Later definitions of a name win, as they do in the Indexer.
+        row = self.connection.execute(
+            f"{_SELECT_ENTITIES} WHERE e.name = ? AND e.kind != ? ORDER BY e.id DESC LIMIT 1",
+            (name, KIND_REFERENCE),
+        ).fetchone()
+        return row and self._materialize(row)
+
+    @timed("index")
+    def _update_module(self, module_name, module, stamp):
+        execute = self.connection.execute
+        with self._transaction():
+            old_definitions = dict(execute(
+                "SELECT name, kind FROM entities WHERE module = ? AND kind != ?", (module_name, KIND_REFERENCE),
+            ).fetchall())
+            execute("DELETE FROM entities WHERE module = ?", (module_name,))
+            execute("DELETE FROM modules WHERE name = ?", (module_name,))
+
+            new_definitions = {}
+            if module is not None:
+                execute("INSERT INTO modules VALUES (?, ?, ?, ?, ?)", (module_name, *stamp))
+                rows = []
+                for entity in module.flatten():
+                    kind = KINDS[type(entity)]
+                    if kind != KIND_REFERENCE:
+                        new_definitions[entity.name] = kind
+
+                    rows.append(_row(module_name, kind, entity))
+
+                self.connection.executemany(
+                    "INSERT INTO entities"
+                    " (module, kind, name, basename, target, arguments, docstring,"
+                    ' line, "column", end_line, end_column)'
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+
+            # Definitions that appeared or disappeared, as well as the
+            # names bound inside of scopes that changed kind, can change
+            # what existing references resolve to.
+            changed_names = old_definitions.keys() ^ new_definitions.keys()
+            for name, kind in old_definitions.items():
+                if kind in _SCOPE_KINDS and new_definitions.get(name, kind) != kind:
+                    prefix = f"{name}."
+                    changed_names.update(
+                        n for n in old_definitions.keys() | new_definitions.keys() if n.startswith(prefix)
+                    )
+
+            resolved = {}
+            references = execute(
+                "SELECT id, name FROM entities WHERE module = ? AND kind = ?", (module_name, KIND_REFERENCE),
+            ).fetchall()
+            updates = [(self._resolve_reference(name, resolved), reference_id) for reference_id, name in references]
+            for name in changed_names:
+                scope, _, basename = name.rpartition(".")
+                if scope:
+                    candidates = execute(
+                        "SELECT id, name, target FROM entities"
+                        " WHERE kind = ? AND basename = ? AND name > ? AND name < ? AND module != ?",
+                        (KIND_REFERENCE, basename, f"{scope}.", f"{scope}/", module_name),
+                    )
+                else:
+                    candidates = execute(
+                        "SELECT id, name, target FROM entities WHERE kind = ? AND basename = ? AND module != ?",
+                        (KIND_REFERENCE, basename, module_name),
+                    )
+
+                for reference_id, reference_name, old_target in candidates.fetchall():
+                    target = self._resolve_reference(reference_name, resolved)
+                    if target != old_target:
+                        updates.append((target, reference_id))
+
+            self.connection.executemany("UPDATE entities SET target = ? WHERE id = ?", updates)
+
+    def _resolve_reference(self, name, resolved):
+        try:
+            return resolved[name]
+        except KeyError:
+            scope, _, basename = name.rpartition(".")
+            resolved[name] = target = self._resolve_name(scope, basename)
+            return target
+
+    def _resolve_name(self, scope, basename):
+        # The same LEGB rules as Indexer._resolve_name, answered with
+        # queries against the name index.
+        execute, nested, counters = self.connection.execute, False, self.stats.counters
+        while scope:
+            counters["resolver.probes"] += 1
+            row = execute(
+                f"SELECT kind FROM entities WHERE name = ? AND kind IN {_SCOPE_KINDS} ORDER BY id DESC LIMIT 1",
+                (scope,),
+            ).fetchone()
+            if row is None:
+                break
+
+            kind = row[0]
+            if not (nested and kind == KIND_CLASS) and execute(
+                "SELECT 1 FROM entities WHERE name = ? AND kind NOT IN (?, ?) LIMIT 1",
+                (f"{scope}.{basename}", KIND_MODULE, KIND_REFERENCE),
+            ).fetchone():
+                return f"{scope}.{basename}"
+
+            scope, nested = scope.rpartition(".")[0], True
+            if kind == KIND_MODULE:
+                break
+
+        while scope:
+            counters["resolver.probes"] += 1
+            name = f"{scope}.{basename}"
+            query = "SELECT 1 FROM entities WHERE name = ? AND kind != ? LIMIT 1"
+            if execute(query, (name, KIND_REFERENCE)).fetchone():
+                return name
+
+            scope = scope.rpartition(".")[0]
+
+        return basename
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so that two
+        # writers can't both read and then fail to upgrade their locks.
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        else:
+            self.connection.execute("COMMIT")
+
+    @contextmanager
+    def _reading(self):
+        # Lookups that take more than one query read from a single
+        # snapshot of the database.
+        if self.connection.in_transaction:
+            yield
+            return
+
+        self.connection.execute("BEGIN")
+        try:
+            yield
+        finally:
+            self.connection.execute("COMMIT")
+
+    def _materialize(self, row):
+        _, filename, kind, name, target, arguments, docstring, *position = row
+        source_location = SourceLocation(filename, *position)
+        if kind in (KIND_VARIABLE, KIND_REFERENCE):
+            return KIND_TYPES[kind](name, source_location)
+
+        if kind == KIND_IMPORT:
+            return Import(name, target, source_location)
+
+        return KIND_TYPES[kind](name, arguments and json.loads(arguments), docstring, source_location)
+
+
+def _row(module_name, kind, entity):
+    target = arguments = docstring = None
+    if kind == KIND_IMPORT:
+        target = entity.target
+    elif kind not in (KIND_VARIABLE, KIND_REFERENCE):
+        arguments = None if entity.arguments is None else json.dumps(entity.arguments)
+        docstring = entity.docstring
+
+    return (
+        module_name, kind, entity.name, entity.name.rpartition(".")[2], target, arguments, docstring,
+        *entity.source_location[1:],
+    )
@@ -0,0 +1,555 @@
+"""Prebuilt, read-only indexes of the standard library and of the
+distributions installed in an interpreter's environment.
+
+Every distribution (the standard library counts as one, named
+"python") is indexed once into its own file, keyed by its name, its
+version and the interpreter's cache tag, so environments that share a
+distribution also share its index.  Index files are memory-mapped
+rather than loaded: their columns are used in place, so every process
+on a machine that attaches the same index shares the same pages.
+
+A manifest per interpreter lists the indexes that make up its
+environment.  Run `python -m kawa index-env` to (re)build them after
+installing or upgrading distributions.
+"""
+import json
+import mmap
+import os
+import re
+import sys
+import zlib
+
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from .columnar import KIND_IMPORT, CompactIndex
+from .common import qualified_name_from_root, write_atomically
+
+ENV_FORMAT_VERSION = 1
+ENV_FORMAT_MAGIC = b"KAWE"
+
+#: Standard library directories that aren't worth indexing.
+STDLIB_IGNORED_DIRNAMES = frozenset(("__pycache__", "dist-packages", "idlelib", "site-packages", "test", "turtledemo"))
+
+_ALIGNMENT = 8
+
+
+class Distribution(namedtuple("Distribution", ("name", "version", "root", "filenames"))):
+    """An installed distribution.  Filenames are relative to root,
+    the directory the distribution's top-level modules live in.
+    """
+
+    @property
+    def key(self):
+        version = re.sub(r"[^\w.+]+", "_", self.version)
+        return f"{self.name}-{version}-{sys.implementation.cache_tag}"
+
+
+class MappedIndex(CompactIndex):
+    """A CompactIndex of a single distribution that is backed by a
+    memory-mapped file.  Use MappedIndex.open to open one.
+
+    Attributes:
+      distribution(str)
+      version(str)
+      root(str): The directory the distribution is installed in.
+        Filenames are stored relative to it.
+      packages(list[str]): The top-level modules and packages the
+        distribution provides.
+    """
+
+    @classmethod
+    def open(cls, path, root):
+        """Map an index written by write_index.
+
+        Parameters:
+          path(str)
+          root(str): The directory the distribution is installed in.
+
+        Raises:
+          ValueError: If the file is not an environment index or if it
+            was written by an incompatible version of kawa.
+
+        Returns:
+          MappedIndex
+        """
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if mapped[:len(ENV_FORMAT_MAGIC)] != ENV_FORMAT_MAGIC:
+            raise ValueError(f"{path} is not a kawa environment index.")
+
+        version = int.from_bytes(mapped[4:8], "big")
+        if version != ENV_FORMAT_VERSION:
+            raise ValueError(f"{path} uses environment format {version} but {ENV_FORMAT_VERSION} is required.")
+
+        header_size = int.from_bytes(mapped[8:16], "big")
+        header = json.loads(mapped[16:16 + header_size])
+        view, base = memoryview(mapped), _align(16 + header_size)
+        index = cls.__new__(cls)
+        index.distribution = header["distribution"]
+        index.version = header["version"]
+        index.packages = header["packages"]
+        index.root = root
+        for name, (typecode, offset, count) in header["sections"].items():
+            section = view[base + offset:base + offset + count * array(typecode).itemsize]
+            setattr(index, name, section.cast(typecode))
+
+        index.strings = _MappedStrings(index.string_offsets, index.string_data)
+        index.modules = _MappedModules(index.strings, index.module_names)
+        index.details = _MappedDetails(index.strings, index.docstrings, index.arguments)
+        return index
+
+    def find_definition_row(self, name):
+        """Find the row of the definition a name resolves to.
+
+        Parameters:
+          name(str)
+
+        Returns:
+          int or None
+        """
+        name_id = self.strings.find(name)
+        if name_id is None:
+            return None
+        return self._find_definition_row(name_id)
+
+    def _module_id(self, filename):
+        filename = os.path.abspath(filename)
+        if os.path.commonpath([self.root, filename]) != self.root:
+            return None
+        return self.modules.get(qualified_name_from_root(self.root, filename))
+
+    def _filename(self, row):
+        return os.path.join(self.root, super()._filename(row))
+
+
+class Environment:
+    """The indexes of the distributions installed in an environment.
+    Indexers look up the targets of imports in the environments that
+    are attached to them.  See Indexer.attach.
+
+    Parameters:
+      indexes(list[MappedIndex])
+    """
+
+    def __init__(self, indexes=()):
+        self.indexes = list(indexes)
+        self.indexes_by_package = {}
+        for index in self.indexes:
+            for package in index.packages:
+                self.indexes_by_package.setdefault(package, []).append(index)
+
+    @classmethod
+    def load(cls, cache_dir=None):
+        """Load the environment of the running interpreter, as built by
+        index_environment.  Indexes that are missing or unusable are
+        skipped.
+
+        Parameters:
+          cache_dir(str): Defaults to default_cache_dir().
+
+        Returns:
+          Environment
+        """
+        try:
+            entries = _read_manifest(manifest_path(cache_dir))
+        except (OSError, ValueError):
+            return cls()
+
+        indexes = []
+        for path, root in entries:
+            try:
+                indexes.append(MappedIndex.open(path, root))
+            except (OSError, ValueError):
+                continue
+
+        return cls(indexes)
+
+    def lookup_name(self, name):
+        """Find the definition of an FQN.  Imports are followed across
+        distributions and names that go through imported modules (eg.
+        "os.path.join") are looked up in the modules they import.
+
+        Parameters:
+          name(str)
+
+        Returns:
+          An object representing the definition, the last import that
+          couldn't be followed or None if the name isn't defined in any
+          of the indexes.
+        """
+        entity, seen = None, set()
+        while name not in seen:
+            seen.add(name)
+            found = self._find(name)
+            if found is None:
+                break
+
+            index, row, rest = found
+            if rest:
+                if index.kinds[row] != KIND_IMPORT:
+                    break
+
+                name = index.strings[index.targets[row]] + rest
+                continue
+
+            entity = index.materialize(row)
+            if index.kinds[row] != KIND_IMPORT:
+                break
+
+            name = entity.target
+
+        return entity
+
+    def _find(self, name):
+        # The longest prefix of the name that is defined somewhere wins.
+        indexes = self.indexes_by_package.get(name.partition(".")[0], ())
+        prefix = name
+        while prefix:
+            for index in indexes:
+                row = index.find_definition_row(prefix)
+                if row is not None:
+                    return index, row, name[len(prefix):]
+
+            prefix = prefix.rpartition(".")[0]
+
+        return None
+
+
+def default_cache_dir():
+    """Find the directory environment indexes are kept in:
+    $XDG_CACHE_HOME/kawa/env or ~/.cache/kawa/env.
+
+    Returns:
+      str
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "kawa", "env")
+
+
+def manifest_path(cache_dir=None):
+    """Find the path of the manifest of the running interpreter's
+    environment.
+
+    Returns:
+      str
+    """
+    prefix = os.path.abspath(sys.prefix)
+    name = f"{sys.implementation.cache_tag}-{zlib.crc32(os.fsencode(prefix)):08x}.json"
+    return os.path.join(cache_dir or default_cache_dir(), name)
+
+
+def find_distributions():
+    """Find the standard library and every distribution installed in
+    the running interpreter's environment.  Distributions that are
+    shadowed by an earlier one with the same name and distributions
+    that don't list their files are skipped.
+
+    Returns:
+      list[Distribution]
+    """
+    import sysconfig
+
+    from importlib.metadata import distributions
+
+    stdlib = sysconfig.get_paths()["stdlib"]
+    version = ".".join(map(str, sys.version_info[:3]))
+    found, seen = [Distribution("python", version, stdlib, _find_stdlib_files(stdlib))], {"python"}
+    for distribution in distributions():
+        name = distribution.metadata["Name"]
+        if not name or distribution.files is None:
+            continue
+
+        name = re.sub(r"[-_.]+", "-", name).lower()
+        if name in seen:
+            continue
+
+        seen.add(name)
+        filenames = sorted(
+            os.path.normpath(str(path)) for path in distribution.files
+            if path.suffix == ".py" and path.parts[0] != ".." and _is_module_path(path.parts)
+        )
+        if filenames:
+            root = os.path.abspath(str(distribution.locate_file("")))
+            found.append(Distribution(name, distribution.version, root, filenames))
+
+    return found
+
+
+def index_environment(cache_dir=None, distributions=None, jobs=None, rebuild=False, progress=None):
+    """Build the indexes of the distributions in an environment that
+    aren't in the cache yet and write the manifest of the running
+    interpreter's environment.
+
+    Parameters:
+      cache_dir(str): Defaults to default_cache_dir().
+      distributions(list[Distribution]): Defaults to find_distributions().
+      jobs(int): The number of worker processes to analyze files with.
+        Defaults to the number of CPUs.
+      rebuild(bool): Whether or not to rebuild indexes that are
+        already in the cache.
+      progress(callable): Called with every distribution and whether
+        or not it had to be indexed, before it is indexed.
+
+    Returns:
+      list[tuple[Distribution, str]]: Every distribution along with
+      the path of its index.
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    os.makedirs(os.path.join(cache_dir, "indexes"), exist_ok=True)
+    if distributions is None:
+        distributions = find_distributions()
+
+    indexed = []
+    for distribution in distributions:
+        path = os.path.join(cache_dir, "indexes", f"{distribution.key}.kawe")
+        missing = rebuild or not os.path.exists(path)
+        if progress:
+            progress(distribution, missing)
+
+        if missing:
+            build_index(distribution, path, jobs)
+
+        indexed.append((distribution, path))
+
+    manifest = {
+        "prefix": os.path.abspath(sys.prefix),
+        "indexes": [
+            {
+                "distribution": distribution.name,
+                "version": distribution.version,
+                "root": distribution.root,
+                "path": path,
+            }
+            for distribution, path in indexed
+        ],
+    }
+    write_atomically(manifest_path(cache_dir), json.dumps(manifest, indent=2).encode())
+    return indexed
+
+
+def build_index(distribution, path, jobs=None):
+    """Index every module of a distribution and write the result to
+    path.  Function bodies are skipped: environment indexes are used
+    to find definitions, not usages.  Modules that can't be analyzed
+    are skipped.
+
+    Parameters:
+      distribution(Distribution)
+      path(str)
+      jobs(int): The number of worker processes to use.  Defaults to
+        the number of CPUs.
+    """
+    from .indexer import Indexer
+    from .project import analyze_modules
+
+    modules = []
+    for filename in distribution.filenames:
+        filename = os.path.join(distribution.root, filename)
+        modules.append((filename, qualified_name_from_root(distribution.root, filename), True))
+
+    indexer = Indexer(lazy=True)
+    analyzed = analyze_modules(modules, jobs or os.cpu_count() or 1)
+    indexer.add_modules(result for _, result, _ in analyzed if not isinstance(result, Exception))
+    write_index(CompactIndex.from_indexer(indexer), path, distribution)
+
+
+def write_index(index, path, distribution):
+    """Write a CompactIndex in the format MappedIndex.open reads.  The
+    file is written atomically so that processes that map it never
+    observe a partial index.
+
+    Parameters:
+      index(CompactIndex)
+      path(str)
+      distribution(Distribution)
+    """
+    strings = index.strings.strings
+    filenames = [os.path.relpath(strings[filename_id], distribution.root) for filename_id in index.module_filenames]
+    docstrings, arguments = {}, {}
+    for row, (docstring, row_arguments) in index.details.items():
+        if docstring is not None:
+            docstrings[row] = docstring
+        if row_arguments is not None:
+            arguments[row] = "\0".join(row_arguments)
+
+    # Sorting the strings lets readers look them up by bisection
+    # without building a dictionary of every string.
+    values = sorted(set(strings).union(filenames, docstrings.values(), arguments.values()))
+    ids = {value: i for i, value in enumerate(values)}
+    remap = [ids[string] for string in strings]
+
+    def column(string_ids):
+        return array("q", (remap[string_id] if string_id != -1 else -1 for string_id in string_ids))
+
+    def details(strings_by_row):
+        return array("q", (ids[strings_by_row[row]] if row in strings_by_row else -1 for row in range(len(index))))
+
+    data = [value.encode("utf-8", "surrogatepass") for value in values]
+    string_offsets = array("q", [0])
+    for value in data:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    definitions = sorted(zip(column(index.definition_names), index.definition_rows))
+    references = sorted(zip(column(index.reference_targets), index.reference_rows))
+    sections = {
+        "string_offsets": string_offsets,
+        "string_data": array("B", b"".join(data)),
+        "module_names": array("q", (ids[module_name] for module_name in sorted(index.modules, key=index.modules.get))),
+        "module_filenames": array("q", (ids[filename] for filename in filenames)),
+        "module_rows": index.module_rows,
+        "kinds": index.kinds,
+        "names": column(index.names),
+        "starts": index.starts,
+        "ends": index.ends,
+        "parents": index.parents,
+        "targets": column(index.targets),
+        "docstrings": details(docstrings),
+        "arguments": details(arguments),
+        "definition_names": array("q", (name_id for name_id, _ in definitions)),
+        "definition_rows": array("q", (row for _, row in definitions)),
+        "reference_targets": array("q", (target_id for target_id, _ in references)),
+        "reference_rows": array("q", (row for _, row in references)),
+    }
+
+    header = {
+        "distribution": distribution.name,
+        "version": distribution.version,
+        "packages": sorted({module_name.partition(".")[0] for module_name in index.modules}),
+        "sections": {},
+    }
+
+    # Section offsets are relative to the end of the header, which is
+    # padded so that every section is aligned.
+    chunks, offset = [], 0
+    for name, section in sections.items():
+        header["sections"][name] = [section.typecode, offset, len(section)]
+        chunks.append(section.tobytes())
+        chunks.append(bytes(_align(len(chunks[-1])) - len(chunks[-1])))
+        offset += len(chunks[-1]) + len(chunks[-2])
+
+    encoded_header = json.dumps(header).encode()
+    preamble = b"".join((
+        ENV_FORMAT_MAGIC, ENV_FORMAT_VERSION.to_bytes(4, "big"), len(encoded_header).to_bytes(8, "big"), encoded_header,
+    ))
+    chunks.insert(0, preamble + bytes(_align(len(preamble)) - len(preamble)))
+    write_atomically(path, b"".join(chunks))
+
+
+class _MappedStrings:
+    """A sorted string table whose strings are decoded on access.
+    """
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, string_id):
+        return self.data[self.offsets[string_id]:self.offsets[string_id + 1]].tobytes().decode("utf-8", "surrogatepass")
+
+    def find(self, string):
+        string_id = bisect_left(self, string)
+        if string_id == len(self) or self[string_id] != string:
+            return None
+        return string_id
+
+
+class _MappedModules:
+    """Maps module names to module ids.  Modules are stored in name
+    order, so their name ids are sorted.
+    """
+
+    def __init__(self, strings, module_names):
+        self.strings = strings
+        self.module_names = module_names
+
+    def __len__(self):
+        return len(self.module_names)
+
+    def __iter__(self):
+        return (self.strings[name_id] for name_id in self.module_names)
+
+    def get(self, module_name, default=None):
+        name_id = self.strings.find(module_name)
+        if name_id is None:
+            return default
+
+        module_id = bisect_left(self.module_names, name_id)
+        if module_id == len(self.module_names) or self.module_names[module_id] != name_id:
+            return default
+        return module_id
+
+    def __getitem__(self, module_name):
+        module_id = self.get(module_name)
+        if module_id is None:
+            raise KeyError(module_name)
+        return module_id
+
+    def __contains__(self, module_name):
+        return self.get(module_name) is not None
+
+
+class _MappedDetails:
+    """Maps the rows of modules, classes and functions to their
+    docstrings and arguments.
+    """
+
+    def __init__(self, strings, docstrings, arguments):
+        self.strings = strings
+        self.docstrings = docstrings
+        self.arguments = arguments
+
+    def __getitem__(self, row):
+        docstring_id, arguments_id = self.docstrings[row], self.arguments[row]
+        docstring = self.strings[docstring_id] if docstring_id != -1 else None
+        if arguments_id == -1:
+            return docstring, None
+
+        arguments = self.strings[arguments_id]
+        return docstring, arguments.split("\0") if arguments else []
+
+
+def _find_stdlib_files(stdlib):
+    filenames = []
+    for dirpath, dirnames, files in os.walk(stdlib):
+        dirnames[:] = sorted(dirname for dirname in dirnames if dirname not in STDLIB_IGNORED_DIRNAMES)
+        relative_dir = os.path.relpath(dirpath, stdlib)
+        parts = () if relative_dir == os.curdir else tuple(relative_dir.split(os.sep))
+        if not _is_module_path(parts + ("__init__.py",)):
+            dirnames[:] = []
+            continue
+
+        for filename in sorted(files):
+            if filename.endswith(".py") and _is_module_path(parts + (filename,)):
+                filenames.append(os.path.normpath(os.path.join(relative_dir, filename)))
+
+    return filenames
+
+
+def _read_manifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+
+    # A manifest that was truncated or written by something else must
+    # not take every command down with it.
+    try:
+        entries = [(entry["path"], entry["root"]) for entry in manifest["indexes"]]
+    except (KeyError, TypeError):
+        raise ValueError(f"{path} is not a valid manifest.")
+
+    if not all(isinstance(value, str) for entry in entries for value in entry):
+        raise ValueError(f"{path} is not a valid manifest.")
+    return entries
+
+
+def _is_module_path(parts):
+    return all(part.isidentifier() for part in parts[:-1]) and parts[-1][:-3].isidentifier()
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
@@ -0,0 +1,370 @@
+"""An asyncio-based HTTP front-end for the Indexer so that many editor
+clients can share one warm index.
+
+Lookups are answered in a thread pool from a snapshot of the index so
+that a slow query never stalls other connections.  (Re)indexing
+happens on a copy of the current snapshot in a background executor and
+the copy replaces the current snapshot once it is complete, so a
+lookup never observes a half-updated index.
+
+Snapshots are not strictly read-only, though: lookups fill in the
+snapshot's resolved_names memo and lazy source cache, bring the stamps
+of touched files up to date and bump the stats counters every snapshot
+shares.  Memo entries only depend on
+the snapshot and every write is a single dict operation, so concurrent
+lookups can at worst repeat each other's work.  Counters are not
+locked, so stats may undercount while lookups run concurrently.
+
+Endpoints:
+
+  GET  /describe?filename=...&line=...&column=...
+  GET  /find_definition?filename=...&line=...&column=...
+  GET  /find_usages?filename=...&line=...&column=...
+  GET  /search?query=...&limit=...
+  POST /index?filename=...
+  GET  /stats
+"""
+import asyncio
+import json
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from .watcher import ProjectWatcher, make_watcher
+
+LOOKUPS = {
+    "/describe": "lookup_metadata",
+    "/find_definition": "lookup_definition",
+    "/find_usages": "lookup_references",
+}
+
+MAX_HEADER_COUNT = 100
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class HTTPError(Exception):
+    """Raised by request handlers to short-circuit with an error response.
+    """
+
+    def __init__(self, status, message=None):
+        super().__init__(message or status.phrase)
+        self.status = status
+        self.message = message or status.phrase
+
+
+class SnapshotIndex:
+    """Holds the current generation of an Indexer.  Readers grab the
+    current snapshot and only ever update its caches (see above).
+    Writers are serialized and each one produces a new generation.
+
+    Parameters:
+      indexer(Indexer): The initial snapshot.
+      executor(Executor): The executor indexing work is run on.
+    """
+
+    def __init__(self, indexer, executor=None):
+        self.current = indexer
+        self.generation = 0
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self._write_lock = asyncio.Lock()
+
+    async def ensure_indexed(self, filename):
+        """Make sure the current snapshot contains an up-to-date copy
+        of the given file, indexing it in the background if necessary.
+
+        Returns:
+          Indexer: A snapshot containing the file.
+        """
+        loop = asyncio.get_running_loop()
+        snapshot = self.current
+        if not await loop.run_in_executor(None, snapshot.needs_indexing, filename):
+            return snapshot
+
+        return await self._update(_reindexed, filename)
+
+    async def index_located_module(self, filename, module_name):
+        """Add a module found by Indexer.locate_import to a new snapshot.
+
+        Returns:
+          Indexer: A snapshot containing the module, unless it
+          couldn't be analyzed.
+        """
+        return await self._update(_with_located_module, filename, module_name)
+
+    async def expand_bodies(self, pending):
+        """Analyze lazy function bodies returned by
+        Indexer.lookup_pending_expansions in a new snapshot.
+
+        Returns:
+          Indexer
+        """
+        return await self._update(_with_expanded_bodies, pending)
+
+    async def update_files(self, analyzed_modules, removed_paths):
+        """Apply a batch of changes (see Indexer.update_files) to a new
+        snapshot.
+
+        Returns:
+          Indexer
+        """
+        return await self._update(_with_updated_files, analyzed_modules, removed_paths)
+
+    async def _update(self, update, *args):
+        loop = asyncio.get_running_loop()
+        async with self._write_lock:
+            snapshot = await loop.run_in_executor(self.executor, update, self.current, *args)
+            if snapshot is not self.current:
+                self.current = snapshot
+                self.generation += 1
+
+            return snapshot
+
+
+class HTTPServer:
+    """Serves lookups from a SnapshotIndex over HTTP/1.1.
+
+    Parameters:
+      index(SnapshotIndex)
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    async def start(self, host, port):
+        """Start listening for connections.
+
+        Returns:
+          asyncio.AbstractServer
+        """
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HTTPError as e:
+                    await _write_response(writer, e.status, {"error": e.message}, keep_alive=False)
+                    return
+
+                if request is None:
+                    return
+
+                method, target, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    status, payload = HTTPStatus.OK, await self.handle_request(method, target, body)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": e.message}
+                except Exception as e:
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"}
+
+                await _write_response(writer, status, payload, keep_alive=keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, method, target, body):
+        """Handle a single request and return the JSON-serializable
+        payload to respond with.
+
+        Raises:
+          HTTPError: If the request cannot be handled.
+        """
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        if body:
+            try:
+                params.update(json.loads(body))
+            except (ValueError, TypeError):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Request bodies must be JSON objects.")
+
+        if url.path == "/index":
+            if method != "POST":
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+            await self.index.ensure_indexed(_require(params, "filename"))
+            return {"generation": self.index.generation}
+
+        if url.path == "/stats":
+            return await _run(self.index.current.stats.as_dict)
+
+        if url.path == "/search":
+            try:
+                limit = int(params.get("limit", 20))
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "limit must be an integer.")
+
+            return await _run(self.index.current.search_symbols, _require(params, "query"), limit)
+
+        try:
+            lookup = LOOKUPS[url.path]
+        except KeyError:
+            raise HTTPError(HTTPStatus.NOT_FOUND)
+
+        if method not in ("GET", "POST"):
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+        filename = _require(params, "filename")
+        try:
+            line, column = int(_require(params, "line")), int(_require(params, "column"))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "line and column must be integers.")
+
+        snapshot = await self.index.ensure_indexed(filename)
+        attempted = []
+        pending = await _run(snapshot.lookup_pending_expansions, lookup, filename, line, column)
+        while pending and pending not in attempted:
+            attempted.append(pending)
+            snapshot = await self.index.expand_bodies(pending)
+            pending = await _run(snapshot.lookup_pending_expansions, lookup, filename, line, column)
+
+        if lookup == "lookup_definition":
+            # Like function bodies, modules that imported names come
+            # from are indexed into new snapshots so that lookups never
+            # add modules to a snapshot.
+            attempted = set()
+            located = await _run(snapshot.lookup_pending_import, filename, line, column)
+            while located is not None and located not in attempted:
+                attempted.add(located)
+                snapshot = await self.index.index_located_module(*located)
+                located = await _run(snapshot.lookup_pending_import, filename, line, column)
+
+            return await _run(partial(snapshot.lookup_definition, locate_imports=False), filename, line, column)
+
+        return await _run(getattr(snapshot, lookup), filename, line, column)
+
+
+def serve_http(indexer, host, port, watch=None, poll=False):
+    """Serve lookups over HTTP until interrupted.
+
+    Parameters:
+      indexer(Indexer)
+      host(str)
+      port(int)
+      watch(str): A project root to watch for changes.  Changed files
+        are re-indexed into new snapshots.
+      poll(bool): Whether or not to poll for changes rather than use
+        inotify.
+    """
+    async def run():
+        index = SnapshotIndex(indexer)
+        server = await HTTPServer(index).start(host, port)
+        watcher = None
+        if watch:
+            loop = asyncio.get_running_loop()
+
+            def update_files(analyzed_modules, removed_paths):
+                asyncio.run_coroutine_threadsafe(index.update_files(analyzed_modules, removed_paths), loop).result()
+
+            watcher = ProjectWatcher(watch, update_files, make_watcher(watch, poll), lazy=indexer.lazy).start()
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher is not None:
+                await loop.run_in_executor(None, watcher.stop)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def _reindexed(indexer, filename):
+    if not indexer.needs_indexing(filename):
+        return indexer
+
+    indexer = indexer.copy()
+    indexer.ensure_indexed(filename)
+    return indexer
+
+
+def _with_located_module(indexer, filename, module_name):
+    if module_name in indexer.modules:
+        return indexer
+
+    updated = indexer.copy()
+    if updated.index_located_module(filename, module_name):
+        return updated
+    return indexer
+
+
+def _with_expanded_bodies(indexer, pending):
+    updated = indexer.copy()
+    updated.expand_bodies(pending)
+    return updated
+
+
+def _with_updated_files(indexer, analyzed_modules, removed_paths):
+    updated = indexer.copy()
+    updated.update_files(analyzed_modules, removed_paths)
+    return updated
+
+
+async def _run(function, *args):
+    # Lookups only update a snapshot's caches so they can run
+    # concurrently in the default executor, away from the event loop
+    # and from the writer executor.
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+def _require(params, name):
+    try:
+        return params[name]
+    except KeyError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Missing parameter {name!r}.")
+
+
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line.")
+
+    headers = {}
+    for _ in range(MAX_HEADER_COUNT):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+    try:
+        content_length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length.")
+
+    if content_length < 0:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length.")
+
+    if content_length > MAX_BODY_SIZE:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+    body = await reader.readexactly(content_length) if content_length else b""
+    return method.upper(), target, headers, body
+
+
+async def _write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode("utf-8")
+    writer.write((
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        f"\r\n"
+    ).encode("latin-1") + body)
+    await writer.drain()
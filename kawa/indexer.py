@@ -1,25 +1,251 @@
+import functools
+import hashlib
 import os
+import pickle
+import re
+import sys
+import time
+import warnings
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from importlib.util import decode_source
+from operator import attrgetter
 
-from .analyzer import Analyzer, Reference
-from .common import find_qualified_name
+from .analyzer import Analyzer, Call, Class, Import, LazyFunction, Module, Reference, Scope, _split_lines, bind_template
+from .calls import CallGraph
+from .common import CopyOnWrite, find_module_file, find_module_search_path, find_qualified_name, load_data
+from .positions import PositionIndex
+from .stats import Stats
+from .symbols import SymbolIndex
 
+#: The version of the on-disk index format.  Bump this whenever the
+#: structure of the serialized data changes.
+INDEX_FORMAT_VERSION = 8
+INDEX_FORMAT_MAGIC = b"KAWA"
 
-class Indexer:
+#: The classes saved indexes may contain.  See load_data.
+INDEX_CLASSES = frozenset([
+    ("builtins", "list"),
+    ("collections", "defaultdict"),
+    ("kawa.indexer", "FileStamp"),
+    ("kawa.positions", "PositionIndex"),
+] + [
+    ("kawa.analyzer", name) for name in (
+        "Call", "Class", "Function", "Import", "LazyFunction", "Module", "Reference", "SourceLocation", "Variable",
+    )
+])
+
+
+class FileStamp(namedtuple("FileStamp", ("filename", "mtime", "size", "digest"))):
+    """Identifies the exact contents of a file at the time it was indexed.
+    """
+
+    @classmethod
+    def from_source(cls, filename, source_bytes):
+        st = os.stat(filename)
+        return cls(filename, st.st_mtime_ns, st.st_size, _digest(source_bytes))
+
+    def is_fresh(self):
+        """Check whether the file on disk still matches this stamp.
+        Content is only hashed when the mtime or size differ.
+
+        Returns:
+          bool
+        """
+        return self.refreshed() is not None
+
+    def refreshed(self):
+        """Check whether the file on disk still matches this stamp and
+        bring its mtime and size up to date if only those changed (eg.
+        because the file was touched), so that checking the new stamp
+        doesn't hash the file again.
+
+        Returns:
+          FileStamp: This stamp or an up to date copy of it, or None if
+          the file's contents changed or it can't be read.
+        """
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+
+        if st.st_mtime_ns == self.mtime and st.st_size == self.size:
+            return self
+
+        try:
+            with open(self.filename, "rb") as f:
+                if _digest(f.read()) != self.digest:
+                    return None
+        except OSError:
+            return None
+
+        return self._replace(mtime=st.st_mtime_ns, size=st.st_size)
+
+
+class TemplateCache:
+    """Deduplicates the analysis of byte-identical files (vendored
+    copies, generated stubs, boilerplate __init__.py files, etc.).
+
+    The digest of every source is remembered.  The second time a
+    digest comes up, the source is analyzed as a template that isn't
+    tied to any module name or filename and the template is kept so
+    that it, and every later file with the same contents, can be
+    bound to its own name without being parsed.  Unique files are
+    analyzed as usual and don't take up any space in the cache beyond
+    their digest.
+
+    Attributes:
+      seen(set[tuple[str, bool]]): The (digest, lazy) pairs of every
+        source analyzed so far.
+      templates(dict[tuple[str, bool], Module])
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self.templates = {}
+
+    def analyze(self, filename, module_name, source, digest, stats=None, lazy=False):
+        """Analyze a module, reusing the analysis of an identical
+        source if there is one.  The "templates" cache's hit rate in
+        the stats is the fraction of files that didn't need parsing.
+
+        Parameters:
+          filename(str)
+          module_name(str)
+          source(str)
+          digest(str): The digest of the source's bytes.
+          stats(Stats)
+          lazy(bool)
+
+        Returns:
+          Module
+        """
+        key = digest, lazy
+        template = self.templates.get(key)
+        if template is not None:
+            if stats is not None:
+                stats.hit("templates")
+            return bind_template(template, module_name, filename)
+
+        if stats is not None:
+            stats.miss("templates")
+
+        if key not in self.seen:
+            self.seen.add(key)
+            return Analyzer(filename, module_name, source, stats, lazy).analyze()
+
+        template = self.templates[key] = Analyzer(None, None, source, stats, lazy).analyze()
+        return bind_template(template, module_name, filename)
+
+
+class Bindings(namedtuple("Bindings", ("kind", "names"))):
+    """The names bound directly inside of a scope.
+
+    Attributes:
+      kind(type): The type of the scope (Module, Class or Function).
+      names(frozenset[str]): The unqualified names bound in the scope.
+    """
+
+    @classmethod
+    def from_scope(cls, scope):
+        return cls(type(scope), frozenset(_basename(definition.name) for definition in scope.definitions))
+
+
+def timed(phase):
+    """Decorate an Indexer method so that every call to it is counted
+    and timed under the given phase in the indexer's stats.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.stats.add_time(phase, time.perf_counter() - start)
+                self.stats.count(f"calls.{phase}")
+        return wrapper
+    return decorator
+
+
+class Indexer(CopyOnWrite):
     """The indexer keeps track of a set of modules in order to
     facilitate analyzed entity lookup.
 
     Attributes:
       modules(dict[str, entity])
+      stamps(dict[str, FileStamp])
+      references_by_module(dict[str, dict[Reference, str]]): Maps
+        every module to its references and the names they resolve to.
+      references_by_basename(dict[str, dict[str, set[Reference]]]):
+        Maps the last segment of every reference's name to the
+        references that end with it, grouped by module.
+      submodules(dict[str, set[str]]): Maps every package prefix to
+        the names of the modules under it.
+      scopes(dict[str, Bindings]): Maps the FQN of every module, class
+        and function to the names bound directly inside of it.
+      scopes_by_module(dict[str, dict[str, Bindings]])
+      resolved_names(dict[str, str]): A memo of resolved reference
+        names.  An entry is dropped whenever a reference with that name
+        is retracted or might resolve differently.
+      located_modules(dict[str, str]): Maps the filenames of modules
+        that were indexed because something imported them to their
+        names, since those names may not be derivable from the
+        filenames (eg. for modules on sys.path).
+      lazy_bodies(dict[str, tuple[LazyFunction]]): Maps modules to
+        their functions whose bodies haven't been analyzed yet.
+      symbols(SymbolIndex): The names of every module and of every
+        class, function and variable defined at module or class
+        level, for search_symbols.
+      calls(CallGraph): The calls and imports of every module, for
+        lookup_callers and lookup_callees.
+      stats(Stats): Instrumentation shared with every copy of this
+        indexer.
+      templates(TemplateCache): The analyses of duplicated sources,
+        also shared with every copy of this indexer.
+
+    Parameters:
+      lazy(bool): Whether or not to only index the outline of new
+        modules (their classes, functions, signatures and docstrings).
+        Function bodies are analyzed when a lookup lands inside of
+        them or when a search for usages needs them.
     """
 
-    def __init__(self):
+    def __init__(self, lazy=False):
+        self.lazy = lazy
         self.modules = {}
+        self.stamps = {}
         self.entities_by_fqn = {}
         self.entities_by_module = {}
         self.source_locations_by_module = {}
         self.references_by_fqn = defaultdict(list)
+        self.references_by_module = {}
+        self.references_by_basename = {}
+        self.submodules = {}
+        self.scopes = {}
+        self.scopes_by_module = {}
+        self.resolved_names = {}
+        self.located_modules = {}
+        self.lazy_bodies = {}
+        self._lazy_sources = {}
+        self.symbols = SymbolIndex()
+        self.calls = CallGraph()
+        self.stats = Stats()
+        self.templates = TemplateCache()
+        self.environments = []
+        self._owned = set()
+
+    def attach(self, environment):
+        """Attach a prebuilt environment index (see kawa.environment).
+        Imports whose targets aren't in this index are looked up in the
+        environments attached to it, in the order they were attached,
+        before lookup_definition falls back to indexing the modules
+        they come from.
+
+        Parameters:
+          environment(Environment)
+        """
+        self.environments.append(environment)
 
     def index_file(self, filename, module_name=None):
         """Add a file to the index.
@@ -27,58 +253,509 @@ class Indexer:
         Parameters:
           filename(str)
         """
+        self.add_module(*analyze_file(filename, module_name, self.stats, self.lazy, self.templates))
+
+    def add_module(self, module, stamp):
+        """Add an analyzed module to the index.
+
+        Parameters:
+          module(Module)
+          stamp(FileStamp)
+        """
+        self.add_modules([(module, stamp)])
+
+    def add_modules(self, analyzed_modules):
+        """Add many analyzed modules to the index at once.  Modules that
+        are already indexed are updated incrementally: definitions and
+        references that went away are retracted, new ones are added and
+        only the references whose targets may have changed as a result
+        are resolved again.  References are resolved once every
+        module's definitions are known so the result doesn't depend on
+        the order of the modules.
+
+        Parameters:
+          analyzed_modules(iterable[tuple[Module, FileStamp]])
+        """
+        self._update_modules((module.name, module, stamp) for module, stamp in analyzed_modules)
+
+    def needs_indexing(self, filename, module_name=None):
+        """Check whether a file is missing from the index or has
+        changed on disk since it was indexed.
+
+        Parameters:
+          filename(str)
+
+        Returns:
+          bool
+        """
+        filename = os.path.abspath(filename)
+        module_name = module_name or self.module_name_of(filename)
+        stamp = self.stamps.get(module_name)
+        return stamp is None or stamp.filename != filename or self._refresh_stamp(module_name, stamp) is None
+
+    def ensure_indexed(self, filename, module_name=None):
+        """Index a file unless it is already indexed and hasn't changed
+        on disk since.
+
+        Parameters:
+          filename(str)
+
+        Returns:
+          bool: True if the file had to be (re)indexed.
+        """
         filename = os.path.abspath(filename)
-        with open(filename, "r") as f:
-            module_name = module_name or find_qualified_name(filename)
-            module_source = f.read()
+        module_name = module_name or self.module_name_of(filename)
+        if not self.needs_indexing(filename, module_name):
+            self.stats.hit("stamps")
+            return False
+
+        self.stats.miss("stamps")
+        self.index_file(filename, module_name)
+        return True
+
+    def remove_module(self, module_name):
+        """Remove a module and everything it defines from the index.
+
+        Parameters:
+          module_name(str)
+        """
+        if module_name in self.modules:
+            self._update_modules([(module_name, None, None)])
+
+    def update_files(self, analyzed_modules, removed_paths=()):
+        """Apply a batch of changes to a project in a single incremental
+        update: add or replace the analyzed modules and drop every
+        module whose file was, or was under, one of the removed paths
+        and no longer exists.
+
+        Parameters:
+          analyzed_modules(iterable[tuple[Module, FileStamp]])
+          removed_paths(iterable[str]): Files or directories.
+        """
+        updates = [(module.name, module, stamp) for module, stamp in analyzed_modules]
+        updated = {module_name for module_name, _, _ in updates}
+        for module_name in _modules_under(self.stamps, removed_paths):
+            if module_name not in updated:
+                updates.append((module_name, None, None))
+
+        self._update_modules(updates)
+
+    @timed("index")
+    def _update_modules(self, updates):
+        retracted = defaultdict(set)
+        changed_names = set()
+        pending = []
+        for module_name, module, stamp in updates:
+            old_entities = self.entities_by_module.pop(module_name, {})
+            old_references = self.references_by_module.pop(module_name, {})
+            old_scopes = self.scopes_by_module.pop(module_name, {})
+            if module is None:
+                self._drop_module(module_name)
+                new_entities, new_references, new_scopes = {}, [], {}
+            else:
+                new_entities, new_references, new_scopes = self._install_module(module_name, module, stamp)
+
+            changed_names.update(self._replace_entities(old_entities, new_entities))
+            self._update_call_imports(old_entities, new_entities)
+            self._update_symbols(old_entities, old_scopes, new_entities, new_scopes)
+            changed_names.update(self._replace_scopes(old_scopes, new_scopes))
+            kept_references = self._retract_references(module_name, old_references, new_references, retracted)
+            if module is not None:
+                self.references_by_module[module_name] = kept_references
+                self._owned.add(id(kept_references))
+                pending.append((module_name, [r for r in new_references if r not in kept_references]))
 
-        analyzer = Analyzer(filename, module_name, module_source)
-        self.modules[module_name] = module = analyzer.analyze()
-        self.entities_by_module[module_name] = entities_by_module = {}
-        self.source_locations_by_module[module_name] = source_locations = defaultdict(dict)
+        added = self._resolve_affected(changed_names, retracted)
+        self._resolve_pending(pending, added)
+        self._apply_resolutions(retracted, added)
 
+    def _drop_module(self, module_name):
+        self.modules.pop(module_name, None)
+        stamp = self.stamps.pop(module_name, None)
+        if stamp and self.located_modules.get(stamp.filename) == module_name:
+            del self.located_modules[stamp.filename]
+
+        self.source_locations_by_module.pop(module_name, None)
+        self.lazy_bodies.pop(module_name, None)
+        self._update_submodules(module_name, False)
+
+    def _install_module(self, module_name, module, stamp):
+        if module_name not in self.modules:
+            self._update_submodules(module_name, True)
+
+        self.stamps[module_name] = stamp
+        self.modules[module_name] = module
+        flattened = list(module.flatten())
+        self.source_locations_by_module[module_name] = PositionIndex(flattened)
+        new_entities, new_references, new_scopes, lazy_bodies = {}, [], {}, []
+        for entity in flattened:
+            if isinstance(entity, Reference):
+                new_references.append(entity)
+                continue
+
+            new_entities[entity.name] = entity
+            if isinstance(entity, Scope):
+                new_scopes[entity.name] = Bindings.from_scope(entity)
+                if isinstance(entity, LazyFunction):
+                    lazy_bodies.append(entity)
+
+        self.entities_by_module[module_name] = new_entities
+        self.scopes_by_module[module_name] = new_scopes
+        if lazy_bodies:
+            self.lazy_bodies[module_name] = tuple(lazy_bodies)
+        else:
+            self.lazy_bodies.pop(module_name, None)
+
+        return new_entities, new_references, new_scopes
+
+    def _replace_entities(self, old_entities, new_entities):
         entities = self.entities_by_fqn
-        references = []
-        for entity in module.flatten():
-            location = entity.source_location
-            if not isinstance(entity, Reference):
-                entities[entity.name] = entity
-                entities_by_module[entity.name] = entity
+        for name in old_entities.keys() - new_entities.keys():
+            if entities.get(name) is old_entities[name]:
+                del entities[name]
+
+        entities.update(new_entities)
+        return old_entities.keys() ^ new_entities.keys()
+
+    def _update_call_imports(self, old_entities, new_entities):
+        for name, entity in old_entities.items():
+            if isinstance(entity, Import) and new_entities.get(name) != entity:
+                self.calls.remove_import(name, entity.target)
 
+        for name, entity in new_entities.items():
+            if isinstance(entity, Import) and old_entities.get(name) != entity:
+                self.calls.add_import(name, entity.target)
+
+    def _update_symbols(self, old_entities, old_scopes, new_entities, new_scopes):
+        old_symbols = {name for name, entity in old_entities.items() if _is_symbol(entity, old_scopes)}
+        new_symbols = {name for name, entity in new_entities.items() if _is_symbol(entity, new_scopes)}
+        for name in old_symbols - new_symbols:
+            if name not in self.entities_by_fqn:
+                self.symbols.remove(name)
+
+        for name in new_symbols - old_symbols:
+            self.symbols.add(name)
+
+    def _replace_scopes(self, old_scopes, new_scopes):
+        # A scope that changes kind (eg. from a class to a function)
+        # changes how the names bound inside of it are resolved.
+        changed_names = set()
+        for name, bindings in old_scopes.items():
+            new_bindings = new_scopes.get(name)
+            if new_bindings is None:
+                self.scopes.pop(name, None)
+            elif new_bindings.kind is not bindings.kind:
+                changed_names.update(f"{name}.{binding}" for binding in bindings.names)
+
+        self.scopes.update(new_scopes)
+        return changed_names
+
+    def _retract_references(self, module_name, old_references, new_references, retracted):
+        kept_references = {}
+        for reference in new_references:
+            if reference in old_references:
+                kept_references[reference] = old_references.pop(reference)
+
+        for reference, target in old_references.items():
+            retracted[target].add(reference)
+            self.resolved_names.pop(reference.name, None)
+            self._unindex_basename(reference, module_name)
+
+        return kept_references
+
+    def _resolve_affected(self, changed_names, retracted):
+        # Definitions that appeared or disappeared can change what
+        # existing references resolve to.  Only the references that
+        # could have resolved to one of those names are looked at.
+        added = defaultdict(list)
+        affected = self._references_affected_by(changed_names)
+        for reference in affected:
+            self.resolved_names.pop(reference.name, None)
+
+        for reference, module_name in affected.items():
+            old_target = self.references_by_module[module_name][reference]
+            new_target = self._resolve_reference(reference)
+            if new_target != old_target:
+                self._writable(self.references_by_module, module_name, dict)[reference] = new_target
+                retracted[old_target].add(reference)
+                added[new_target].append(reference)
+
+        return added
+
+    def _resolve_pending(self, pending, added):
+        for module_name, new_references in pending:
+            module_references = self.references_by_module[module_name]
+            for reference in new_references:
+                module_references[reference] = target = self._resolve_reference(reference)
+                added[target].append(reference)
+                self._index_basename(reference, module_name)
+
+    def _apply_resolutions(self, retracted, added):
+        for name, references in retracted.items():
+            remaining = [r for r in self.references_by_fqn.get(name, ()) if r not in references]
+            if remaining:
+                self.references_by_fqn[name] = remaining
+                self._owned.add(id(remaining))
             else:
-                references.append(entity)
+                self.references_by_fqn.pop(name, None)
+
+            self._update_calls(name, references, self.calls.remove)
 
-            source_locations[location.line_number][location.column_offset] = entity
+        for name, references in added.items():
+            self._writable(self.references_by_fqn, name, list).extend(references)
+            self._update_calls(name, references, self.calls.add)
 
+    def _update_calls(self, name, references, update):
         for reference in references:
-            name = self._resolve_reference(reference)
-            self.references_by_fqn[name].append(reference)
+            if type(reference) is Call:
+                update(_scope(reference.name), name)
+
+    def _references_affected_by(self, changed_names):
+        affected = {}
+        for name in changed_names:
+            scope, _, basename = name.rpartition(".")
+            references_by_module = self.references_by_basename.get(basename)
+            if not references_by_module:
+                continue
+
+            if not scope:
+                candidates = references_by_module.items()
+
+            else:
+                # A reference can only resolve to scope.basename if it
+                # lives inside of scope.  So it must belong either to a
+                # module that encloses scope or to a submodule of scope.
+                candidates = []
+                module_name = scope
+                while module_name:
+                    if module_name in references_by_module:
+                        candidates.append((module_name, references_by_module[module_name]))
+                    module_name = module_name.rpartition(".")[0]
+
+                for module_name in self.submodules.get(scope, ()):
+                    if module_name in references_by_module:
+                        candidates.append((module_name, references_by_module[module_name]))
+
+            for module_name, references in candidates:
+                for reference in references:
+                    reference_scope = reference.name.rpartition(".")[0]
+                    if not scope or reference_scope == scope or reference_scope.startswith(f"{scope}."):
+                        affected[reference] = module_name
+
+        return affected
+
+    def _index_basename(self, reference, module_name):
+        references_by_module = self._writable(self.references_by_basename, _basename(reference.name), dict)
+        self._writable(references_by_module, module_name, set).add(reference)
+
+    def _unindex_basename(self, reference, module_name):
+        basename = _basename(reference.name)
+        references_by_module = self._writable(self.references_by_basename, basename, dict)
+        references = self._writable(references_by_module, module_name, set)
+        references.discard(reference)
+        if not references:
+            del references_by_module[module_name]
+            if not references_by_module:
+                del self.references_by_basename[basename]
+
+    def _update_submodules(self, module_name, present):
+        parent = module_name.rpartition(".")[0]
+        while parent:
+            submodules = self._writable(self.submodules, parent, set)
+            if present:
+                submodules.add(module_name)
+            else:
+                submodules.discard(module_name)
+                if not submodules:
+                    del self.submodules[parent]
+
+            parent = parent.rpartition(".")[0]
+
+    def refresh(self):
+        """Re-index every module whose file changed on disk since it
+        was indexed and drop the ones whose files were removed.
+
+        Returns:
+          list[str]: The names of the modules that were updated.
+        """
+        updated = []
+        for module_name, stamp in list(self.stamps.items()):
+            if self._refresh_stamp(module_name, stamp) is not None:
+                continue
+
+            if os.path.exists(stamp.filename):
+                self.index_file(stamp.filename, module_name)
+            else:
+                self.remove_module(module_name)
+
+            updated.append(module_name)
+
+        return updated
+
+    def _refresh_stamp(self, module_name, stamp):
+        fresh = stamp.refreshed()
+        if fresh is not None and fresh is not stamp:
+            self.stamps[module_name] = fresh
+        return fresh
+
+    def copy(self):
+        """Return a copy of this indexer that can be updated without
+        affecting it.  Entities are immutable and are shared between
+        the two, as are the containers nested inside of the top-level
+        maps.  Either indexer copies a shared container before it first
+        mutates it.
+
+        Returns:
+          Indexer
+        """
+        self._owned = set()
+        indexer = type(self)(self.lazy)
+        indexer.modules = self.modules.copy()
+        indexer.stamps = self.stamps.copy()
+        indexer.entities_by_fqn = self.entities_by_fqn.copy()
+        indexer.entities_by_module = self.entities_by_module.copy()
+        indexer.source_locations_by_module = self.source_locations_by_module.copy()
+        indexer.references_by_fqn = self.references_by_fqn.copy()
+        indexer.references_by_module = self.references_by_module.copy()
+        indexer.references_by_basename = self.references_by_basename.copy()
+        indexer.submodules = self.submodules.copy()
+        indexer.scopes = self.scopes.copy()
+        indexer.scopes_by_module = self.scopes_by_module.copy()
+        indexer.resolved_names = self.resolved_names.copy()
+        indexer.located_modules = self.located_modules.copy()
+        indexer.lazy_bodies = self.lazy_bodies.copy()
+        indexer.symbols = self.symbols.copy()
+        indexer.calls = self.calls.copy()
+        indexer.stats = self.stats
+        indexer.templates = self.templates
+        indexer.environments = list(self.environments)
+        return indexer
+
+    def save(self, path):
+        """Serialize the index to disk.  The file is written atomically
+        so that concurrent readers never observe a partial index.
+
+        Parameters:
+          path(str)
+        """
+        data = {
+            "stamps": self.stamps,
+            "modules": self.modules,
+            "entities_by_fqn": self.entities_by_fqn,
+            "source_locations_by_module": self.source_locations_by_module,
+            "references_by_fqn": self.references_by_fqn,
+            "references_by_module": self.references_by_module,
+            "located_modules": self.located_modules,
+            "lazy": self.lazy,
+        }
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(INDEX_FORMAT_MAGIC)
+            f.write(INDEX_FORMAT_VERSION.to_bytes(4, "big"))
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, refresh=True):
+        """Load an index previously written by save.
+
+        Parameters:
+          path(str)
+          refresh(bool): Whether or not to re-index modules whose
+            files changed since the index was saved.
+
+        Raises:
+          ValueError: If the file is not an index, if it was written
+            by an incompatible version of kawa or if it can't be
+            trusted.  See load_data.
+
+        Returns:
+          Indexer
+        """
+        with open(path, "rb") as f:
+            if f.read(len(INDEX_FORMAT_MAGIC)) != INDEX_FORMAT_MAGIC:
+                raise ValueError(f"{path} is not a kawa index.")
+
+            version = int.from_bytes(f.read(4), "big")
+            if version != INDEX_FORMAT_VERSION:
+                raise ValueError(f"{path} uses index format {version} but {INDEX_FORMAT_VERSION} is required.")
+
+            data = load_data(f, INDEX_CLASSES)
+
+        indexer = cls(data["lazy"])
+        indexer.stamps = data["stamps"]
+        indexer.modules = data["modules"]
+        indexer.entities_by_fqn = data["entities_by_fqn"]
+        indexer.source_locations_by_module = data["source_locations_by_module"]
+        indexer.references_by_fqn = data["references_by_fqn"]
+        indexer.references_by_module = data["references_by_module"]
+        indexer.located_modules = data["located_modules"]
+        for module_name, module in indexer.modules.items():
+            indexer.entities_by_module[module_name] = entities = {}
+            indexer.scopes_by_module[module_name] = scopes = {}
+            lazy_bodies = []
+            for entity in module.flatten():
+                if not isinstance(entity, Reference):
+                    entities[entity.name] = entity
+                    if isinstance(entity, Import):
+                        indexer.calls.add_import(entity.name, entity.target)
+                    elif isinstance(entity, Scope):
+                        scopes[entity.name] = Bindings.from_scope(entity)
+                        if isinstance(entity, LazyFunction):
+                            lazy_bodies.append(entity)
+
+            indexer.scopes.update(scopes)
+            for name, entity in entities.items():
+                if _is_symbol(entity, scopes):
+                    indexer.symbols.add(name)
+
+            if lazy_bodies:
+                indexer.lazy_bodies[module_name] = tuple(lazy_bodies)
+
+        for module_name, references in indexer.references_by_module.items():
+            indexer._update_submodules(module_name, True)
+            for reference, target in references.items():
+                indexer._index_basename(reference, module_name)
+                if type(reference) is Call:
+                    indexer.calls.add(_scope(reference.name), target)
+
+        if refresh:
+            indexer.refresh()
+
+        return indexer
 
     def lookup_entity(self, filename, line_number, column_offset):
-        """Look up the at a given location.
+        """Look up the innermost entity at a given location.
 
         Returns:
           An object representing the entity or None.
         """
-        module_name = find_qualified_name(filename)
+        module_name = self.module_name_of(filename)
         if module_name not in self.modules:
-            self.index_file(filename)
+            self.index_file(filename, module_name)
 
-        source_locations = self.source_locations_by_module[module_name]
-        columns_at_line = source_locations[line_number]
-        if not columns_at_line:
-            return None
+        self._expand_pending("lookup_entity", filename, line_number, column_offset)
+        return self.source_locations_by_module[module_name].lookup(line_number, column_offset)
 
-        closest_column = 0
-        for line_column, entity in columns_at_line.items():
-            if line_column == column_offset:
-                return entity
+    @timed("lookup.range")
+    def lookup_entities_between(self, filename, first_line, last_line):
+        """Look up every entity that overlaps a range of lines (for
+        example, the lines visible in an editor's viewport), along with
+        the entities that enclose them.
 
-            elif line_column < column_offset:
-                closest_column = line_column
+        Returns:
+          A list of entities in source order.
+        """
+        module_name = self.module_name_of(filename)
+        if module_name not in self.modules:
+            self.index_file(filename, module_name)
 
-        return columns_at_line[closest_column]
+        self._expand_pending("lookup_entities_between", filename, first_line, last_line)
+        return self.source_locations_by_module[module_name].lookup_range(first_line, last_line)
 
+    @timed("lookup.metadata")
     def lookup_metadata(self, filename, line_number, column_offset):
         """Look up the metadata of an entity.
 
@@ -90,50 +767,588 @@ class Indexer:
             return None
         return entity.metadata
 
-    def lookup_definition(self, filename, line_number, column_offset):
-        """Look up the definition of an entity.
+    @timed("lookup.definition")
+    def lookup_definition(self, filename, line_number, column_offset, locate_imports=True):
+        """Look up the definition of an entity.  Imported names are
+        followed to the definitions they import.
+
+        Parameters:
+          locate_imports(bool): Whether or not to find and index the
+            modules imported names come from when they aren't indexed
+            yet.  When this is False, names imported from modules that
+            aren't indexed are resolved to their import statements.
 
         Returns:
           A dictionary describing where the entity is defined or None.
         """
-        module_name = find_qualified_name(filename)
-        entity = self.lookup_entity(filename, line_number, column_offset)
+        entity = self._lookup_definition(filename, line_number, column_offset)
         if not entity:
             return None
 
-        if not isinstance(entity, Reference):
-            return entity.metadata
+        attempted = set()
+        while locate_imports and isinstance(entity, Import):
+            located = self.locate_import(entity)
+            if located is None or located in attempted:
+                break
+
+            attempted.add(located)
+            if self.index_located_module(*located):
+                entity = self._follow_imports(entity)
+
+        return entity.metadata
+
+    def lookup_pending_import(self, filename, line_number, column_offset):
+        """Find the module lookup_definition would have to index next in
+        order to follow the import the entity at a location refers to.
+
+        Returns:
+          tuple[str, str]: The module's filename and name or None.
+        """
+        entity = self._lookup_definition(filename, line_number, column_offset)
+        if not isinstance(entity, Import):
+            return None
+        return self.locate_import(entity)
+
+    def locate_import(self, entity):
+        """Find the module that defines the target of an import, unless
+        it is already indexed.  Targets like "a.b.c" may either be
+        modules or names defined inside of a module, so the longest
+        matching module wins.
+
+        Parameters:
+          entity(Import)
+
+        Returns:
+          tuple[str, str]: The module's filename and name or None.
+        """
+        search_path = None
+        module_name = entity.target
+        while module_name:
+            if module_name in self.modules:
+                return None
+
+            search_path = search_path or find_module_search_path(entity.source_location.filename)
+            filename = find_module_file(module_name, search_path)
+            if filename is not None:
+                return filename, module_name
+
+            module_name = module_name.rpartition(".")[0]
+
+        return None
+
+    def index_located_module(self, filename, module_name):
+        """Index a module found by locate_import.  Modules that can't be
+        analyzed are skipped.
+
+        Returns:
+          bool: True if the module was indexed.
+        """
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                self.index_file(filename, module_name)
+        except (OSError, SyntaxError, UnicodeDecodeError, ValueError, RecursionError):
+            return False
+
+        self.located_modules[os.path.abspath(filename)] = module_name
+        self.stats.count("imports.located")
+        return True
+
+    def lookup_pending_expansions(self, lookup, filename, *args):
+        """Find the lazy function bodies that have to be analyzed before
+        a lookup can be answered: the ones the looked up position or
+        range lands in and, when searching for usages, the ones that
+        mention the name being searched for.
+
+        Parameters:
+          lookup(str): The name of a lookup method.
+          filename(str)
+          args: The rest of the lookup's arguments.
+
+        Returns:
+          dict[str, list[tuple[int, int]]]: Maps module names to the
+          start positions of the functions to expand.  Modules whose
+          files changed on disk map to empty lists.
+        """
+        if not self.lazy_bodies:
+            return {}
+
+        module_name = self.module_name_of(filename)
+        positions = self.source_locations_by_module.get(module_name)
+        if positions is None:
+            return {}
+
+        if lookup == "lookup_entities_between":
+            entities = positions.lookup_range(*args)
+        else:
+            entities = [positions.lookup(*args)]
+
+        starts = [entity.source_location.start for entity in entities if isinstance(entity, LazyFunction)]
+        if starts:
+            return {module_name: starts}
+
+        if lookup != "lookup_references" or entities[0] is None:
+            return {}
+
+        entity = entities[0]
+        name = self._resolve_reference(entity) if isinstance(entity, Reference) else entity.name
+        return self._lazy_bodies_mentioning(_basename(name))
+
+    def expand_bodies(self, pending):
+        """Analyze the lazy function bodies returned by
+        lookup_pending_expansions.  Modules whose files changed on disk
+        are re-indexed instead.
+
+        Parameters:
+          pending(dict[str, list[tuple[int, int]]])
+        """
+        for module_name, starts in pending.items():
+            stamp = self.stamps.get(module_name)
+            if stamp is None:
+                continue
+
+            source = _read_fresh_source(stamp)
+            if source is None:
+                if os.path.exists(stamp.filename):
+                    self.index_file(stamp.filename, module_name)
+                else:
+                    self.remove_module(module_name)
+                continue
+
+            starts, expanded = set(starts), {}
+            analyzer = Analyzer(stamp.filename, module_name, source)
+            with self.stats.timed("expand"):
+                for function in self.lazy_bodies.get(module_name, ()):
+                    location = function.source_location
+                    if location.start in starts:
+                        expanded[function.name, location.start] = analyzer.analyze_function(
+                            function.name, location.line_number, location.end_line_number,
+                        )
+
+            if expanded:
+                self.stats.count("lazy.bodies_expanded", len(expanded))
+                self._update_modules([(module_name, _expand_scope(self.modules[module_name], expanded), stamp)])
+
+    def _expand_pending(self, lookup, filename, *args):
+        attempted = []
+        pending = self.lookup_pending_expansions(lookup, filename, *args)
+        while pending and pending not in attempted:
+            attempted.append(pending)
+            self.expand_bodies(pending)
+            pending = self.lookup_pending_expansions(lookup, filename, *args)
+
+    def _lazy_bodies_mentioning(self, basename):
+        pattern = re.compile(rf"\b{re.escape(basename)}\b")
+        pending, sources = {}, {}
+        for module_name, functions in self.lazy_bodies.items():
+            cached = sources[module_name] = self._lazy_body_sources(module_name, functions)
+            if cached is None:
+                pending[module_name] = []
+                continue
+
+            starts = [start for start, body in cached.bodies if pattern.search(body)]
+            if starts:
+                pending[module_name] = starts
+
+        # Rebuilding the cache drops the modules that are no longer lazy.
+        self._lazy_sources = {module_name: cached for module_name, cached in sources.items() if cached is not None}
+        return pending
+
+    def _lazy_body_sources(self, module_name, functions):
+        # The source of every lazy function body of a module.  Files are
+        # read and hashed once: later searches reuse their bodies for as
+        # long as the module wasn't re-indexed and the file's mtime and
+        # size still match its stamp.
+        stamp = self.stamps[module_name]
+        cached = self._lazy_sources.get(module_name)
+        if cached is not None and cached.stamp is stamp and cached.functions is functions and _is_unchanged(stamp):
+            self.stats.hit("lazy_sources")
+            return cached
+
+        self.stats.miss("lazy_sources")
+        source = _read_fresh_source(stamp)
+        if source is None:
+            return None
+
+        lines = _split_lines(source)
+        return _LazySources(stamp, functions, [
+            (location.start, "".join(lines[location.line_number - 1:location.end_line_number]))
+            for location in (function.source_location for function in functions)
+        ])
+
+    def module_name_of(self, filename):
+        """Find the name of the module a file defines.
 
+        Returns:
+          str
+        """
+        filename = os.path.abspath(filename)
         try:
-            return self.entities_by_module[module_name][entity.name].metadata
+            return self.located_modules[filename]
         except KeyError:
-            name = self._resolve_reference(entity)
-            return self.entities_by_fqn[name].metadata
+            return find_qualified_name(filename)
+
+    def _lookup_definition(self, filename, line_number, column_offset):
+        entity = self.lookup_entity(filename, line_number, column_offset)
+        if isinstance(entity, Reference):
+            try:
+                entity = self.entities_by_module[self.module_name_of(filename)][entity.name]
+            except KeyError:
+                name = self._resolve_reference(entity)
+                entity = self.entities_by_fqn.get(name)
+                if entity is None:
+                    # Names that resolve past the module boundary may be
+                    # defined by an attached index (eg. another shard).
+                    entity = self._lookup_attached(name)
+                    if entity is None:
+                        raise KeyError(name)
+
+        if isinstance(entity, Import):
+            return self._follow_imports(entity)
+        return entity
+
+    def _follow_imports(self, entity):
+        # Follow chains of re-exports for as long as their targets are
+        # indexed, stopping at the first cycle.
+        seen = set()
+        while isinstance(entity, Import) and entity.name not in seen:
+            seen.add(entity.name)
+            target = self.entities_by_fqn.get(entity.target)
+            if target is None:
+                break
+
+            entity = target
+
+        if isinstance(entity, Import):
+            target = self._lookup_attached(entity.target)
+            if target is not None:
+                self.stats.count("imports.environment")
+                return target
+
+        return entity
+
+    def _lookup_attached(self, name):
+        for environment in self.environments:
+            entity = environment.lookup_name(name)
+            if entity is not None:
+                return entity
+        return None
 
+    @timed("lookup.references")
     def lookup_references(self, filename, line_number, column_offset):
         """Look up the list of references of an entity.
 
         Returns:
           A list of dictionaries describing the references to the entity.
         """
+        return list(self.iter_references(filename, line_number, column_offset))
+
+    def iter_references(self, filename, line_number, column_offset, by_file=False):
+        """Like lookup_references, but describe the references one at
+        a time so that callers can use the first ones (or stop early)
+        before every reference to a popular name has been described.
+
+        Parameters:
+          filename(str)
+          line_number(int)
+          column_offset(int)
+          by_file(bool): Whether or not to order the references by
+            filename and position instead of in the order they were
+            indexed.  The definition always comes first.
+
+        Returns:
+          generator[dict]
+        """
+        name = self.lookup_fqn(filename, line_number, column_offset)
+        if name is None:
+            return
+
+        yield self.entities_by_fqn[name].metadata
+        yield from self._describe_references(name, by_file)
+
+    def lookup_fqn(self, filename, line_number, column_offset):
+        """Find the FQN of the entity at a location or, if it's a
+        reference, of the name it resolves to.  Imports are not
+        followed.  Lazy function bodies that may refer to the name are
+        analyzed first, like they are by iter_references.
+
+        Returns:
+          str: The FQN or None if there is no entity at the location.
+        """
         entity = self.lookup_entity(filename, line_number, column_offset)
         if not entity:
-            return []
+            return None
 
+        self._expand_pending("lookup_references", filename, line_number, column_offset)
         if isinstance(entity, Reference):
-            name = self._resolve_reference(entity)
-            entity = self.entities_by_fqn[name]
+            return self._resolve_reference(entity)
+        return entity.name
+
+    def iter_references_to(self, name, by_file=False):
+        """Describe the references to an FQN, without its definition,
+        which may live in another index (see kawa.shards).  Lazy
+        function bodies that mention the name are analyzed first.
+
+        Parameters:
+          name(str)
+          by_file(bool): See iter_references.
+
+        Returns:
+          generator[dict]
+        """
+        attempted = []
+        pending = self._lazy_bodies_mentioning(_basename(name)) if self.lazy_bodies else {}
+        while pending and pending not in attempted:
+            attempted.append(pending)
+            self.expand_bodies(pending)
+            pending = self._lazy_bodies_mentioning(_basename(name)) if self.lazy_bodies else {}
+
+        return self._describe_references(name, by_file)
+
+    def _describe_references(self, name, by_file):
+        # Taking a copy keeps the references stable if the index is
+        # updated while they're being consumed.
+        references = tuple(self.references_by_fqn.get(name, ()))
+        if by_file:
+            references = sorted(references, key=attrgetter("source_location"))
+
+        for reference in references:
+            yield reference.metadata
+
+    @timed("lookup.callers")
+    def lookup_callers(self, filename, line_number, column_offset, depth=1):
+        """Look up the functions that call the entity at a location,
+        either directly or, up to depth calls away, indirectly.  Calls
+        made through the names imports bind the entity to count.
+
+        Parameters:
+          filename(str)
+          line_number(int)
+          column_offset(int)
+          depth(int): The maximum number of calls between the entity
+            and its callers.  None means there is no limit.
+
+        Returns:
+          A list of dictionaries describing the callers, closest first.
+          Each one has a "depth" key.  Calls made in the bodies of
+          classes and modules are attributed to the class or module.
+        """
+        return self._walk_calls(filename, line_number, column_offset, depth, True)
+
+    @timed("lookup.callees")
+    def lookup_callees(self, filename, line_number, column_offset, depth=1):
+        """Look up the functions and classes the entity at a location
+        calls, either directly or, up to depth calls away, indirectly.
+        Only calls to plain names (eg. "f(x)" but not "a.f(x)") are
+        known.  Imported callees are followed to their definitions.
+
+        Parameters:
+          filename(str)
+          line_number(int)
+          column_offset(int)
+          depth(int): The maximum number of calls between the entity
+            and its callees.  None means there is no limit.
+
+        Returns:
+          A list of dictionaries describing the callees, closest first.
+          Each one has a "depth" key.
+        """
+        return self._walk_calls(filename, line_number, column_offset, depth, False)
+
+    def _walk_calls(self, filename, line_number, column_offset, depth, callers):
+        entity = self._lookup_definition(filename, line_number, column_offset)
+        if not entity:
+            return []
+
+        # Walking the call graph may need any function body, so lazy
+        # indexes analyze all of them up front.
+        if self.lazy_bodies:
+            self.expand_bodies({
+                module_name: [function.source_location.start for function in functions]
+                for module_name, functions in self.lazy_bodies.items()
+            })
+
+        results, seen = [], set()
+        for name, distance in self.calls.walk([entity.name], callers, depth):
+            definition = self._definition_of(name)
+            if definition is not None and definition.name not in seen:
+                seen.add(definition.name)
+                metadata = definition.metadata
+                metadata["depth"] = distance
+                results.append(metadata)
+
+        return results
 
-        references = [entity] + self.references_by_fqn[entity.name]
-        return [entity.metadata for entity in references]
+    def _definition_of(self, name):
+        entity = self.entities_by_fqn.get(name)
+        if isinstance(entity, Import):
+            return self._follow_imports(entity)
+        return entity
+
+    @timed("lookup.symbols")
+    def search_symbols(self, query, limit=20):
+        """Find the modules and the module or class level classes,
+        functions and variables whose names best match a query.  Names
+        match when they start with the query, contain it or when the
+        query abbreviates their camel or snake case words (eg. "gfn"
+        for "get_file_name").
+
+        Parameters:
+          query(str): Dotted queries (eg. "reader.read") only match
+            names whose scope contains the part before the last dot.
+          limit(int): The maximum number of results.
+
+        Returns:
+          A list of dictionaries describing the matching definitions,
+          best match first.
+        """
+        return [self.entities_by_fqn[name].metadata for name in self.symbols.search(query, limit)]
 
     def _resolve_reference(self, reference):
-        name = reference.name
-        while True:
-            if name in self.entities_by_fqn or "." not in name:
-                return name
-
-            # foo.bar.baz.x -> foo.bar.x
-            pieces = name.split(".")
-            pieces = pieces[:-2] + [pieces[-1]]
-            name = ".".join(pieces)
+        try:
+            name = self.resolved_names[reference.name]
+            self.stats.hit("resolved_names")
+            return name
+        except KeyError:
+            start = time.perf_counter()
+            scope, _, basename = reference.name.rpartition(".")
+            self.resolved_names[reference.name] = name = self._resolve_name(scope, basename)
+            self.stats.miss("resolved_names")
+            self.stats.add_time("resolve", time.perf_counter() - start)
+            return name
+
+    def _resolve_name(self, scope, basename):
+        # Look the name up in the scopes of its module following Python's
+        # LEGB rules: class scopes are only visible to code that lives
+        # directly inside of them.  The results are interned so every
+        # reference to a name shares a single copy of its FQN.
+        scopes, nested, counters = self.scopes, False, self.stats.counters
+        while scope:
+            counters["resolver.probes"] += 1
+            bindings = scopes.get(scope)
+            if bindings is None:
+                break
+
+            if basename in bindings.names and not (nested and bindings.kind is Class):
+                return sys.intern(f"{scope}.{basename}")
+
+            scope, nested = scope.rpartition(".")[0], True
+            if bindings.kind is Module:
+                break
+
+        # Past the module boundary, fall back to any entity (usually a
+        # sibling module) whose FQN matches: foo.bar.x -> foo.x -> x.
+        while scope:
+            counters["resolver.probes"] += 1
+            name = f"{scope}.{basename}"
+            if name in self.entities_by_fqn:
+                return sys.intern(name)
+
+            scope = scope.rpartition(".")[0]
+
+        return sys.intern(basename)
+
+
+def analyze_file(filename, module_name=None, stats=None, lazy=False, templates=None):
+    """Analyze a file without adding it to an index.  This is safe to
+    call from worker processes.
+
+    Parameters:
+      filename(str)
+      module_name(str)
+      stats(Stats): Optional.  Receives the analyzer's instrumentation.
+      lazy(bool): Whether or not to skip function bodies.
+      templates(TemplateCache): Optional.  Used to avoid analyzing
+        files whose contents were already analyzed.
+
+    Returns:
+      tuple[Module, FileStamp]
+    """
+    filename = os.path.abspath(filename)
+    with open(filename, "rb") as f:
+        module_name = module_name or find_qualified_name(filename)
+        source_bytes = f.read()
+
+    stamp = FileStamp.from_source(filename, source_bytes)
+    if templates is not None:
+        return templates.analyze(filename, module_name, decode_source(source_bytes), stamp.digest, stats, lazy), stamp
+
+    analyzer = Analyzer(filename, module_name, decode_source(source_bytes), stats, lazy)
+    return analyzer.analyze(), stamp
+
+
+def _modules_under(stamps, paths):
+    # The modules whose files are, or are under, one of the given paths
+    # and no longer exist.
+    paths = [os.path.abspath(path) for path in paths]
+    if not paths:
+        return []
+
+    prefixes = tuple(os.path.join(path, "") for path in paths)
+    paths = set(paths)
+    return [
+        module_name for module_name, stamp in stamps.items()
+        if (stamp.filename in paths or stamp.filename.startswith(prefixes)) and not os.path.exists(stamp.filename)
+    ]
+
+
+def _is_symbol(entity, scopes):
+    # Locals and imported names would drown out the definitions people
+    # search for.
+    if isinstance(entity, Module):
+        return True
+    if isinstance(entity, Import):
+        return False
+
+    bindings = scopes.get(entity.name.rpartition(".")[0])
+    return bindings is not None and bindings.kind in (Module, Class)
+
+
+def _expand_scope(scope, expanded):
+    definitions = []
+    for definition in scope.definitions:
+        if isinstance(definition, LazyFunction):
+            definition = expanded.get((definition.name, definition.source_location.start), definition)
+        elif isinstance(definition, Class):
+            definition = _expand_scope(definition, expanded)
+
+        definitions.append(definition)
+
+    return scope._replace(definitions=definitions)
+
+
+#: The (start, body) pairs of a module's lazy functions, along with the
+#: stamp and the functions they were read for.
+_LazySources = namedtuple("_LazySources", ("stamp", "functions", "bodies"))
+
+
+def _is_unchanged(stamp):
+    try:
+        st = os.stat(stamp.filename)
+    except OSError:
+        return False
+    return st.st_mtime_ns == stamp.mtime and st.st_size == stamp.size
+
+
+def _read_fresh_source(stamp):
+    try:
+        with open(stamp.filename, "rb") as f:
+            source_bytes = f.read()
+    except OSError:
+        return None
+
+    if _digest(source_bytes) != stamp.digest:
+        return None
+    return decode_source(source_bytes)
+
+
+def _scope(name):
+    return name.rpartition(".")[0]
+
+
+def _basename(name):
+    return name.rpartition(".")[2]
+
+
+def _digest(source_bytes):
+    return hashlib.sha1(source_bytes).hexdigest()
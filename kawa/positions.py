@@ -0,0 +1,87 @@
+"""Position indexes map source positions to the entities that cover
+them.  Every module gets its own index, built once when the module is
+indexed.
+"""
+from bisect import bisect_left, bisect_right
+
+#: Positions are packed into single integers so that they can be
+#: compared and bisected cheaply.
+_COLUMN_BITS = 32
+
+
+class PositionIndex:
+    """An index of the source spans of a module's entities sorted by
+    their start position.  Since Python's syntax nests, spans are
+    either disjoint or contained within one another, so the innermost
+    entity at a position is always either the last entity that starts
+    before it or one of that entity's ancestors.
+
+    Parameters:
+      entities(iterable): Entities with a source_location.
+    """
+
+    __slots__ = ("starts", "ends", "parents", "entities")
+
+    def __init__(self, entities):
+        # Outer spans sort before the inner spans that start at the
+        # same position so that the innermost span is always last.
+        spans = sorted(
+            (_pack(*entity.source_location.start), -_pack(*entity.source_location.end), i, entity)
+            for i, entity in enumerate(entities)
+        )
+
+        self.starts = [start for start, _, _, _ in spans]
+        self.ends = [-end for _, end, _, _ in spans]
+        self.entities = [entity for _, _, _, entity in spans]
+        self.parents = parents = []
+        stack = []
+        for i, (start, end) in enumerate(zip(self.starts, self.ends)):
+            while stack and self.ends[stack[-1]] <= start:
+                stack.pop()
+
+            parents.append(stack[-1] if stack else -1)
+            stack.append(i)
+
+    def __len__(self):
+        return len(self.entities)
+
+    def lookup(self, line_number, column_offset):
+        """Find the innermost entity whose span contains a position.
+
+        Returns:
+          The entity or None.
+        """
+        position = _pack(line_number, column_offset)
+        i = bisect_right(self.starts, position) - 1
+        while i != -1:
+            if position < self.ends[i]:
+                return self.entities[i]
+
+            i = self.parents[i]
+
+        return None
+
+    def lookup_range(self, first_line, last_line):
+        """Find every entity whose span overlaps the given lines,
+        including the entities that enclose them, in source order.
+
+        Returns:
+          list
+        """
+        lo = _pack(first_line, 0)
+        hi = _pack(last_line + 1, 0)
+
+        enclosing = []
+        i = bisect_left(self.starts, lo) - 1
+        while i != -1:
+            if lo < self.ends[i]:
+                enclosing.append(self.entities[i])
+
+            i = self.parents[i]
+
+        enclosing.reverse()
+        return enclosing + self.entities[bisect_left(self.starts, lo):bisect_left(self.starts, hi)]
+
+
+def _pack(line_number, column_offset):
+    return (line_number << _COLUMN_BITS) | column_offset
@@ -0,0 +1,153 @@
+"""Whole-project indexing.  Files are analyzed in parallel by a pool
+of worker processes and the resulting trees are merged into a single
+Indexer by the parent process.
+"""
+import os
+import time
+import warnings
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from .common import find_python_files, find_qualified_name, find_vc_root
+from .indexer import Indexer, TemplateCache, analyze_file
+from .stats import Stats
+
+#: Deduplicates analyses within worker processes.
+_templates = TemplateCache()
+
+
+class IndexReport(namedtuple("IndexReport", ("files", "bytes", "failures", "elapsed", "deduplicated"))):
+    """Summarizes a project indexing run.  Deduplicated files are the
+    ones whose contents were identical to those of a file that was
+    analyzed before, so they didn't have to be parsed.
+    """
+
+    @property
+    def files_per_second(self):
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def megabytes_per_second(self):
+        return self.bytes / 1024 / 1024 / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"Indexed {self.files} files ({self.bytes / 1024 / 1024:.2f} MB) in {self.elapsed:.2f}s: "
+            f"{self.files_per_second:.1f} files/s, {self.megabytes_per_second:.2f} MB/s, "
+            f"{len(self.failures)} failed, {self.deduplicated} deduplicated."
+        )
+
+
+def find_project_modules(root):
+    """Find every Python module under root along with its fully
+    qualified name.
+
+    Parameters:
+      root(str)
+
+    Raises:
+      ValueError: If no vc root can be found.
+
+    Returns:
+      list[tuple[str, str]]: (filename, module_name) pairs.
+    """
+    root = os.path.abspath(root)
+    find_vc_root(os.path.join(root, "__init__.py"))
+    return [(filename, find_qualified_name(filename)) for filename in find_python_files(root)]
+
+
+def index_project(root, indexer=None, jobs=None, progress=None):
+    """Index every Python module under root.
+
+    Parameters:
+      root(str)
+      indexer(Indexer): The indexer to add the modules to.  A new one
+        is created if this is not provided.
+      jobs(int): The number of worker processes to use.  Defaults to
+        the number of CPUs.  Analysis happens in-process when this is 1.
+      progress(callable): Called with the number of files processed
+        so far and the total number of files after every file.
+
+    Returns:
+      tuple[Indexer, IndexReport]
+    """
+    indexer = indexer or Indexer()
+    jobs = jobs or os.cpu_count() or 1
+    modules = [
+        (filename, module_name) for filename, module_name in find_project_modules(root)
+        if indexer.needs_indexing(filename, module_name)
+    ]
+
+    start = time.monotonic()
+    analyzed, failures, total_bytes, deduplicated = [], [], 0, 0
+    analyzing = analyze_modules([module + (indexer.lazy,) for module in modules], jobs, indexer.templates)
+    for filename, result, stats in analyzing:
+        indexer.stats.merge(stats)
+        deduplicated += stats.counters["cache.templates.hits"]
+        if isinstance(result, Exception):
+            failures.append((filename, result))
+        else:
+            analyzed.append(result)
+            total_bytes += result[1].size
+
+        if progress:
+            progress(len(analyzed) + len(failures), len(modules))
+
+    indexer.add_modules(analyzed)
+    return indexer, IndexReport(len(analyzed), total_bytes, failures, time.monotonic() - start, deduplicated)
+
+
+def analyze_modules(modules, jobs, templates=None, executor=None):
+    """Analyze many modules, in parallel unless jobs is 1.  Results are
+    produced in the same order as the modules.
+
+    Parameters:
+      modules(list[tuple[str, str, bool]]): (filename, module_name, lazy)
+        triples.
+      jobs(int): The number of worker processes to use.
+      templates(TemplateCache): Deduplicates analyses when they happen
+        in-process.
+      executor(ProcessPoolExecutor): A pool of jobs workers to analyze
+        the modules on.  A new pool is started and shut down for every
+        call otherwise.
+
+    Returns:
+      generator[tuple[str, tuple[Module, FileStamp] | Exception, Stats]]
+    """
+    if jobs == 1 or len(modules) < 2:
+        for module in modules:
+            yield analyze_module(module, templates)
+        return
+
+    # Large chunks amortize the cost of shipping work to the workers
+    # while still keeping every worker busy until the end of the run.
+    chunksize = max(1, min(64, len(modules) // (jobs * 4)))
+    if executor is not None:
+        yield from executor.map(analyze_module, modules, chunksize=chunksize)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(analyze_module, modules, chunksize=chunksize)
+
+
+def analyze_module(module, templates=None):
+    """Analyze a single module.  Errors that make the file impossible
+    to analyze are returned rather than raised.
+
+    Parameters:
+      module(tuple[str, str, bool]): A (filename, module_name, lazy) triple.
+      templates(TemplateCache)
+
+    Returns:
+      tuple[str, tuple[Module, FileStamp] | Exception, Stats]
+    """
+    filename, module_name, lazy = module
+    stats = Stats()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            templates = _templates if templates is None else templates
+            return filename, analyze_file(filename, module_name, stats, lazy, templates), stats
+    except (OSError, SyntaxError, UnicodeDecodeError, ValueError, RecursionError) as e:
+        return filename, e, stats
@@ -0,0 +1,188 @@
+"""The server keeps a single Indexer resident and answers lookup
+requests from editors over newline-delimited JSON-RPC messages.
+
+Every request is a JSON object on its own line:
+
+  {"jsonrpc": "2.0", "id": 1, "method": "describe",
+   "params": {"filename": "foo.py", "line": 1, "column": 0}}
+
+Every response is written on its own line as soon as it is available
+and carries the id of the request it answers, so clients may pipeline
+as many requests as they like without waiting for replies.
+"""
+import contextlib
+import inspect
+import json
+
+from itertools import islice
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class RequestError(Exception):
+    """Raised when a request cannot be handled.
+    """
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def describe(indexer, filename, line, column):
+    indexer.ensure_indexed(filename)
+    return indexer.lookup_metadata(filename, line, column)
+
+
+def find_definition(indexer, filename, line, column):
+    indexer.ensure_indexed(filename)
+    return indexer.lookup_definition(filename, line, column)
+
+
+def find_usages(indexer, filename, line, column, limit=None, by_file=False):
+    indexer.ensure_indexed(filename)
+    return list(islice(indexer.iter_references(filename, line, column, by_file), limit))
+
+
+def find_callers(indexer, filename, line, column, depth=1):
+    indexer.ensure_indexed(filename)
+    return indexer.lookup_callers(filename, line, column, depth)
+
+
+def find_callees(indexer, filename, line, column, depth=1):
+    indexer.ensure_indexed(filename)
+    return indexer.lookup_callees(filename, line, column, depth)
+
+
+def describe_range(indexer, filename, first_line, last_line):
+    indexer.ensure_indexed(filename)
+    return [entity.metadata for entity in indexer.lookup_entities_between(filename, first_line, last_line)]
+
+
+def search(indexer, query, limit=20):
+    return indexer.search_symbols(query, limit)
+
+
+def index(indexer, filename):
+    indexer.ensure_indexed(filename)
+    return True
+
+
+def stats(indexer, reset=False):
+    result = indexer.stats.as_dict()
+    if reset:
+        indexer.stats.reset()
+    return result
+
+
+METHODS = {
+    "describe": describe,
+    "find_definition": find_definition,
+    "find_usages": find_usages,
+    "find_callers": find_callers,
+    "find_callees": find_callees,
+    "describe_range": describe_range,
+    "search": search,
+    "index": index,
+    "stats": stats,
+}
+
+
+def handle_request(indexer, request):
+    """Handle a single decoded request.
+
+    Parameters:
+      indexer(Indexer)
+      request(dict)
+
+    Returns:
+      dict: The response to send back to the client.
+    """
+    request_id = request.get("id") if isinstance(request, dict) else None
+    try:
+        result = dispatch(indexer, request)
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+    except RequestError as e:
+        return _error(request_id, e.code, e.message)
+    except Exception as e:
+        return _error(request_id, INTERNAL_ERROR, f"{type(e).__name__}: {e}")
+
+
+def dispatch(indexer, request, methods=METHODS):
+    """Call the method a request refers to and return its result.
+
+    Parameters:
+      indexer(Indexer)
+      request(dict)
+      methods(dict): Maps method names to the functions that
+        implement them.
+
+    Raises:
+      RequestError: If the request is malformed.
+    """
+    if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+        raise RequestError(INVALID_REQUEST, "Requests must be objects with a 'method'.")
+
+    method = request["method"]
+    try:
+        fn = methods[method]
+    except KeyError:
+        raise RequestError(METHOD_NOT_FOUND, f"Unknown method {method!r}.")
+
+    params = request.get("params", {})
+    try:
+        if isinstance(params, list):
+            arguments = inspect.signature(fn).bind(indexer, *params)
+        elif isinstance(params, dict):
+            arguments = inspect.signature(fn).bind(indexer, **params)
+        else:
+            raise TypeError("params must be an array or an object")
+    except TypeError as e:
+        raise RequestError(INVALID_PARAMS, str(e))
+
+    return fn(*arguments.args, **arguments.kwargs)
+
+
+def serve_stdio(indexer, infile, outfile, lock=None):
+    """Answer requests read from infile until it is closed or an
+    "exit" request is received.
+
+    Parameters:
+      indexer(Indexer)
+      infile(file): A text file to read requests from.
+      outfile(file): A text file to write responses to.
+      lock(Lock): Held while handling every request, so that other
+        threads (eg. a ProjectWatcher) can update the indexer safely.
+    """
+    lock = lock or contextlib.nullcontext()
+    while True:
+        line = infile.readline()
+        if not line:
+            return
+
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = _error(None, PARSE_ERROR, str(e))
+        else:
+            if isinstance(request, dict) and request.get("method") == "exit":
+                return
+
+            with lock:
+                response = handle_request(indexer, request)
+
+        outfile.write(json.dumps(response))
+        outfile.write("\n")
+        outfile.flush()
+
+
+def _error(request_id, code, message):
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
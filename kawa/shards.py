@@ -0,0 +1,418 @@
+"""Sharded indexes for projects that are too large to index in a
+single process.
+
+A project's modules are split into shards by top-level package (every
+top-level directory or module under the project's root is a shard
+and the modules directly under the root share one) or by configurable
+path prefixes.  Every shard is indexed by its own worker process and
+saved to its own file, and a manifest records the files each shard
+was built from, so that only the shards whose files changed have to
+be rebuilt.
+
+A ShardedIndex answers lookups from the shards in a directory.  It
+loads shards as lookups need them, routes definition lookups to the
+shard that owns the file (and follows imports into the shards that
+own their targets) and fans reference lookups out to every shard.
+"""
+import json
+import os
+import re
+import time
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+from heapq import merge
+from itertools import chain
+
+from .analyzer import Import
+from .common import write_atomically
+from .indexer import Indexer
+from .project import IndexReport, analyze_module, find_project_modules
+from .stats import Stats
+
+SHARDS_FORMAT_VERSION = 1
+
+#: The shard of the modules that live directly under a project's root.
+ROOT_SHARD = "."
+
+
+def shard_key(path, prefixes=()):
+    """Find the shard a file belongs to.
+
+    Parameters:
+      path(str): The file's path, relative to the project's root.
+      prefixes(list[str]): Path prefixes (eg. "services/billing") that
+        get shards of their own.  The longest matching one wins.
+
+    Returns:
+      str: The matching prefix or else the file's top-level directory
+      or module name.
+    """
+    path = path.replace(os.sep, "/")
+    for prefix in sorted((prefix.strip("/") for prefix in prefixes), key=len, reverse=True):
+        if path.startswith(f"{prefix}/"):
+            return prefix
+
+    head, sep, _ = path.partition("/")
+    return head if sep else ROOT_SHARD
+
+
+def index_shards(directory, root, prefixes=(), jobs=None, rebuild=False, lazy=False, progress=None):
+    """Index the shards of a project whose files changed since they
+    were last indexed into a directory and update its manifest.
+    Shards are indexed in parallel, one per worker process, and shards
+    that no longer have any modules are deleted.
+
+    Parameters:
+      directory(str): Where to keep the shards and the manifest.
+      root(str): The project's root.
+      prefixes(list[str]): See shard_key.
+      jobs(int): The number of worker processes to use.  Defaults to
+        the number of CPUs.
+      rebuild(bool): Whether or not to rebuild shards that are up to
+        date.
+      lazy(bool): Whether or not to only index the outlines of modules.
+        See Indexer.
+      progress(callable): Called with the key of every shard and its
+        IndexReport, or None if it was up to date, as shards finish.
+
+    Raises:
+      ValueError: If no vc root can be found.
+
+    Returns:
+      dict[str, IndexReport]: The reports of the shards that were
+      indexed, by key.
+    """
+    directory, root = os.path.abspath(directory), os.path.abspath(root)
+    os.makedirs(directory, exist_ok=True)
+    manifest = _read_manifest(directory)
+    if manifest.get("root") != root or manifest.get("prefixes") != list(prefixes) or manifest.get("lazy") != lazy:
+        manifest = {}
+
+    modules_by_shard = {}
+    for filename, module_name in find_project_modules(root):
+        key = shard_key(os.path.relpath(filename, root), prefixes)
+        modules_by_shard.setdefault(key, []).append((filename, module_name))
+
+    shards, tasks = manifest.get("shards", {}), []
+    for key, modules in sorted(modules_by_shard.items()):
+        shard = shards.get(key)
+        if rebuild or shard is None or _is_stale(root, shard, modules):
+            tasks.append((key, root, modules, os.path.join(directory, _shard_filename(key)), lazy))
+        elif progress:
+            progress(key, None)
+
+    reports = {}
+    for key, stamps, external, report in _build_all(tasks, jobs or os.cpu_count() or 1):
+        shards[key] = {"path": _shard_filename(key), "modules": stamps, "external": external}
+        reports[key] = report
+        if progress:
+            progress(key, report)
+
+    for key in set(shards) - set(modules_by_shard):
+        _remove(os.path.join(directory, shards.pop(key)["path"]))
+
+    manifest = {
+        "version": SHARDS_FORMAT_VERSION,
+        "root": root,
+        "prefixes": list(prefixes),
+        "lazy": lazy,
+        "shards": shards,
+    }
+    write_atomically(_manifest_path(directory), json.dumps(manifest, indent=2).encode())
+    return reports
+
+
+class ShardedIndex:
+    """Answers lookups from the shards built by index_shards.  Shards
+    are loaded the first time a lookup needs them and every shard has
+    this index attached to it (see Indexer.attach) so that imports
+    are followed into the shards that own their targets.
+
+    Attributes:
+      directory(str)
+      root(str): The root of the project the shards were built from.
+      shards(dict[str, Indexer]): The shards that were loaded so far,
+        by key.
+      shards_by_module(dict[str, str]): Maps module names to the keys
+        of the shards that own them.
+      shards_referencing(dict[str, list[str]]): Maps names to the keys
+        of the shards that refer to them without defining them.
+      stats(Stats): Instrumentation shared with every loaded shard.
+
+    Parameters:
+      directory(str): A directory that index_shards built shards in.
+        A ShardedIndex over a directory without shards is empty.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.shards = {}
+        self.stats = Stats()
+        self.environments = []
+
+        manifest = _read_manifest(self.directory)
+        self.root = manifest.get("root")
+        self.prefixes = manifest.get("prefixes", [])
+        self.lazy = manifest.get("lazy", False)
+        shards = manifest.get("shards", {})
+        self.paths = {key: os.path.join(self.directory, shard["path"]) for key, shard in shards.items()}
+        self.shards_by_module = {module_name: key for key, shard in shards.items() for module_name in shard["modules"]}
+        self.shards_referencing = {}
+        for key, shard in sorted(shards.items()):
+            for name in shard["external"]:
+                self.shards_referencing.setdefault(name, []).append(key)
+
+    def attach(self, environment):
+        """Attach a prebuilt environment index to every shard.  See
+        Indexer.attach.
+
+        Parameters:
+          environment(Environment)
+        """
+        self.environments.append(environment)
+        for shard in self.shards.values():
+            shard.attach(environment)
+
+    def shard(self, key):
+        """Get a shard, loading it if necessary.  Shards that are
+        missing or unusable are replaced by empty ones and the files
+        of shards that changed since they were built are re-indexed.
+
+        Parameters:
+          key(str)
+
+        Returns:
+          Indexer
+        """
+        try:
+            return self.shards[key]
+        except KeyError:
+            pass
+
+        shard = None
+        if key in self.paths:
+            try:
+                with self.stats.timed("shards.load"):
+                    shard = Indexer.load(self.paths[key])
+                self.stats.count("shards.loaded")
+            except (OSError, ValueError, EOFError):
+                pass
+
+        if shard is None:
+            shard = Indexer(self.lazy)
+
+        shard.stats = self.stats
+        shard.attach(self)
+        for environment in self.environments:
+            shard.attach(environment)
+
+        self.shards[key] = shard
+        return shard
+
+    def shard_of(self, filename):
+        """Get the shard that owns a file.
+
+        Returns:
+          Indexer
+        """
+        filename = os.path.abspath(filename)
+        if self.root is None:
+            return self.shard(ROOT_SHARD)
+        return self.shard(shard_key(os.path.relpath(filename, self.root), self.prefixes))
+
+    def lookup_metadata(self, filename, line_number, column_offset):
+        """See Indexer.lookup_metadata.
+        """
+        return self.shard_of(filename).lookup_metadata(filename, line_number, column_offset)
+
+    def lookup_definition(self, filename, line_number, column_offset, locate_imports=True):
+        """Look up the definition of an entity in the shard that owns
+        the file.  Imported names are followed into the shards that
+        own the modules they come from.  See Indexer.lookup_definition.
+        """
+        return self.shard_of(filename).lookup_definition(filename, line_number, column_offset, locate_imports)
+
+    def lookup_references(self, filename, line_number, column_offset):
+        """Look up the references of an entity across every shard.
+
+        Returns:
+          A list of dictionaries describing the entity's definition
+          followed by its references.
+        """
+        return list(self.iter_references(filename, line_number, column_offset))
+
+    def iter_references(self, filename, line_number, column_offset, by_file=False):
+        """Like lookup_references, but describe the references one at a
+        time.  The name at the location is resolved by the shard that
+        owns the file and its definition is looked up in the shard that
+        owns the name.  References are looked up in those shards and in
+        the shards that referred to the name when they were built.  The
+        ones from the shard that owns the file come first, followed by
+        the others in order of their keys, unless by_file is set, in
+        which case they are merged by filename and position.
+
+        Returns:
+          generator[dict]
+        """
+        owner = self.shard_of(filename)
+        name = owner.lookup_fqn(filename, line_number, column_offset)
+        if name is None:
+            return
+
+        definition = owner.entities_by_fqn.get(name)
+        if definition is None:
+            key = self._shard_defining(name)
+            definition = None if key is None else self.shard(key).entities_by_fqn.get(name)
+            if definition is None:
+                return
+
+        yield definition.metadata
+        keys = [self._shard_defining(name)] + self.shards_referencing.get(name, [])
+        shards = [owner] + [shard for shard in map(self.shard, sorted(filter(None, set(keys)))) if shard is not owner]
+        shard_references = [shard.iter_references_to(name, by_file) for shard in shards]
+        self.stats.count("shards.fan_out", len(shards))
+        if by_file:
+            yield from merge(*shard_references, key=_location_key)
+        else:
+            yield from chain.from_iterable(shard_references)
+
+    def lookup_name(self, name):
+        """Find the definition of an FQN in the shard that owns it.
+        Imports are followed across shards.  Shards look the targets of
+        their imports up through this method.
+
+        Parameters:
+          name(str)
+
+        Returns:
+          An object representing the definition, the last import that
+          couldn't be followed or None if no shard defines the name.
+        """
+        entity, seen = None, set()
+        while name not in seen:
+            seen.add(name)
+            key = self._shard_defining(name)
+            if key is None:
+                break
+
+            target = self.shard(key).entities_by_fqn.get(name)
+            if target is None:
+                break
+
+            entity = target
+            if not isinstance(entity, Import):
+                break
+
+            name = entity.target
+
+        return entity
+
+    def _shard_defining(self, name):
+        # Names belong to the shard of the longest module name that
+        # prefixes them.
+        while name:
+            key = self.shards_by_module.get(name)
+            if key is not None:
+                return key
+
+            name = name.rpartition(".")[0]
+
+        return None
+
+
+def _build_all(tasks, jobs):
+    if jobs == 1 or len(tasks) < 2:
+        for task in tasks:
+            yield _build_shard(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+        yield from executor.map(_build_shard, tasks)
+
+
+def _build_shard(task):
+    key, root, modules, path, lazy = task
+    indexer, analyzed, failures, total_bytes, deduplicated = Indexer(lazy), [], [], 0, 0
+    start = time.monotonic()
+    for filename, module_name in modules:
+        filename, result, stats = analyze_module((filename, module_name, lazy), indexer.templates)
+        deduplicated += stats.counters["cache.templates.hits"]
+        if isinstance(result, Exception):
+            failures.append((filename, result))
+        else:
+            analyzed.append(result)
+            total_bytes += result[1].size
+
+    indexer.add_modules(analyzed)
+    indexer.save(path)
+
+    # Modules that failed to analyze are recorded without a stamp so
+    # that the shard is rebuilt once they change.
+    stamps = {module_name: [os.path.relpath(filename, root), None, None] for filename, module_name in modules}
+    for module_name, stamp in indexer.stamps.items():
+        stamps[module_name] = [os.path.relpath(stamp.filename, root), stamp.mtime, stamp.size]
+
+    # Names the shard refers to but doesn't define (eg. names other
+    # shards define), so that reference lookups can skip the shards
+    # that can't refer to a name.
+    external = sorted(name for name in indexer.references_by_fqn if name not in indexer.entities_by_fqn)
+    failures = [(filename, str(error)) for filename, error in failures]
+    report = IndexReport(len(analyzed), total_bytes, failures, time.monotonic() - start, deduplicated)
+    return key, stamps, external, report
+
+
+def _is_stale(root, shard, modules):
+    stamps = shard["modules"]
+    if len(stamps) != len(modules):
+        return True
+
+    for filename, module_name in modules:
+        stamp = stamps.get(module_name)
+        if stamp is None or os.path.join(root, stamp[0]) != filename:
+            return True
+
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return True
+
+        if [st.st_mtime_ns, st.st_size] != stamp[1:]:
+            return True
+
+    return False
+
+
+def _location_key(reference):
+    location = reference["location"]
+    return location["filename"], location["line_number"], location["column_offset"]
+
+
+def _shard_filename(key):
+    # Keys are paths, so they're checksummed to keep the filenames of
+    # keys like "a/b" and "a_b" apart.
+    name = re.sub(r"[^\w.-]+", "_", key)
+    return f"{name}-{zlib.crc32(key.encode()):08x}.kawa-index"
+
+
+def _manifest_path(directory):
+    return os.path.join(directory, "manifest.json")
+
+
+def _read_manifest(directory):
+    try:
+        with open(_manifest_path(directory)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get("version") != SHARDS_FORMAT_VERSION:
+        return {}
+    return manifest
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
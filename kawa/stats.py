@@ -0,0 +1,110 @@
+"""Counters and timers that describe where kawa spends its time.
+
+Every Indexer owns a Stats object and shares it with the Analyzers it
+runs and with its copies.  Counter names are dotted paths:
+
+  analyzer.nodes.<type>   AST nodes visited, per node type
+  analyzer.definitions    definitions produced
+  analyzer.references     references produced
+  resolver.probes         scopes and names checked while resolving
+  cache.<name>.hits       lookups answered from a cache
+  cache.<name>.misses     lookups that had to do the work
+  calls.<phase>           calls made to a timed Indexer method
+
+Timers accumulate seconds under "parse", "walk", "index" (which
+includes resolving the references being indexed), "resolve" and
+"lookup.<kind>".
+"""
+import time
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+class Stats:
+    """Accumulates counters and timings.
+
+    Attributes:
+      counters(Counter[str])
+      timings(dict[str, float]): Seconds spent per phase.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.timings = defaultdict(float)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def hit(self, cache):
+        self.counters[f"cache.{cache}.hits"] += 1
+
+    def miss(self, cache):
+        self.counters[f"cache.{cache}.misses"] += 1
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] += seconds
+
+    @contextmanager
+    def timed(self, phase):
+        """Add the time spent inside the block to a phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] += time.perf_counter() - start
+
+    def merge(self, other):
+        """Add another Stats object's counters and timings to this one.
+
+        Parameters:
+          other(Stats or dict): A Stats object or the result of as_dict.
+        """
+        if isinstance(other, Stats):
+            counters, timings = other.counters, other.timings
+        else:
+            counters, timings = other["counters"], other["timings"]
+
+        self.counters.update(counters)
+        for phase, seconds in timings.items():
+            self.timings[phase] += seconds
+
+    def reset(self):
+        self.counters.clear()
+        self.timings.clear()
+
+    @property
+    def cache_hit_rates(self):
+        """dict[str, float]: The hit rate of every cache that was used.
+        """
+        caches = {
+            name[len("cache."):].rpartition(".")[0]
+            for name in self.counters if name.startswith("cache.")
+        }
+
+        rates = {}
+        for cache in caches:
+            hits, misses = self.counters[f"cache.{cache}.hits"], self.counters[f"cache.{cache}.misses"]
+            rates[cache] = hits / (hits + misses) if hits + misses else 0.0
+
+        return dict(sorted(rates.items()))
+
+    def as_dict(self):
+        """Returns:
+          dict: The stats in a form that can be serialized to JSON.
+        """
+        return {
+            "counters": dict(sorted(self.counters.items())),
+            "timings": dict(sorted(self.timings.items())),
+            "cache_hit_rates": self.cache_hit_rates,
+        }
+
+    def __str__(self):
+        lines = ["Timings:"]
+        lines.extend(f"  {phase:<40} {seconds * 1000:>12.2f}ms" for phase, seconds in sorted(self.timings.items()))
+        lines.append("Counters:")
+        lines.extend(f"  {name:<40} {value:>14}" for name, value in sorted(self.counters.items()))
+        lines.append("Cache hit rates:")
+        lines.extend(f"  {cache:<40} {rate * 100:>13.1f}%" for cache, rate in self.cache_hit_rates.items())
+        return "\n".join(lines)
@@ -0,0 +1,209 @@
+"""An index of definition names for workspace symbol search.
+
+Names are looked up by their last segment (their basename).  Every
+distinct basename is filed under a handful of search keys:
+
+  ^a, ^ab   its first one and two characters, for short prefix queries
+  abc       every trigram it contains, for substring queries
+  ~ab       the first two characters of every camel or snake case
+            fuzzy match, for queries like "gfn" -> "get_file_name"
+
+A query only ever looks at the basenames filed under its own keys and
+those candidates are then verified and ranked: exact matches first
+(case sensitive ones before the others), then prefix matches,
+substring matches and fuzzy matches, with shorter names winning ties.
+"""
+import re
+
+from itertools import groupby
+from operator import itemgetter
+
+from .common import CopyOnWrite
+
+_WORD_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+RANK_EXACT, RANK_EXACT_IGNORING_CASE, RANK_PREFIX, RANK_WORD, RANK_SUBSTRING, RANK_FUZZY = range(6)
+
+
+class SymbolIndex(CopyOnWrite):
+    """Maps search keys to the names of definitions.
+
+    Attributes:
+      names(dict[str, set[str]]): Maps basenames to the FQNs that end
+        with them.
+      postings(dict[str, set[str]]): Maps search keys to basenames.
+    """
+
+    def __init__(self):
+        self.names = {}
+        self.postings = {}
+        self._owned = set()
+
+    def __len__(self):
+        return sum(len(names) for names in self.names.values())
+
+    def add(self, name):
+        """Add a fully-qualified name to the index.
+
+        Parameters:
+          name(str)
+        """
+        basename = name.rpartition(".")[2]
+        if basename not in self.names:
+            for key in _search_keys(basename):
+                self._writable(self.postings, key, set).add(basename)
+
+        self._writable(self.names, basename, set).add(name)
+
+    def remove(self, name):
+        """Remove a fully-qualified name from the index.
+
+        Parameters:
+          name(str)
+        """
+        basename = name.rpartition(".")[2]
+        if name not in self.names.get(basename, ()):
+            return
+
+        names = self._writable(self.names, basename, set)
+        names.discard(name)
+        if names:
+            return
+
+        del self.names[basename]
+        for key in _search_keys(basename):
+            basenames = self._writable(self.postings, key, set)
+            basenames.discard(basename)
+            if not basenames:
+                del self.postings[key]
+
+    def search(self, query, limit=20):
+        """Find the names that best match a query.  Queries that contain
+        dots only match names whose scope contains the part of the
+        query before the last dot (eg. "reader.read").
+
+        Parameters:
+          query(str)
+          limit(int): The maximum number of names to return.
+
+        Returns:
+          list[str]: The matching names, best first.
+        """
+        qualifier, _, original_query = query.rpartition(".")
+        query, qualifier = original_query.lower(), qualifier.lower()
+        if not query:
+            return []
+
+        # Fuzzy matches rank below every other kind of match, so they
+        # are only looked at when there aren't enough of the others.
+        candidates = self._candidates(query)
+        names = self._expand((
+            (_rank(basename, query, original_query), basename) for basename in candidates
+        ), qualifier, limit)
+        if len(names) < limit and len(query) > 1:
+            names += self._expand((
+                (RANK_FUZZY, basename) for basename in self.postings.get(f"~{query[:2]}", ())
+                if basename not in candidates and _fuzzy_match(_split_words(basename), query)
+            ), qualifier, limit - len(names))
+
+        return names
+
+    def copy(self):
+        """Returns:
+          SymbolIndex: A copy of this index that can be updated without
+          affecting it.
+        """
+        self._owned = set()
+        index = type(self)()
+        index.names = self.names.copy()
+        index.postings = self.postings.copy()
+        return index
+
+    def _candidates(self, query):
+        # The basenames that may start with or contain the query.
+        postings = self.postings
+        if len(query) < 3:
+            return postings.get(f"^{query}", set())
+
+        trigrams = sorted((postings.get(query[i:i + 3], set()) for i in range(len(query) - 2)), key=len)
+        return trigrams[0].intersection(*trigrams[1:])
+
+    def _expand(self, ranked_basenames, qualifier, limit):
+        # Turn (rank, basename) pairs into the best names that end with
+        # those basenames without expanding more basenames than needed.
+        ranked_basenames = sorted(
+            (rank, len(basename), basename) for rank, basename in ranked_basenames if rank is not None
+        )
+
+        names = []
+        for _, group in groupby(ranked_basenames, key=itemgetter(0, 1)):
+            if len(names) >= limit:
+                break
+
+            names.extend(sorted(
+                (name for _, _, basename in group for name in self.names[basename]
+                 if not qualifier or qualifier in name[:-len(basename)].lower()),
+                key=lambda name: (len(name), name),
+            ))
+
+        return names[:limit]
+
+
+def _search_keys(basename):
+    lower = basename.lower()
+    keys = {f"^{lower[:1]}", f"^{lower[:2]}"}
+    keys.update(lower[i:i + 3] for i in range(len(lower) - 2))
+    words = _split_words(basename)
+    for i, word in enumerate(words):
+        if len(word) > 1:
+            keys.add(f"~{word[:2]}")
+        keys.update(f"~{word[0]}{other[0]}" for other in words[i + 1:])
+    return keys
+
+
+def _rank(basename, query, original_query):
+    lower = basename.lower()
+    if lower == query:
+        return RANK_EXACT if basename == original_query else RANK_EXACT_IGNORING_CASE
+    if lower.startswith(query):
+        return RANK_PREFIX
+
+    i = lower.find(query)
+    if i != -1:
+        return RANK_WORD if basename[i - 1] == "_" or basename[i].isupper() else RANK_SUBSTRING
+    return None
+
+
+def _fuzzy_match(words, query):
+    # Check whether the query can be split into prefixes of the given
+    # words, in order.  Words may be skipped.  next_words[i] is the
+    # lowest index of the word that can follow a match of query[:i].
+    # Lower is better since any later word may still be used, so that
+    # one index per position is enough to avoid backtracking.
+    if not _is_subsequence(query, "".join(words)):
+        return False
+
+    next_words = [0] + [None] * len(query)
+    for query_index in range(len(query)):
+        if next_words[query_index] is None:
+            continue
+
+        for i in range(next_words[query_index], len(words)):
+            word, length = words[i], 0
+            while length < len(word) and query_index + length < len(query) \
+                    and word[length] == query[query_index + length]:
+                length += 1
+                end = query_index + length
+                if next_words[end] is None or next_words[end] > i + 1:
+                    next_words[end] = i + 1
+
+    return next_words[len(query)] is not None
+
+
+def _is_subsequence(query, string):
+    characters = iter(string)
+    return all(character in characters for character in query)
+
+
+def _split_words(basename):
+    return [word.lower() for word in _WORD_RE.findall(basename)]
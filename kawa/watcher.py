@@ -0,0 +1,358 @@
+"""Watches a project for changes to its Python files so that a
+long-running kawa process can keep its index up to date.
+
+On Linux, changes are reported by inotify (through ctypes).  Anywhere
+else, or when inotify isn't available, the project is polled for
+changes to the mtimes and sizes of its files instead.
+
+Bursts of changes (eg. a `git checkout` touching thousands of files)
+are coalesced: a batch is only processed once no new changes have come
+in for a short while, its files are analyzed in parallel by a pool of
+worker processes and the results are applied to the index in a single
+incremental update.
+"""
+import ctypes
+import ctypes.util
+import multiprocessing
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .common import find_python_files, find_qualified_name, invalidate_caches, is_source_dirname
+from .project import analyze_modules
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+IN_CHANGES = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+WATCH_MASK = IN_CHANGES | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Reports changes under a directory using Linux's inotify.  Every
+    source directory under the root is watched, including the ones
+    that are created after the watcher is.
+
+    Parameters:
+      root(str)
+
+    Raises:
+      OSError: If inotify is not available.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.directories = {}
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise _errno_error("inotify_init1")
+
+        try:
+            self._watch_tree(self.root)
+        except OSError:
+            self.close()
+            raise
+
+    def read(self, timeout=None):
+        """Wait for changes.
+
+        Parameters:
+          timeout(float): The maximum number of seconds to wait.
+
+        Returns:
+          set[str]: The Python files and directories that changed.  An
+          empty set if nothing changed before the timeout.
+        """
+        if self._fd < 0 or not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+
+        try:
+            data = os.read(self._fd, 256 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed, offset = set(), 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += _EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped so everything has to be looked at.
+                changed.add(self.root)
+                continue
+
+            directory = self.directories.get(wd)
+            if directory is None:
+                continue
+
+            if mask & IN_IGNORED:
+                del self.directories[wd]
+                continue
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(directory)
+                continue
+
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if not is_source_dirname(os.path.basename(path)):
+                    continue
+
+                changed.add(path)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may have been added to the directory before
+                    # it was watched.  They are picked up by the scan of
+                    # the directory that the change triggers.
+                    self._watch_tree(path)
+
+            elif path.endswith(".py"):
+                changed.add(path)
+
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _watch_tree(self, root):
+        for dirpath, dirnames, _ in os.walk(root):
+            dirnames[:] = [dirname for dirname in dirnames if is_source_dirname(dirname)]
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                error = _errno_error("inotify_add_watch")
+                if dirpath == root and root == self.root:
+                    raise error
+                continue
+
+            self.directories[wd] = dirpath
+
+
+class PollingWatcher:
+    """Reports changes under a directory by periodically comparing the
+    mtimes and sizes of the Python files in it.
+
+    Parameters:
+      root(str)
+      interval(float): The number of seconds to wait between scans.
+    """
+
+    def __init__(self, root, interval=1.0):
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        self.files = self._scan()
+
+    def read(self, timeout=None):
+        """Wait for changes.  See InotifyWatcher.read.
+        """
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        files = self._scan()
+        changed = {
+            filename for filename in files.keys() | self.files.keys()
+            if files.get(filename) != self.files.get(filename)
+        }
+        self.files = files
+        return changed
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        files = {}
+        for filename in find_python_files(self.root):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+
+            files[filename] = st.st_mtime_ns, st.st_size
+        return files
+
+
+def make_watcher(root, polling=False, interval=1.0):
+    """Create the best watcher available on this platform.
+
+    Parameters:
+      root(str)
+      polling(bool): Whether or not to poll even if inotify is available.
+      interval(float): The polling interval, in seconds.
+
+    Returns:
+      InotifyWatcher or PollingWatcher
+    """
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root)
+        except OSError:
+            pass
+
+    return PollingWatcher(root, interval)
+
+
+class ProjectWatcher:
+    """Re-indexes the files that change under a project root on a
+    background thread.
+
+    Changes are collected until none have come in for `debounce`
+    seconds (or for at most `max_delay` seconds), then the changed
+    files are analyzed, in parallel when there are many of them, and
+    `apply` is called with the results.  Batches are analyzed on the
+    watcher's thread, so worker processes are spawned rather than
+    forked (forking a multithreaded process can deadlock) and they are
+    kept around between batches.  Files that fail to analyze
+    (eg. because they're being edited) are skipped and keep their
+    previous version in the index.
+
+    Attributes:
+      failures(list[tuple[str, Exception]]): The files that couldn't be
+        analyzed in the last batch.
+      batches(int): The number of batches applied so far.
+
+    Parameters:
+      root(str)
+      apply(callable): Called with a list of (Module, FileStamp) pairs
+        and a list of removed paths.  Typically an indexer's
+        update_files method.
+      watcher: An InotifyWatcher or a PollingWatcher.  The best one
+        available is used by default.
+      debounce(float)
+      max_delay(float)
+      jobs(int): The number of worker processes to use.  Defaults to
+        the number of CPUs.
+      lazy(bool): Whether or not to only analyze the outlines of modules.
+    """
+
+    def __init__(self, root, apply, watcher=None, debounce=0.2, max_delay=2.0, jobs=None, lazy=False):
+        self.root = os.path.abspath(root)
+        self.apply = apply
+        self.watcher = watcher or make_watcher(self.root)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.jobs = jobs or os.cpu_count() or 1
+        self.lazy = lazy
+        self.failures = []
+        self.batches = 0
+        self._executor = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="kawa-watcher", daemon=True)
+
+    def start(self):
+        if self.jobs > 1:
+            self._executor = ProcessPoolExecutor(self.jobs, mp_context=multiprocessing.get_context("spawn"))
+
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.watcher.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def process(self, paths):
+        """Analyze and apply a batch of changed paths right away.
+
+        Parameters:
+          paths(set[str]): Changed files and directories.
+        """
+        changed, removed = [], []
+        for path in sorted(paths):
+            if os.path.isdir(path) or path.endswith("__init__.py"):
+                # Packages that appeared or went away change the names
+                # of the modules under them.
+                invalidate_caches(path if os.path.isdir(path) else os.path.dirname(path))
+
+            if os.path.isdir(path):
+                changed.extend(find_python_files(path))
+                removed.append(path)
+            elif os.path.isfile(path):
+                changed.append(path)
+            else:
+                removed.append(path)
+
+        modules, self.failures = [], []
+        for filename in dict.fromkeys(changed):
+            try:
+                modules.append((filename, find_qualified_name(filename), self.lazy))
+            except ValueError as e:
+                self.failures.append((filename, e))
+
+        analyzed = []
+        # Without a pool of spawned workers (ie. before the watcher is
+        # started), batches are analyzed in-process.
+        jobs = self.jobs if self._executor is not None else 1
+        for filename, result, _ in analyze_modules(modules, jobs, executor=self._executor):
+            if isinstance(result, Exception):
+                self.failures.append((filename, result))
+            else:
+                analyzed.append(result)
+
+        self.apply(analyzed, removed)
+        self.batches += 1
+
+    def _run(self):
+        while not self._stopped.is_set():
+            paths = self.watcher.read(timeout=0.5)
+            if not paths:
+                continue
+
+            deadline = time.monotonic() + self.max_delay
+            while not self._stopped.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                more = self.watcher.read(timeout=min(self.debounce, remaining))
+                if not more:
+                    break
+
+                paths |= more
+
+            try:
+                self.process(paths)
+            except Exception as e:
+                self.failures = [(self.root, e)]
+
+
+def _load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError("inotify is not available.")
+
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+def _errno_error(function):
+    errno = ctypes.get_errno()
+    return OSError(errno, f"{function}: {os.strerror(errno)}")
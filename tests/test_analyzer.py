@@ -1,6 +1,8 @@
 import pytest
 
-from kawa.analyzer import SourceLocation, Module, Class, Function, Variable, Reference, Analyzer
+from kawa.analyzer import (
+    SourceLocation, Module, Class, Function, Variable, Reference, Call, Import, Analyzer, bind_template,
+)
 
 
 @pytest.mark.parametrize("module_name,module_source,expected_output", [
@@ -15,7 +17,7 @@ from kawa.analyzer import SourceLocation, Module, Class, Function, Variable, Ref
         Module(
             name="kawa.example",
             docstring="This module does something.",
-            source_location=SourceLocation("<example>", 0, 0),
+            source_location=SourceLocation("<example>", 0, 0, 4, 8),
             definitions=[],
             references=[],
         )
@@ -32,23 +34,23 @@ z, a = (1, 2)
 
         Module(
             name="kawa.example",
-            source_location=SourceLocation("<example>", 0, 0),
+            source_location=SourceLocation("<example>", 0, 0, 5, 8),
             definitions=[
                 Variable(
                     name="kawa.example.x",
-                    source_location=SourceLocation("<example>", 2, 0),
+                    source_location=SourceLocation("<example>", 2, 0, 2, 1),
                 ),
                 Variable(
                     name="kawa.example.y",
-                    source_location=SourceLocation("<example>", 3, 0),
+                    source_location=SourceLocation("<example>", 3, 0, 3, 1),
                 ),
                 Variable(
                     name="kawa.example.z",
-                    source_location=SourceLocation("<example>", 4, 0),
+                    source_location=SourceLocation("<example>", 4, 0, 4, 1),
                 ),
                 Variable(
                     name="kawa.example.a",
-                    source_location=SourceLocation("<example>", 4, 3),
+                    source_location=SourceLocation("<example>", 4, 3, 4, 4),
                 )
             ],
         ),
@@ -69,19 +71,19 @@ def g():
 
         Module(
             name="kawa.example",
-            source_location=SourceLocation("<example>", 0, 0),
+            source_location=SourceLocation("<example>", 0, 0, 9, 8),
             definitions=[
                 Function(
                     name="kawa.example.f",
                     arguments=[],
                     docstring="This function returns the number 42.",
-                    source_location=SourceLocation("<example>", 2, 0),
+                    source_location=SourceLocation("<example>", 2, 0, 5, 13),
                 ),
                 Function(
                     name="kawa.example.g",
                     arguments=[],
                     docstring=None,
-                    source_location=SourceLocation("<example>", 7, 0),
+                    source_location=SourceLocation("<example>", 7, 0, 8, 8),
                 )
             ],
         )
@@ -104,38 +106,38 @@ class Reader:
 
         Module(
             name="kawa.example",
-            source_location=SourceLocation("<example>", 0, 0),
+            source_location=SourceLocation("<example>", 0, 0, 11, 8),
             definitions=[
                 Class(
                     name="kawa.example.Reader",
-                    source_location=SourceLocation("<example>", 2, 0),
+                    source_location=SourceLocation("<example>", 2, 0, 10, 33),
                     definitions=[
                         Function(
                             name="kawa.example.Reader.__init__",
                             arguments=["self", "filename"],
-                            source_location=SourceLocation("<example>", 3, 4),
+                            source_location=SourceLocation("<example>", 3, 4, 5, 39),
                             definitions=[
                                 Variable(
                                     name="kawa.example.Reader.__init__.self",
-                                    source_location=SourceLocation("<example>", 3, 17),
+                                    source_location=SourceLocation("<example>", 3, 17, 3, 21),
                                 ),
                                 Variable(
                                     name="kawa.example.Reader.__init__.filename",
-                                    source_location=SourceLocation("<example>", 3, 23),
+                                    source_location=SourceLocation("<example>", 3, 23, 3, 31),
                                 ),
                             ],
                             references=[
                                 Reference(
                                     name="kawa.example.Reader.__init__.filename",
-                                    source_location=SourceLocation("<example>", 4, 24),
+                                    source_location=SourceLocation("<example>", 4, 24, 4, 32),
                                 ),
-                                Reference(
+                                Call(
                                     name="kawa.example.Reader.__init__.open",
-                                    source_location=SourceLocation("<example>", 5, 20),
+                                    source_location=SourceLocation("<example>", 5, 20, 5, 24),
                                 ),
                                 Reference(
                                     name="kawa.example.Reader.__init__.filename",
-                                    source_location=SourceLocation("<example>", 5, 25),
+                                    source_location=SourceLocation("<example>", 5, 25, 5, 33),
                                 ),
                             ],
                         ),
@@ -143,15 +145,15 @@ class Reader:
                             name="kawa.example.Reader.read",
                             arguments=["self", "count"],
                             docstring='Reads "count" bytes from a file.',
-                            source_location=SourceLocation("<example>", 7, 4),
+                            source_location=SourceLocation("<example>", 7, 4, 10, 33),
                             definitions=[
                                 Variable(
                                     name="kawa.example.Reader.read.self",
-                                    source_location=SourceLocation("<example>", 7, 13),
+                                    source_location=SourceLocation("<example>", 7, 13, 7, 17),
                                 ),
                                 Variable(
                                     name="kawa.example.Reader.read.count",
-                                    source_location=SourceLocation("<example>", 7, 19),
+                                    source_location=SourceLocation("<example>", 7, 19, 7, 24),
                                 ),
                             ],
                             references=[],
@@ -174,17 +176,17 @@ def f():
 
         Module(
             name="kawa.example",
-            source_location=SourceLocation("<example>", 0, 0),
+            source_location=SourceLocation("<example>", 0, 0, 6, 8),
             definitions=[
                 Function(
                     name="kawa.example.f",
                     arguments=[],
-                    source_location=SourceLocation("<example>", 2, 0),
+                    source_location=SourceLocation("<example>", 2, 0, 5, 12),
                     definitions=[
                         Function(
                             name="kawa.example.f.g",
                             arguments=[],
-                            source_location=SourceLocation("<example>", 3, 4),
+                            source_location=SourceLocation("<example>", 3, 4, 4, 17),
                             definitions=[],
                             references=[],
                         )
@@ -192,7 +194,7 @@ def f():
                     references=[
                         Reference(
                             name="kawa.example.f.g",
-                            source_location=SourceLocation("<example>", 5, 11),
+                            source_location=SourceLocation("<example>", 5, 11, 5, 12),
                         )
                     ],
                 ),
@@ -211,17 +213,19 @@ def f(a, b=None, *args, **kwargs):
 
         Module(
             name="kawa.example",
-            source_location=SourceLocation("<example>", 0, 0),
+            source_location=SourceLocation("<example>", 0, 0, 4, 8),
             definitions=[
                 Function(
                     name="kawa.example.f",
                     arguments=["a", "b", "*args", "**kwargs"],
-                    source_location=SourceLocation("<example>", 2, 0),
+                    source_location=SourceLocation("<example>", 2, 0, 3, 8),
                     definitions=[
-                        Variable(name="kawa.example.f.a", source_location=SourceLocation("<example>", 2, 6)),
-                        Variable(name="kawa.example.f.b", source_location=SourceLocation("<example>", 2, 9)),
-                        Variable(name="kawa.example.f.args", source_location=SourceLocation("<example>", 2, 18)),
-                        Variable(name="kawa.example.f.kwargs", source_location=SourceLocation("<example>", 2, 26)),
+                        Variable(name="kawa.example.f.a", source_location=SourceLocation("<example>", 2, 6, 2, 7)),
+                        Variable(name="kawa.example.f.b", source_location=SourceLocation("<example>", 2, 9, 2, 10)),
+                        Variable(name="kawa.example.f.args", source_location=SourceLocation("<example>", 2, 18, 2, 22)),
+                        Variable(
+                            name="kawa.example.f.kwargs", source_location=SourceLocation("<example>", 2, 26, 2, 32),
+                        ),
                     ],
                 )
             ],
@@ -241,28 +245,135 @@ def g():
 
         Module(
             name="kawa.example",
-            source_location=SourceLocation("<example>", 0, 0),
+            source_location=SourceLocation("<example>", 0, 0, 7, 8),
             definitions=[
                 Function(
                     name="kawa.example.f",
                     arguments=[],
-                    source_location=SourceLocation("<example>", 2, 0),
+                    source_location=SourceLocation("<example>", 2, 0, 3, 8),
                 ),
                 Function(
                     name="kawa.example.g",
                     arguments=[],
-                    source_location=SourceLocation("<example>", 5, 0),
+                    source_location=SourceLocation("<example>", 5, 0, 6, 14),
                     references=[
-                        Reference(
+                        Call(
                             name="kawa.example.g.f",
-                            source_location=SourceLocation("<example>", 6, 11),
+                            source_location=SourceLocation("<example>", 6, 11, 6, 12),
                         )
                     ]
                 )
             ],
         )
+    ),
+
+    (
+        # Test call argument reference discovery
+        "kawa.example",
+        """
+f(1, x, key=y)
+        """,
+
+        Module(
+            name="kawa.example",
+            source_location=SourceLocation("<example>", 0, 0, 3, 8),
+            references=[
+                Call(
+                    name="kawa.example.f",
+                    source_location=SourceLocation("<example>", 2, 0, 2, 1),
+                ),
+                Reference(
+                    name="kawa.example.x",
+                    source_location=SourceLocation("<example>", 2, 5, 2, 6),
+                ),
+                Reference(
+                    name="kawa.example.y",
+                    source_location=SourceLocation("<example>", 2, 12, 2, 13),
+                ),
+            ],
+        )
+    ),
+
+    (
+        # Test import alias discovery
+        "kawa.example",
+        """
+import os.path, json as j
+from collections import OrderedDict as OD, namedtuple
+from . import common
+from ..other import *
+from .common import find_vc_root
+        """,
+
+        Module(
+            name="kawa.example",
+            source_location=SourceLocation("<example>", 0, 0, 7, 8),
+            definitions=[
+                Import(
+                    name="kawa.example.os",
+                    target="os",
+                    source_location=SourceLocation("<example>", 2, 7, 2, 14),
+                ),
+                Import(
+                    name="kawa.example.j",
+                    target="json",
+                    source_location=SourceLocation("<example>", 2, 16, 2, 25),
+                ),
+                Import(
+                    name="kawa.example.OD",
+                    target="collections.OrderedDict",
+                    source_location=SourceLocation("<example>", 3, 24, 3, 41),
+                ),
+                Import(
+                    name="kawa.example.namedtuple",
+                    target="collections.namedtuple",
+                    source_location=SourceLocation("<example>", 3, 43, 3, 53),
+                ),
+                Import(
+                    name="kawa.example.common",
+                    target="kawa.common",
+                    source_location=SourceLocation("<example>", 4, 14, 4, 20),
+                ),
+                Import(
+                    name="kawa.example.find_vc_root",
+                    target="kawa.common.find_vc_root",
+                    source_location=SourceLocation("<example>", 6, 20, 6, 32),
+                ),
+            ],
+        )
     )
 ])
 def test_analyzer(module_name, module_source, expected_output):
     analyzer = Analyzer("<example>", module_name, module_source)
     assert analyzer.analyze() == expected_output
+
+
+TEMPLATE_SOURCE = """
+from . import sibling
+from .sibling import f as g
+from .. import cousin
+import os
+
+class A:
+    def m(self, x):
+        return g(x, os)
+"""
+
+
+@pytest.mark.parametrize("filename,module_name,lazy", [
+    ("/project/a/b/mod.py", "a.b.mod", False),
+    ("/project/a/b/__init__.py", "a.b", False),
+    ("/project/a/mod.py", "a.mod", True),
+    ("/project/mod.py", "mod", False),
+])
+def test_templates_bind_to_the_same_tree_as_direct_analysis(filename, module_name, lazy):
+    # Given a module analyzed as a template
+    template = Analyzer(None, None, TEMPLATE_SOURCE, lazy=lazy).analyze()
+
+    # When I bind it to a module name and a filename
+    module = bind_template(template, module_name, filename)
+
+    # Then I expect the result to match analyzing the module under that name
+    expected = Analyzer(filename, module_name, TEMPLATE_SOURCE, lazy=lazy).analyze()
+    assert [(type(entity), entity) for entity in module.flatten()] == \
+        [(type(entity), entity) for entity in expected.flatten()]
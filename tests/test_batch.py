@@ -0,0 +1,94 @@
+import io
+import json
+import os
+
+from kawa.batch import run_batch
+from kawa.indexer import Indexer
+from kawa.server import INTERNAL_ERROR, INVALID_PARAMS, INVALID_REQUEST, PARSE_ERROR
+
+
+def rel(path):
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), path))
+
+
+def batch(indexer, *queries):
+    infile = io.StringIO("".join(
+        query if isinstance(query, str) else json.dumps(query) + "\n"
+        for query in queries
+    ))
+    outfile = io.StringIO()
+    run_batch(indexer, infile, outfile, jobs=1)
+    return [json.loads(line) for line in outfile.getvalue().splitlines()]
+
+
+def test_batches_answer_queries_in_order(tmpdir):
+    # Given queries about a couple of files, interleaved
+    tmpdir.mkdir(".git")
+    tmpdir.join("a.py").write("x = 1\n")
+    reader, other = rel("examples/reader.py"), str(tmpdir.join("a.py"))
+
+    # When I run them
+    results = batch(
+        Indexer(),
+        {"id": 1, "op": "find_usages", "filename": reader, "line": 12, "column": 9},
+        {"id": 2, "op": "describe", "filename": other, "line": 1, "column": 0},
+        {"id": 3, "op": "find_definition", "filename": reader, "line": 18, "column": 10},
+    )
+
+    # Then I expect one result per query, in the order they were read
+    assert [result["id"] for result in results] == [1, 2, 3]
+    assert len(results[0]["result"]) == 2
+    assert results[1]["result"]["name"] == "a.x"
+    assert results[2]["result"]["name"] == "tests.examples.reader.read"
+
+
+def test_batches_index_every_file_at_most_once():
+    # Given an indexer
+    indexer = Indexer()
+
+    # When I run many queries about the same file
+    params = {"filename": rel("examples/reader.py"), "line": 18, "column": 10}
+    results = batch(indexer, *({"op": op, **params} for op in ("describe", "find_definition", "find_usages") * 10))
+
+    # Then I expect every one of them to be answered
+    assert all("result" in result for result in results)
+
+    # And I expect the file to have been analyzed a single time
+    assert indexer.stats.counters["analyzer.modules"] == 1
+
+
+def test_batches_find_callers_across_their_projects(tmpdir):
+    # Given a project where a function is called from a file no query refers to
+    tmpdir.mkdir(".git")
+    tmpdir.join("a.py").write("def f():\n    pass\n")
+    tmpdir.join("b.py").write("from a import f\n\ndef g():\n    f()\n")
+
+    # When I ask for the callers of the function
+    query = {"id": 1, "op": "find_callers", "filename": str(tmpdir.join("a.py")), "line": 1, "column": 4}
+    results = batch(Indexer(), query)
+
+    # Then I expect the caller in the other file to be found
+    assert [caller["name"] for caller in results[0]["result"]] == ["b.g"]
+
+
+def test_batches_report_errors_per_query(tmpdir):
+    # Given a file that can't be analyzed
+    tmpdir.mkdir(".git")
+    broken = tmpdir.join("broken.py")
+    broken.write("def (:\n")
+
+    # When I run a batch containing bad queries alongside good ones
+    results = batch(
+        Indexer(),
+        "not json\n",
+        {"id": 1, "filename": str(broken)},
+        {"id": 2, "op": "describe", "filename": str(broken), "line": 1, "column": 0},
+        {"id": 3, "op": "describe", "filename": rel("examples/reader.py")},
+        {"id": 4, "op": "describe", "filename": rel("examples/reader.py"), "line": 1, "column": 0},
+    )
+
+    # Then I expect every bad query to get its own error
+    assert [result.get("error", {}).get("code") for result in results] == [
+        PARSE_ERROR, INVALID_REQUEST, INTERNAL_ERROR, INVALID_PARAMS, None,
+    ]
+    assert results[4]["result"]["name"] == "tests.examples.reader.Reader"
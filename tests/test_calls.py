@@ -0,0 +1,79 @@
+import pytest
+
+from kawa.calls import CallGraph
+
+CALLS = [
+    ("app.main", "app.run"),
+    ("app.run", "app.step"),
+    ("app.run", "app.step"),
+    ("app.step", "app.helper"),
+    ("lib.core.work", "lib.core.leaf"),
+]
+
+
+@pytest.fixture
+def graph():
+    graph = CallGraph()
+    for caller, callee in CALLS:
+        graph.add(caller, callee)
+
+    # app.helper is bound by "from lib import work as helper" and lib
+    # re-exports lib.core.work.
+    graph.add_import("app.helper", "lib.work")
+    graph.add_import("lib.work", "lib.core.work")
+    return graph
+
+
+@pytest.mark.parametrize("name,callers,depth,expected", [
+    ("app.main", False, 1, [("app.run", 1)]),
+    ("app.main", False, 2, [("app.run", 1), ("app.step", 2)]),
+    ("app.main", False, None, [
+        ("app.run", 1), ("app.step", 2), ("app.helper", 3), ("lib.core.leaf", 4),
+    ]),
+    ("app.step", True, None, [("app.run", 1), ("app.main", 2)]),
+
+    # Callers of a definition include the callers of its imports
+    ("lib.core.work", True, 1, [("app.step", 1)]),
+    ("lib.core.leaf", True, None, [("lib.core.work", 1), ("app.step", 2), ("app.run", 3), ("app.main", 4)]),
+
+    # Nothing else
+    ("app.missing", False, None, []),
+    ("app.main", True, None, []),
+])
+def test_call_graphs_can_be_walked(graph, name, callers, depth, expected):
+    # Given a call graph
+    # When I walk it from a name
+    # Then I expect every name it reaches, closest first
+    assert graph.walk([name], callers, depth) == expected
+
+
+def test_call_graphs_can_remove_calls(graph):
+    # Given a call graph and a copy of it
+    copy = graph.copy()
+
+    # When I remove calls and imports from the copy
+    copy.remove("app.run", "app.step")
+    copy.remove("app.step", "app.missing")
+    copy.remove_import("lib.work", "lib.core.work")
+
+    # Then I expect calls that were made more than once to remain
+    assert copy.walk(["app.main"], depth=None) == [("app.run", 1), ("app.step", 2), ("app.helper", 3)]
+    assert copy.walk(["lib.core.work"], callers=True) == []
+
+    # And I expect the original to be unaffected
+    assert graph.walk(["lib.core.work"], callers=True) == [("app.step", 1)]
+
+
+def test_call_graphs_reuse_the_ids_of_names_without_calls(graph):
+    # Given a call graph
+    size = len(graph.names)
+
+    # When I remove every call to and from a name and add calls to another one
+    graph.remove("app.step", "app.helper")
+    graph.remove_import("app.helper", "lib.work")
+    graph.add("app.step", "app.other")
+
+    # Then I expect the name to be forgotten and its id to be reused
+    assert "app.helper" not in graph.names.ids
+    assert len(graph.names) == size
+    assert graph.walk(["app.step"]) == [("app.other", 1)]
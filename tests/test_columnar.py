@@ -0,0 +1,126 @@
+import pytest
+
+from kawa.columnar import CompactIndex
+from kawa.project import index_project
+
+from .test_indexer import rel
+
+POSITIONS = [(line, column) for line in range(1, 20) for column in range(0, 40, 3)]
+
+
+@pytest.fixture
+def project(tmpdir):
+    tmpdir.mkdir(".git")
+    package = tmpdir.mkdir("package")
+    package.join("__init__.py").write("")
+    package.join("a.py").write("def f():\n    pass\n\nclass A:\n    x = f()\n\n    def g(self):\n        return x\n")
+    package.join("b.py").write("from package.a import f as h, A\n\ndef g():\n    return h()\n\ny = g(A)\n")
+    return tmpdir
+
+
+@pytest.fixture
+def indexers(project):
+    indexer, _ = index_project(str(project), jobs=1)
+    indexer.index_file(rel("examples/reader.py"))
+    return indexer, CompactIndex.from_indexer(indexer)
+
+
+def filenames(project):
+    return [
+        str(project.join("package", "a.py")),
+        str(project.join("package", "b.py")),
+        rel("examples/reader.py"),
+    ]
+
+
+def unless_unresolved(lookup, default, *args):
+    # Indexers raise KeyError for references to names they can't find.
+    try:
+        return lookup(*args)
+    except KeyError:
+        return default
+
+
+def by_location(metadata):
+    return sorted(metadata, key=lambda data: tuple(data["location"].values()))
+
+
+def test_compact_indexes_describe_entities_like_indexers(project, indexers):
+    # Given an indexer and its compact counterpart
+    indexer, compact = indexers
+
+    # When I describe every position of every file
+    # Then I expect both indexes to agree
+    for filename in filenames(project):
+        for line, column in POSITIONS:
+            assert compact.lookup_metadata(filename, line, column) == indexer.lookup_metadata(filename, line, column)
+            expected = unless_unresolved(indexer.lookup_definition, None, filename, line, column)
+            assert compact.lookup_definition(filename, line, column) == expected
+
+
+def test_compact_indexes_find_references_like_indexers(project, indexers):
+    # Given an indexer and its compact counterpart
+    indexer, compact = indexers
+
+    # When I look up the references of every position of every file
+    # Then I expect both indexes to agree
+    for filename in filenames(project):
+        for line, column in POSITIONS:
+            expected = unless_unresolved(indexer.lookup_references, [], filename, line, column)
+            found = compact.lookup_references(filename, line, column)
+            assert found[:1] == expected[:1]
+            assert by_location(found[1:]) == by_location(expected[1:])
+
+            # And I expect references ordered by file to be ordered by location
+            expected = expected[:1] + by_location(expected[1:])
+            assert list(compact.iter_references(filename, line, column, by_file=True)) == expected
+            assert unless_unresolved(
+                lambda *args: list(indexer.iter_references(*args, by_file=True)), [], filename, line, column,
+            ) == expected
+
+
+def test_compact_indexes_look_up_ranges_like_indexers(indexers):
+    # Given an indexer and its compact counterpart
+    indexer, compact = indexers
+
+    # When I look up the entities between lines 2 and 4 of a file
+    # Then I expect both indexes to agree
+    filename = rel("examples/reader.py")
+    expected = [entity.metadata for entity in indexer.lookup_entities_between(filename, 2, 4)]
+    assert [entity.metadata for entity in compact.lookup_entities_between(filename, 2, 4)] == expected
+
+
+def test_compact_indexes_ignore_unknown_files(indexers):
+    # Given a compact index
+    _, compact = indexers
+
+    # When I look up a position in a file it doesn't know about
+    # Then I expect nothing to be found
+    assert compact.lookup_metadata(rel("test_columnar.py"), 1, 0) is None
+    assert compact.lookup_references(rel("test_columnar.py"), 1, 0) == []
+
+
+def test_compact_indexes_can_be_saved_and_loaded(tmpdir, project, indexers):
+    # Given a compact index saved to disk
+    _, compact = indexers
+    path = str(tmpdir.join("index.compact"))
+    compact.save(path)
+
+    # When I load it back
+    loaded = CompactIndex.load(path)
+
+    # Then I expect it to behave like the original
+    for filename in filenames(project):
+        for line, column in POSITIONS:
+            assert loaded.lookup_references(filename, line, column) == compact.lookup_references(filename, line, column)
+
+
+def test_compact_indexes_reject_other_files(tmpdir):
+    # Given a file that isn't a compact index
+    path = tmpdir.join("index.compact")
+    path.write("hello")
+
+    # When I try to load it
+    # Then I expect a ValueError to be raised
+    with pytest.raises(ValueError):
+        CompactIndex.load(str(path))
@@ -1,6 +1,7 @@
 import os
+import pytest
 
-from kawa.common import find_vc_root, find_qualified_name
+from kawa.common import add_source_root, find_vc_root, find_qualified_name, invalidate_caches, remove_source_root
 
 
 def test_find_vc_root_can_find_roots():
@@ -23,3 +24,79 @@ def test_qualify_module_can_qualify_modules():
 
     # Then I should get its qualified name
     assert name == "tests.test_common"
+
+
+def test_find_vc_root_can_find_deeply_nested_roots(tmpdir):
+    # Given a module that is nested very deeply under its vc root
+    tmpdir.mkdir(".git")
+    package = tmpdir.mkdir("a").mkdir("b").mkdir("c").mkdir("d").mkdir("e").mkdir("f")
+    filename = str(package.join("g.py"))
+
+    # When I attempt to find its vc root and its qualified name
+    root = find_vc_root(filename)
+    name = find_qualified_name(filename)
+
+    # Then I should get the right values
+    assert root == str(tmpdir)
+    assert name == "a.b.c.d.e.f.g"
+
+
+def test_find_vc_root_caches_roots(tmpdir):
+    # Given a module under a vc root whose root has been looked up
+    vcs_dir = tmpdir.mkdir(".git")
+    filename = str(tmpdir.mkdir("package").join("module.py"))
+    assert find_vc_root(filename) == str(tmpdir)
+
+    # When the vc root goes away
+    vcs_dir.remove()
+
+    # Then I expect the cached root to be returned
+    assert find_vc_root(filename) == str(tmpdir)
+
+    # Until the cache is invalidated
+    invalidate_caches(str(tmpdir))
+    with pytest.raises(ValueError):
+        find_vc_root(filename)
+
+
+def test_qualify_module_names_packages_after_their_directory(tmpdir):
+    # Given a package under a vc root
+    tmpdir.mkdir(".git")
+    filename = str(tmpdir.mkdir("package").join("__init__.py"))
+
+    # When I attempt to find its fully qualified name
+    name = find_qualified_name(filename)
+
+    # Then I should get the name of the package
+    assert name == "package"
+
+
+def test_qualify_module_honours_src_layouts(tmpdir):
+    # Given a module in a project with a src layout
+    tmpdir.mkdir(".git")
+    filename = str(tmpdir.mkdir("src").mkdir("package").join("module.py"))
+
+    # When I attempt to find its fully qualified name
+    name = find_qualified_name(filename)
+
+    # Then I should get a name relative to the src directory
+    assert name == "package.module"
+
+
+def test_qualify_module_honours_source_roots(tmpdir):
+    # Given a module under a registered source root
+    tmpdir.mkdir(".git")
+    source_root = tmpdir.mkdir("lib").mkdir("python")
+    filename = str(source_root.mkdir("package").join("module.py"))
+    add_source_root(str(source_root))
+    try:
+        # When I attempt to find its fully qualified name
+        name = find_qualified_name(filename)
+    finally:
+        remove_source_root(str(source_root))
+
+    # Then I should get a name relative to the source root
+    assert name == "package.module"
+
+    # And I expect names not to be relative to it once it's removed
+    assert find_qualified_name(filename) == "lib.python.package.module"
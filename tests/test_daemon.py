@@ -0,0 +1,150 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from kawa import daemon
+from kawa.indexer import Indexer
+
+pytestmark = pytest.mark.skipif(not daemon.is_supported(), reason="Unix sockets are not supported")
+
+
+def rel(path):
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), path))
+
+
+@pytest.fixture
+def runtime_dir(tmpdir, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmpdir))
+    return tmpdir
+
+
+def start_daemon(root, idle_timeout=30):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(daemon.serve_daemon(Indexer(), root, idle_timeout)))
+    thread.start()
+
+    path = daemon.socket_path(root)
+    deadline = time.monotonic() + 5
+    while not daemon._is_listening(path) and thread.is_alive():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return thread, results
+
+
+def test_socket_paths_are_per_project(runtime_dir):
+    # Given a couple of project roots
+    # When I look up the paths of their sockets
+    first, second = daemon.socket_path("/a/project"), daemon.socket_path("/b/project")
+
+    # Then I expect them to differ and to be in a per-user directory
+    assert first != second
+    assert os.path.dirname(first) == str(runtime_dir.join(f"kawa-{os.getuid()}"))
+
+
+def test_daemons_answer_requests(runtime_dir):
+    # Given a daemon that exits as soon as it's idle
+    root = rel("..")
+    thread, results = start_daemon(root, idle_timeout=0.5)
+
+    # When I send it a lookup
+    params = {"filename": rel("examples/reader.py"), "line": 18, "column": 10}
+    response = daemon.request(daemon.socket_path(root), "find_definition", params)
+
+    # Then I expect it to be answered
+    assert response["result"]["name"] == "tests.examples.reader.read"
+
+    # And I expect the daemon to clean up its socket once it exits
+    thread.join(5)
+    assert results == [True]
+    assert not os.path.exists(daemon.socket_path(root))
+
+
+def test_daemons_stay_up_while_connections_send_requests(runtime_dir):
+    # Given a daemon that exits as soon as it's idle
+    root = rel("..")
+    thread, results = start_daemon(root, idle_timeout=0.5)
+
+    # When a client keeps a connection open and sends requests over it for longer than that
+    responses = []
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(daemon.socket_path(root))
+        with sock.makefile("rb") as infile:
+            for i in range(8):
+                request = {"jsonrpc": "2.0", "id": i, "method": "stats", "params": {}}
+                sock.sendall(json.dumps(request).encode() + b"\n")
+                responses.append(json.loads(infile.readline()))
+                time.sleep(0.2)
+
+            serving = thread.is_alive()
+
+    # Then I expect every request to be answered without the daemon exiting
+    assert [response["id"] for response in responses] == list(range(8))
+    assert serving
+
+    # And I expect the daemon to exit once the client is done
+    thread.join(5)
+    assert results == [True]
+
+
+def test_only_one_daemon_serves_a_project(runtime_dir):
+    # Given a running daemon
+    thread, results = start_daemon("/some/project", idle_timeout=0.5)
+
+    # When I start another one for the same project
+    # Then I expect it to give up right away
+    assert daemon.serve_daemon(Indexer(), "/some/project") is False
+
+    thread.join(5)
+    assert results == [True]
+
+
+def test_daemons_replace_stale_sockets(runtime_dir):
+    # Given a socket file left behind by a daemon that died
+    path = daemon.socket_path("/some/project")
+    os.makedirs(os.path.dirname(path), mode=0o700)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(path)
+
+    # When I start a daemon
+    thread, results = start_daemon("/some/project", idle_timeout=0.5)
+    thread.join(5)
+
+    # Then I expect it to have served the project
+    assert results == [True]
+
+
+def test_requests_fail_when_no_daemon_is_running(runtime_dir):
+    # Given no daemon
+    # When I send a request
+    # Then I expect an OSError to be raised
+    with pytest.raises(OSError):
+        daemon.request(daemon.socket_path("/some/project"), "describe", {})
+
+
+def make_private_dir(path, mode=0o700):
+    os.mkdir(path)
+    os.chmod(path, mode)
+
+
+@pytest.mark.parametrize("make_dir", [
+    lambda path, other: make_private_dir(path, 0o755),
+    lambda path, other: make_private_dir(path, 0o777),
+    lambda path, other: (make_private_dir(other), os.symlink(other, path)),
+    lambda path, other: open(path, "w").close(),
+])
+def test_daemons_refuse_socket_directories_that_are_not_private(runtime_dir, make_dir):
+    # Given a socket directory that someone else could have set up
+    path = daemon.socket_path("/some/project")
+    make_dir(os.path.dirname(path), str(runtime_dir.join("other")))
+
+    # When I start a daemon or send one a request
+    # Then I expect the directory not to be used
+    with pytest.raises(PermissionError):
+        daemon.serve_daemon(Indexer(), "/some/project")
+
+    with pytest.raises(PermissionError):
+        daemon.request(path, "stats", {})
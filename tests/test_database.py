@@ -0,0 +1,164 @@
+import multiprocessing
+import os
+
+import pytest
+
+from kawa.database import SQLiteIndex
+from kawa.project import index_project
+
+from .test_columnar import POSITIONS, by_location, filenames, project, unless_unresolved  # noqa
+from .test_indexer import rel
+
+
+@pytest.fixture
+def database_path(tmpdir):
+    return str(tmpdir.join("index.sqlite3"))
+
+
+@pytest.fixture
+def indexers(project, database_path):
+    indexer, _ = index_project(str(project), jobs=1)
+    indexer.index_file(rel("examples/reader.py"))
+    database, _ = index_project(str(project), SQLiteIndex(database_path), jobs=1)
+    database.index_file(rel("examples/reader.py"))
+    yield indexer, database
+    database.close()
+
+
+def test_databases_describe_entities_like_indexers(project, indexers):
+    # Given an indexer and a database holding the same modules
+    indexer, database = indexers
+
+    # When I describe every position of every file
+    # Then I expect both indexes to agree
+    for filename in filenames(project):
+        for line, column in POSITIONS:
+            assert database.lookup_metadata(filename, line, column) == indexer.lookup_metadata(filename, line, column)
+            expected = unless_unresolved(indexer.lookup_definition, None, filename, line, column)
+            assert database.lookup_definition(filename, line, column) == expected
+
+
+def test_databases_find_references_like_indexers(project, indexers):
+    # Given an indexer and a database holding the same modules
+    indexer, database = indexers
+
+    # When I look up the references of every position of every file
+    # Then I expect both indexes to agree
+    for filename in filenames(project):
+        for line, column in POSITIONS:
+            expected = unless_unresolved(indexer.lookup_references, [], filename, line, column)
+            found = database.lookup_references(filename, line, column)
+            assert found[:1] == expected[:1]
+            assert by_location(found[1:]) == by_location(expected[1:])
+
+            # And I expect references ordered by file to be ordered by location
+            expected = expected[:1] + by_location(expected[1:])
+            assert list(database.iter_references(filename, line, column, by_file=True)) == expected
+
+
+def test_databases_can_be_updated_while_references_are_consumed(project, database_path):
+    # Given a database holding a project
+    database, _ = index_project(str(project), SQLiteIndex(database_path), jobs=1)
+    a = project.join("package", "a.py")
+
+    # When I start consuming the references of a name
+    references = database.iter_references(str(a), 1, 4)
+    definition = next(references)
+
+    # And the database is updated before I'm done with them
+    a.write(a.read() + "\n\ndef g():\n    pass\n")
+    assert database.ensure_indexed(str(a))
+
+    # Then I expect the update to succeed and the references to come from before it
+    assert definition["name"] == "package.a.f"
+    assert [reference["name"] for reference in references] == ["package.a.A.f"]
+    database.close()
+
+
+def test_databases_refresh_the_stamps_of_touched_files(project, database_path):
+    # Given a database holding a project whose file was touched without being changed
+    database, _ = index_project(str(project), SQLiteIndex(database_path), jobs=1)
+    a = str(project.join("package", "a.py"))
+    os.utime(a, ns=(0, 0))
+
+    # When I check whether it needs indexing
+    # Then I expect it not to and its stamp to be brought up to date
+    assert not database.needs_indexing(a)
+    assert database.stamp_of("package.a").mtime == 0
+    database.close()
+
+
+def test_databases_look_up_ranges_like_indexers(indexers):
+    # Given an indexer and a database holding the same modules
+    indexer, database = indexers
+
+    # When I look up the entities between lines 2 and 4 of a file
+    # Then I expect both indexes to agree
+    filename = rel("examples/reader.py")
+    expected = [entity.metadata for entity in indexer.lookup_entities_between(filename, 2, 4)]
+    assert [entity.metadata for entity in database.lookup_entities_between(filename, 2, 4)] == expected
+
+
+def test_databases_update_references_when_definitions_change(project, database_path):
+    # Given a database holding a project
+    database, _ = index_project(str(project), SQLiteIndex(database_path), jobs=1)
+    b = str(project.join("package", "b.py"))
+    assert database.lookup_definition(b, 4, 11)["name"] == "package.a.f"
+
+    # When I rename the function the import refers to
+    a = project.join("package", "a.py")
+    a.write(a.read().replace("def f():", "def f2():"))
+    assert database.ensure_indexed(str(a))
+
+    # Then I expect the import to no longer be followed
+    assert database.lookup_definition(b, 4, 11)["type"] == "import"
+
+    # When I remove the module
+    database.remove_module("package.a")
+
+    # Then I expect it and its entities to be gone
+    assert "package.a" not in database.module_names
+    assert database.stamp_of("package.a") is None
+    assert database.connection.execute("SELECT count(*) FROM entities WHERE module = 'package.a'").fetchone() == (0,)
+
+
+def test_databases_persist_across_connections(project, database_path):
+    # Given a database holding a project
+    with SQLiteIndex(database_path) as database:
+        index_project(str(project), database, jobs=1)
+
+    # When I open it again
+    with SQLiteIndex(database_path) as database:
+        # Then I expect nothing to need indexing
+        assert not database.needs_indexing(str(project.join("package", "b.py")))
+        assert database.lookup_metadata(str(project.join("package", "b.py")), 3, 4)["name"] == "package.b.g"
+
+
+def _describe(database_path, filename):
+    with SQLiteIndex(database_path) as database:
+        return database.lookup_metadata(filename, 3, 4)["name"]
+
+
+def test_databases_can_be_shared_between_processes(project, database_path):
+    # Given a database holding a project
+    with SQLiteIndex(database_path) as database:
+        index_project(str(project), database, jobs=1)
+
+        # When other processes read from it while it is open
+        filename = str(project.join("package", "b.py"))
+        with multiprocessing.get_context("spawn").Pool(2) as pool:
+            names = pool.starmap(_describe, [(database_path, filename)] * 4)
+
+    # Then I expect them to see its contents
+    assert names == ["package.b.g"] * 4
+
+
+def test_databases_reject_other_schema_versions(database_path):
+    # Given a database written with another schema version
+    with SQLiteIndex(database_path) as database:
+        database.connection.execute("PRAGMA user_version = 1000")
+
+    # When I try to open it
+    # Then I expect a ValueError to be raised
+    with pytest.raises(ValueError):
+        SQLiteIndex(database_path)
@@ -0,0 +1,137 @@
+import os
+
+import pytest
+
+from kawa.columnar import CompactIndex
+from kawa.environment import Distribution, Environment, MappedIndex, index_environment, manifest_path
+from kawa.indexer import Indexer
+
+
+@pytest.fixture
+def distribution(tmpdir):
+    site = tmpdir.mkdir("site-packages")
+    site.mkdir(".git")
+    package = site.mkdir("pkg")
+    package.join("__init__.py").write('"""A package."""\nfrom .core import helper, Thing\n')
+    package.join("core.py").write(
+        'def helper(x, *args):\n    """Help."""\n    return Thing(x)\n\n'
+        'class Thing:\n    def __init__(self, x):\n        pass\n'
+    )
+    return Distribution("pkg", "1.0", str(site), ["pkg/__init__.py", "pkg/core.py"])
+
+
+def test_environments_can_look_up_names(tmpdir, distribution):
+    # Given an environment built from a distribution
+    index_environment(str(tmpdir.join("cache")), [distribution], jobs=1)
+    environment = Environment.load(str(tmpdir.join("cache")))
+
+    # When I look up a name it re-exports
+    entity = environment.lookup_name("pkg.helper")
+
+    # Then I expect to get the definition it imports
+    assert entity.metadata == {
+        "type": "function",
+        "name": "pkg.core.helper",
+        "arguments": ["x", "*args"],
+        "docstring": "Help.",
+        "location": {
+            "filename": str(tmpdir.join("site-packages", "pkg", "core.py")),
+            "line_number": 1,
+            "column_offset": 0,
+            "end_line_number": 3,
+            "end_column_offset": 19,
+        },
+    }
+
+    # And I expect names that aren't defined not to be found
+    assert environment.lookup_name("pkg.missing") is None
+    assert environment.lookup_name("other") is None
+
+
+def test_environments_are_empty_until_they_are_indexed(tmpdir):
+    # Given a cache without a manifest for this interpreter
+    # When I load the environment
+    environment = Environment.load(str(tmpdir))
+
+    # Then I expect it to be empty
+    assert environment.indexes == []
+    assert environment.lookup_name("os") is None
+
+
+@pytest.mark.parametrize("manifest", [
+    "{}",
+    "[]",
+    '{"indexes": 1}',
+    '{"indexes": [{"path": "pkg.kawa-env"}]}',
+    '{"indexes": [{"path": null, "root": "/"}]}',
+])
+def test_environments_skip_malformed_manifests(tmpdir, manifest):
+    # Given a cache whose manifest for this interpreter is malformed
+    path = manifest_path(str(tmpdir))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(manifest)
+
+    # When I load the environment
+    environment = Environment.load(str(tmpdir))
+
+    # Then I expect it to be empty
+    assert environment.indexes == []
+
+
+def test_indexes_are_only_built_once(tmpdir, distribution):
+    # Given an environment that was already indexed
+    cache_dir = str(tmpdir.join("cache"))
+    index_environment(cache_dir, [distribution], jobs=1)
+
+    # When I index it again
+    statuses = []
+    progress = lambda distribution, missing: statuses.append(missing)  # noqa: E731
+    index_environment(cache_dir, [distribution], jobs=1, progress=progress)
+    index_environment(cache_dir, [distribution], jobs=1, rebuild=True, progress=progress)
+
+    # Then I expect its indexes to be reused unless they are rebuilt
+    assert statuses == [False, True]
+    assert os.path.exists(manifest_path(cache_dir))
+
+
+@pytest.mark.parametrize("filename,line,column", [
+    ("pkg/__init__.py", 2, 30),
+    ("pkg/core.py", 3, 11),
+    ("pkg/core.py", 6, 8),
+    ("pkg/core.py", 7, 8),
+])
+def test_mapped_indexes_answer_lookups_like_compact_indexes(tmpdir, distribution, filename, line, column):
+    # Given a distribution's compact index and the mapped index built from it
+    indexer = Indexer(lazy=True)
+    for name in distribution.filenames:
+        indexer.index_file(str(tmpdir.join("site-packages", name)))
+
+    cache_dir = str(tmpdir.join("cache"))
+    [(_, path)] = index_environment(cache_dir, [distribution], jobs=1)
+    compact, mapped = CompactIndex.from_indexer(indexer), MappedIndex.open(path, distribution.root)
+
+    # When I run the same lookups against both
+    # Then I expect the same results
+    filename = str(tmpdir.join("site-packages", filename))
+    for lookup in ("lookup_metadata", "lookup_definition", "lookup_references"):
+        assert getattr(mapped, lookup)(filename, line, column) == getattr(compact, lookup)(filename, line, column)
+
+
+def test_indexers_follow_imports_into_attached_environments(tmpdir, distribution):
+    # Given a project that uses a distribution
+    project = tmpdir.mkdir("project")
+    project.mkdir(".git")
+    project.join("a.py").write("from pkg import Thing\n\nThing(1)\n")
+
+    # And an indexer with that distribution's environment attached
+    index_environment(str(tmpdir.join("cache")), [distribution], jobs=1)
+    indexer = Indexer()
+    indexer.attach(Environment.load(str(tmpdir.join("cache"))))
+
+    # When I look up the definition of the name it imports
+    definition = indexer.lookup_definition(str(project.join("a.py")), 3, 0)
+
+    # Then I expect to find it in the environment
+    assert definition["name"] == "pkg.core.Thing"
+    assert definition["location"]["filename"] == str(tmpdir.join("site-packages", "pkg", "core.py"))
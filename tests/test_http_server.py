@@ -0,0 +1,191 @@
+import asyncio
+import json
+import os
+import threading
+
+from kawa.http_server import HTTPServer, SnapshotIndex
+from kawa.indexer import Indexer
+
+
+def rel(path):
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), path))
+
+
+async def request(port, method, target, headers=""):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {target} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n{headers}\r\n".encode())
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    return status, json.loads(body)
+
+
+def run_with_server(coroutine_fn, indexer=None):
+    async def run():
+        index = SnapshotIndex(indexer or Indexer())
+        server = await HTTPServer(index).start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await coroutine_fn(index, port)
+
+    return asyncio.run(run())
+
+
+def test_http_servers_can_answer_lookups():
+    # Given a running server
+    async def scenario(index, port):
+        # When I request the definition of a name
+        return await request(port, "GET", f"/find_definition?filename={rel('examples/reader.py')}&line=18&column=10")
+
+    status, payload = run_with_server(scenario)
+
+    # Then I expect it to be found
+    assert status == 200
+    assert payload["name"] == "tests.examples.reader.read"
+
+
+def test_http_servers_can_answer_concurrent_lookups():
+    # Given a running server
+    async def scenario(index, port):
+        # When I send many lookups at once
+        target = f"/find_usages?filename={rel('examples/reader.py')}&line=12&column=4"
+        return await asyncio.gather(*(request(port, "GET", target) for _ in range(10)))
+
+    responses = run_with_server(scenario)
+
+    # Then I expect all of them to be answered the same way
+    assert all(response == responses[0] for response in responses)
+    assert len(responses[0][1]) == 2
+
+
+def test_http_servers_only_index_files_once():
+    # Given a running server
+    async def scenario(index, port):
+        # When I index a file twice
+        await request(port, "POST", f"/index?filename={rel('examples/reader.py')}")
+        await request(port, "POST", f"/index?filename={rel('examples/reader.py')}")
+        return index.generation
+
+    # Then I expect a single new generation to have been produced
+    assert run_with_server(scenario) == 1
+
+
+def test_http_servers_report_errors():
+    # Given a running server
+    async def scenario(index, port):
+        # When I make a couple of bad requests
+        return [
+            await request(port, "GET", "/frobnicate"),
+            await request(port, "GET", "/describe?line=1&column=0"),
+            await request(port, "GET", "/index?filename=foo.py"),
+        ]
+
+    # Then I expect them to fail with the appropriate status codes
+    assert [status for status, _ in run_with_server(scenario)] == [404, 400, 405]
+
+
+def test_http_servers_reject_invalid_content_lengths():
+    # Given a running server
+    async def scenario(index, port):
+        # When I send bodies whose lengths are negative or not integers
+        return [
+            await request(port, "POST", "/search", "Content-Length: -1\r\n"),
+            await request(port, "POST", "/search", "Content-Length: ten\r\n"),
+        ]
+
+    # Then I expect them to be rejected
+    assert run_with_server(scenario) == [
+        (400, {"error": "Invalid Content-Length."}),
+        (400, {"error": "Invalid Content-Length."}),
+    ]
+
+
+def test_http_servers_answer_lookups_while_other_lookups_are_running():
+    # Given a running server whose searches block until they are released
+    released = threading.Event()
+
+    class SlowIndexer(Indexer):
+        def search_symbols(self, query, limit=20):
+            released.wait(5)
+            return super().search_symbols(query, limit)
+
+    async def scenario(index, port):
+        # When I ask for stats while a search is running
+        search = asyncio.ensure_future(request(port, "GET", "/search?query=read"))
+        status, _ = await asyncio.wait_for(request(port, "GET", "/stats"), 2)
+        released.set()
+
+        # Then I expect the stats to be served before the search finishes
+        return status, search.done(), (await search)[0]
+
+    assert run_with_server(scenario, SlowIndexer()) == (200, False, 200)
+
+
+def test_http_servers_can_report_stats():
+    # Given a running server
+    async def scenario(index, port):
+        # When I index a file and then ask for stats
+        await request(port, "POST", f"/index?filename={rel('examples/reader.py')}")
+        return await request(port, "GET", "/stats")
+
+    status, payload = run_with_server(scenario)
+
+    # Then I expect the stats to cover the indexing that happened
+    assert status == 200
+    assert payload["counters"]["analyzer.modules"] == 1
+    assert payload["cache_hit_rates"]["stamps"] == 0.0
+
+
+def test_http_servers_can_search_symbols():
+    # Given a running server
+    async def scenario(index, port):
+        # When I index a file and then search for a symbol
+        await request(port, "POST", f"/index?filename={rel('examples/reader.py')}")
+        return await request(port, "GET", "/search?query=Reader&limit=1")
+
+    status, payload = run_with_server(scenario)
+
+    # Then I expect the best match to be returned
+    assert status == 200
+    assert [data["name"] for data in payload] == ["tests.examples.reader.Reader"]
+
+
+def test_http_servers_follow_imports_into_new_snapshots(tmpdir):
+    # Given a project where one module imports a function from another
+    tmpdir.mkdir(".git")
+    tmpdir.join("a.py").write("def f():\n    pass\n")
+    tmpdir.join("b.py").write("from a import f\n\nf()\n")
+
+    async def scenario(index, port):
+        # When I request the definition of the imported name
+        response = await request(port, "GET", f"/find_definition?filename={tmpdir.join('b.py')}&line=3&column=0")
+        return response, index.generation
+
+    (status, payload), generation = run_with_server(scenario)
+
+    # Then I expect the definition to be found in the other module
+    assert status == 200
+    assert payload["name"] == "a.f"
+
+    # And I expect each module to have been indexed into its own snapshot
+    assert generation == 2
+
+
+def test_http_servers_expand_lazy_bodies_into_new_snapshots():
+    # Given a running server with a lazy index
+    async def scenario(index, port):
+        # When I look for the usages of a function parameter
+        response = await request(port, "GET", f"/find_usages?filename={rel('examples/reader.py')}&line=12&column=9")
+        return response, index.generation
+
+    (status, payload), generation = run_with_server(scenario, Indexer(lazy=True))
+
+    # Then I expect the usages inside the function's body to be found
+    assert status == 200
+    assert [usage["location"]["line_number"] for usage in payload] == [12, 15]
+
+    # And I expect the function's body and then the other bodies that
+    # mention the parameter's name to have been expanded in snapshots of their own
+    assert generation == 3
@@ -1,7 +1,8 @@
 import pytest
 import os
+import pickle
 
-from kawa.indexer import Indexer
+from kawa.indexer import INDEX_FORMAT_MAGIC, INDEX_FORMAT_VERSION, Indexer, _digest as digest
 
 
 def rel(path):
@@ -72,6 +73,8 @@ def test_indexers_can_look_up_entities(indexer, filename, line_number, column_of
                 "filename": rel("examples/reader.py"),
                 "line_number": 0,
                 "column_offset": 0,
+                "end_line_number": 18,
+                "end_column_offset": 29,
             }
         }
     ),
@@ -86,6 +89,8 @@ def test_indexers_can_look_up_entities(indexer, filename, line_number, column_of
                 "filename": rel("examples/reader.py"),
                 "line_number": 1,
                 "column_offset": 0,
+                "end_line_number": 9,
+                "end_column_offset": 33,
             }
         }
     ),
@@ -101,6 +106,8 @@ def test_indexers_can_look_up_entities(indexer, filename, line_number, column_of
                 "filename": rel("examples/reader.py"),
                 "line_number": 6,
                 "column_offset": 4,
+                "end_line_number": 9,
+                "end_column_offset": 33,
             }
         }
     ),
@@ -120,6 +127,8 @@ def test_indexers_can_look_up_metadata(indexer, filename, line_number, column_of
                 "filename": rel("examples/reader.py"),
                 "line_number": 1,
                 "column_offset": 0,
+                "end_line_number": 9,
+                "end_column_offset": 33,
             }
         }
     ),
@@ -135,6 +144,8 @@ def test_indexers_can_look_up_metadata(indexer, filename, line_number, column_of
                 "filename": rel("examples/reader.py"),
                 "line_number": 12,
                 "column_offset": 0,
+                "end_line_number": 15,
+                "end_column_offset": 39,
             }
         }
     ),
@@ -154,6 +165,8 @@ def test_indexers_can_look_up_definitions(indexer, filename, line_number, column
                     "filename": rel("examples/reader.py"),
                     "line_number": 2,
                     "column_offset": 23,
+                    "end_line_number": 2,
+                    "end_column_offset": 31,
                 }
             },
             {
@@ -163,6 +176,8 @@ def test_indexers_can_look_up_definitions(indexer, filename, line_number, column
                     "filename": rel("examples/reader.py"),
                     "line_number": 3,
                     "column_offset": 24,
+                    "end_line_number": 3,
+                    "end_column_offset": 32,
                 }
             },
             {
@@ -172,6 +187,8 @@ def test_indexers_can_look_up_definitions(indexer, filename, line_number, column
                     "filename": rel("examples/reader.py"),
                     "line_number": 4,
                     "column_offset": 25,
+                    "end_line_number": 4,
+                    "end_column_offset": 33,
                 }
             }
         ]
@@ -189,6 +206,8 @@ def test_indexers_can_look_up_definitions(indexer, filename, line_number, column
                     "filename": rel("examples/reader.py"),
                     "line_number": 12,
                     "column_offset": 0,
+                    "end_line_number": 15,
+                    "end_column_offset": 39,
                 }
             },
             {
@@ -198,6 +217,8 @@ def test_indexers_can_look_up_definitions(indexer, filename, line_number, column
                     "filename": rel("examples/reader.py"),
                     "line_number": 18,
                     "column_offset": 10,
+                    "end_line_number": 18,
+                    "end_column_offset": 14,
                 }
             }
         ]
@@ -212,7 +233,9 @@ def test_indexers_can_look_up_definitions(indexer, filename, line_number, column
                 "location": {
                     "filename": "/Users/bogdan/sandbox/kawa/tests/examples/reader.py",
                     "line_number": 12,
-                    "column_offset": 9
+                    "column_offset": 9,
+                    "end_line_number": 12,
+                    "end_column_offset": 17
                 }
             },
             {
@@ -221,7 +244,9 @@ def test_indexers_can_look_up_definitions(indexer, filename, line_number, column
                 "location": {
                     "filename": "/Users/bogdan/sandbox/kawa/tests/examples/reader.py",
                     "line_number": 15,
-                    "column_offset": 18
+                    "column_offset": 18,
+                    "end_line_number": 15,
+                    "end_column_offset": 26
                 }
             }
         ]
@@ -229,3 +254,538 @@ def test_indexers_can_look_up_definitions(indexer, filename, line_number, column
 ])
 def test_indexers_can_look_up_references(indexer, filename, line_number, column_offset, expected):
     assert indexer.lookup_references(rel(filename), line_number, column_offset) == expected
+
+
+def test_indexers_can_be_saved_and_loaded(indexer, tmpdir):
+    # Given an indexer that has indexed a file
+    # When I save it to disk and load it back
+    path = str(tmpdir.join("index"))
+    indexer.save(path)
+    loaded = Indexer.load(path)
+
+    # Then I expect the loaded index to answer lookups the same way
+    assert loaded.modules == indexer.modules
+    assert loaded.lookup_references(rel("examples/reader.py"), 12, 4) == \
+        indexer.lookup_references(rel("examples/reader.py"), 12, 4)
+
+
+def test_loading_an_index_reindexes_changed_files(tmpdir):
+    # Given a saved index of a module
+    module = tmpdir.join("example.py")
+    module.write("x = 1\n")
+    indexer = Indexer()
+    indexer.index_file(str(module), "example")
+    path = str(tmpdir.join("index"))
+    indexer.save(path)
+
+    # When I change that module and load the index
+    module.write("y = 1\nz = 2\n")
+    loaded = Indexer.load(path)
+
+    # Then I expect only the new definitions to be present
+    assert "example.x" not in loaded.entities_by_fqn
+    assert "example.y" in loaded.entities_by_fqn
+    assert loaded.stamps["example"].size == len("y = 1\nz = 2\n")
+
+
+def test_loading_an_index_drops_deleted_files(tmpdir):
+    # Given a saved index of a module
+    module = tmpdir.join("example.py")
+    module.write("x = 1\n")
+    indexer = Indexer()
+    indexer.index_file(str(module), "example")
+    path = str(tmpdir.join("index"))
+    indexer.save(path)
+
+    # When I delete that module and load the index
+    module.remove()
+    loaded = Indexer.load(path)
+
+    # Then I expect the module to be gone
+    assert "example" not in loaded.modules
+    assert "example.x" not in loaded.entities_by_fqn
+
+
+def test_loading_an_invalid_index_fails(tmpdir):
+    # Given a file that isn't an index
+    path = tmpdir.join("index")
+    path.write("garbage")
+
+    # When I attempt to load it
+    # Then I expect a ValueError to be raised
+    with pytest.raises(ValueError):
+        Indexer.load(str(path))
+
+
+def test_indexer_copies_are_isolated_from_updates(tmpdir):
+    # Given an indexer and a copy of it
+    module = tmpdir.join("example.py")
+    module.write("x = 1\nx\n")
+    indexer = Indexer()
+    indexer.index_file(str(module), "example")
+    snapshot = indexer.copy()
+
+    # When I reindex a changed file in the original
+    module.write("y = 1\ny\n")
+    os.utime(str(module), ns=(0, 0))
+    indexer.ensure_indexed(str(module), "example")
+
+    # Then I expect the copy to be unaffected
+    assert "example.x" in snapshot.entities_by_fqn
+    assert "example.y" not in snapshot.entities_by_fqn
+    assert len(snapshot.references_by_fqn["example.x"]) == 1
+    assert "example.y" in indexer.entities_by_fqn
+
+
+def test_indexers_only_hash_touched_files_once(tmpdir, monkeypatch):
+    # Given an indexed file that was touched without being changed
+    module = tmpdir.join("example.py")
+    module.write("x = 1\n")
+    indexer = Indexer()
+    indexer.index_file(str(module), "example")
+    os.utime(str(module), ns=(0, 0))
+
+    # When I check whether it needs indexing a couple of times
+    digests = []
+
+    def counting_digest(source_bytes):
+        digests.append(source_bytes)
+        return digest(source_bytes)
+
+    monkeypatch.setattr("kawa.indexer._digest", counting_digest)
+    needs_indexing = [indexer.needs_indexing(str(module), "example") for _ in range(3)]
+
+    # Then I expect it not to need indexing and its contents to only have been hashed the first time
+    assert needs_indexing == [False, False, False]
+    assert len(digests) == 1
+    assert indexer.stamps["example"].mtime == 0
+
+
+def normalized(indexer):
+    return (
+        set(indexer.entities_by_fqn),
+        {name: sorted(references) for name, references in indexer.references_by_fqn.items()},
+    )
+
+
+@pytest.mark.parametrize("versions", [
+    # Definitions and references go away.
+    ["def f():\n    pass\n\nf()\nf()\n", "x = 1\n"],
+
+    # A reference starts resolving to a new, closer definition.
+    ["def g():\n    return f\n", "def g():\n    f = 1\n    return f\n"],
+
+    # Code moves around.
+    ["def f():\n    pass\n\nf()\n", "\n\ndef f():\n    pass\n\nf()\n", "f()\n"],
+])
+def test_reindexing_files_matches_indexing_from_scratch(tmpdir, versions):
+    # Given an indexer and two modules, one of which refers to the other
+    other = tmpdir.join("other.py")
+    other.write("def f():\n    pass\n")
+    module = tmpdir.join("example.py")
+    indexer = Indexer()
+    indexer.index_file(str(other), "other")
+
+    for version in versions:
+        # When I reindex a module after changing it
+        module.write(version)
+        indexer.index_file(str(module), "example")
+
+        # Then I expect the index to be the same as if it had been built from scratch
+        fresh = Indexer()
+        fresh.index_file(str(other), "other")
+        fresh.index_file(str(module), "example")
+        assert normalized(indexer) == normalized(fresh)
+
+
+def test_reindexing_files_does_not_duplicate_references(indexer):
+    # Given an indexer that has indexed a file
+    # When I index that same file again
+    indexer.index_file(rel("examples/reader.py"))
+
+    # Then I expect the references not to be duplicated
+    assert len(indexer.lookup_references(rel("examples/reader.py"), 12, 4)) == 2
+
+
+def test_removing_modules_updates_references_in_other_modules(tmpdir):
+    # Given two modules, one of which refers to the other
+    tmpdir.join("a.py").write("x = 1\n")
+    tmpdir.join("b.py").write("a\n")
+    indexer = Indexer()
+    indexer.index_file(str(tmpdir.join("a.py")), "a")
+    indexer.index_file(str(tmpdir.join("b.py")), "b")
+    assert len(indexer.references_by_fqn["a"]) == 1
+
+    # When I remove the module being referred to
+    indexer.remove_module("a")
+
+    # Then I expect the index to be the same as if that module had never been indexed
+    fresh = Indexer()
+    fresh.index_file(str(tmpdir.join("b.py")), "b")
+    assert normalized(indexer) == normalized(fresh)
+    assert indexer.references_by_module.keys() == {"b"}
+
+
+def test_references_skip_enclosing_class_scopes(tmpdir):
+    # Given a module where a method refers to a name that is bound both
+    # in its class' body and at the module level
+    module = tmpdir.join("example.py")
+    module.write("x = 1\n\nclass A:\n    x = 2\n    y = x\n\n    def f(self):\n        return x\n")
+    indexer = Indexer()
+
+    # When I index it
+    indexer.index_file(str(module), "example")
+
+    # Then I expect the method's reference to resolve to the module-level name
+    assert [r.source_location.line_number for r in indexer.references_by_fqn["example.x"]] == [8]
+
+    # And I expect the class body's reference to resolve to the class-level name
+    assert [r.source_location.line_number for r in indexer.references_by_fqn["example.A.x"]] == [5]
+
+
+@pytest.fixture
+def importing_project(tmpdir):
+    tmpdir.mkdir(".git")
+    package = tmpdir.mkdir("package")
+    package.join("__init__.py").write("from .a import f\n")
+    package.join("a.py").write("def f():\n    pass\n")
+    package.join("b.py").write("from package import f\nimport json\n\nx = f()\ny = json\n")
+    return tmpdir
+
+
+def test_indexers_follow_imports_into_modules_that_are_not_indexed(importing_project):
+    # Given an index that only contains a module that imports names from other modules
+    indexer = Indexer()
+    filename = str(importing_project.join("package", "b.py"))
+    indexer.index_file(filename)
+
+    # When I look up the definition of a name it re-exports from its package
+    definition = indexer.lookup_definition(filename, 4, 4)
+
+    # Then I expect the re-export to be followed to the function's definition
+    assert definition["name"] == "package.a.f"
+    assert definition["location"]["filename"] == str(importing_project.join("package", "a.py"))
+
+    # And I expect only the modules along the way to have been indexed
+    assert sorted(indexer.modules) == ["package", "package.a", "package.b"]
+
+
+def test_indexers_can_follow_imports_onto_sys_path(importing_project):
+    # Given an index that contains a module that imports a module from the standard library
+    indexer = Indexer()
+    filename = str(importing_project.join("package", "b.py"))
+    indexer.index_file(filename)
+
+    # When I look up the definition of a reference to that module
+    definition = indexer.lookup_definition(filename, 5, 4)
+
+    # Then I expect the standard library module to be found
+    assert definition["type"] == "module"
+    assert definition["name"] == "json"
+
+    # And I expect to be able to look up entities inside of it
+    json_filename = definition["location"]["filename"]
+    assert indexer.module_name_of(json_filename) == "json"
+    assert indexer.lookup_entity(json_filename, 1, 0).name == "json"
+
+
+def test_indexers_can_look_up_imports_without_locating_modules(importing_project):
+    # Given an index that only contains a module that imports names from other modules
+    indexer = Indexer()
+    filename = str(importing_project.join("package", "b.py"))
+    indexer.index_file(filename)
+
+    # When I look up the definition of an imported name without locating imports
+    definition = indexer.lookup_definition(filename, 4, 4, locate_imports=False)
+
+    # Then I expect the import itself to be returned
+    assert definition["type"] == "import"
+    assert definition["target"] == "package.f"
+
+    # And I expect the module that has to be indexed next to be known
+    assert indexer.lookup_pending_import(filename, 4, 4) == (
+        str(importing_project.join("package", "__init__.py")), "package",
+    )
+
+
+@pytest.fixture
+def lazy_indexer():
+    indexer = Indexer(lazy=True)
+    indexer.index_file(rel("examples/reader.py"))
+    return indexer
+
+
+def test_lazy_indexers_only_index_outlines(lazy_indexer):
+    # Given a lazily-indexed file
+    # When I look at its entities
+    # Then I expect its functions to be indexed without their bodies
+    assert "tests.examples.reader.Reader.read" in lazy_indexer.entities_by_fqn
+    assert "tests.examples.reader.read" in lazy_indexer.entities_by_fqn
+    assert "tests.examples.reader.read.filename" not in lazy_indexer.entities_by_fqn
+    assert len(lazy_indexer.lazy_bodies["tests.examples.reader"]) == 3
+
+
+@pytest.mark.parametrize("lookup,args", [
+    ("lookup_metadata", (12, 9)),
+    ("lookup_metadata", (15, 18)),
+    ("lookup_definition", (15, 11)),
+    ("lookup_references", (1, 6)),
+    ("lookup_references", (12, 4)),
+])
+def test_lazy_indexers_answer_lookups_like_eager_ones(indexer, lazy_indexer, lookup, args):
+    # Given an eager and a lazy index of the same file
+    # When I perform a lookup against both
+    # Then I expect the same result
+    filename = rel("examples/reader.py")
+    assert getattr(lazy_indexer, lookup)(filename, *args) == getattr(indexer, lookup)(filename, *args)
+
+
+def test_lazy_indexers_only_expand_the_bodies_lookups_need(lazy_indexer):
+    # Given a lazily-indexed file
+    # When I look up a position inside one of its functions
+    lazy_indexer.lookup_metadata(rel("examples/reader.py"), 15, 18)
+
+    # Then I expect only that function's body to have been analyzed
+    assert [f.name for f in lazy_indexer.lazy_bodies["tests.examples.reader"]] == [
+        "tests.examples.reader.Reader.__init__",
+        "tests.examples.reader.Reader.read",
+    ]
+    assert lazy_indexer.stats.counters["lazy.bodies_expanded"] == 1
+
+
+def test_expanding_every_lazy_body_matches_indexing_eagerly(indexer, lazy_indexer):
+    # Given a lazily-indexed file
+    # When I expand every function body in it
+    lazy_indexer.expand_bodies({
+        module_name: [function.source_location.start for function in functions]
+        for module_name, functions in lazy_indexer.lazy_bodies.items()
+    })
+
+    # Then I expect the index to be the same as an eager one
+    assert not lazy_indexer.lazy_bodies
+    assert normalized(lazy_indexer) == normalized(indexer)
+
+
+def test_lazy_indexers_reindex_files_that_changed_before_expanding(tmpdir):
+    # Given a lazily-indexed module
+    tmpdir.mkdir(".git")
+    module = tmpdir.join("example.py")
+    module.write("def f():\n    x = 1\n")
+    indexer = Indexer(lazy=True)
+    indexer.index_file(str(module))
+
+    # When the module changes on disk and I look up a position inside its function
+    module.write("def f():\n    y = 1\n")
+    indexer.expand_bodies(indexer.lookup_pending_expansions("lookup_entity", str(module), 2, 4))
+    indexer.expand_bodies(indexer.lookup_pending_expansions("lookup_entity", str(module), 2, 4))
+
+    # Then I expect the new version of the module to be analyzed
+    assert "example.f.y" in indexer.entities_by_fqn
+    assert "example.f.x" not in indexer.entities_by_fqn
+
+
+def search(indexer, query):
+    return [data["name"] for data in indexer.search_symbols(query)]
+
+
+def test_indexers_can_search_symbols(tmpdir):
+    # Given a module with module and class level definitions, locals and imports
+    module = tmpdir.join("example.py")
+    module.write(
+        "import os\n\nreader_count = 0\n\nclass Reader:\n    buffer_size = 1\n\n"
+        "    def read_all(self):\n        read_local = 1\n\n        def read_nested():\n            pass\n"
+    )
+    indexer = Indexer()
+    indexer.index_file(str(module), "example")
+
+    # When I search for symbols
+    # Then I expect only the module and the module and class level definitions to be found
+    assert search(indexer, "read") == ["example.Reader", "example.Reader.read_all", "example.reader_count"]
+    assert search(indexer, "bs") == ["example.Reader.buffer_size"]
+    assert search(indexer, "os") == []
+
+    # And I expect their metadata to be returned
+    assert indexer.search_symbols("Reader", 1)[0]["type"] == "class"
+
+
+def test_indexers_update_symbols_incrementally(tmpdir):
+    # Given an indexer, a copy of it and two modules that define the same name
+    tmpdir.join("a.py").write("def f():\n    pass\n")
+    tmpdir.join("b.py").write("def f():\n    pass\n")
+    indexer = Indexer()
+    indexer.index_file(str(tmpdir.join("a.py")), "a")
+    indexer.index_file(str(tmpdir.join("b.py")), "b")
+    snapshot = indexer.copy()
+
+    # When I rename a function in one of them and remove the other
+    tmpdir.join("a.py").write("def g():\n    pass\n")
+    indexer.index_file(str(tmpdir.join("a.py")), "a")
+    indexer.remove_module("b")
+
+    # Then I expect searches to reflect the changes
+    assert search(indexer, "f") == []
+    assert search(indexer, "g") == ["a.g"]
+
+    # And I expect the copy to be unaffected
+    assert search(snapshot, "f") == ["a.f", "b.f"]
+
+    # And I expect loaded indexes to be searchable
+    indexer.save(str(tmpdir.join("index")))
+    assert search(Indexer.load(str(tmpdir.join("index"))), "g") == ["a.g"]
+
+
+def test_indexers_analyze_identical_files_once(tmpdir):
+    # Given three files with the same contents
+    source = "from . import sibling\n\nclass A:\n    def f(self):\n        return sibling\n"
+    for name in ("a", "b", "c"):
+        tmpdir.mkdir(name).join("__init__.py").write(source)
+
+    # When I index them
+    indexer = Indexer()
+    for name in ("a", "b", "c"):
+        indexer.index_file(str(tmpdir.join(name, "__init__.py")), name)
+
+    # Then I expect each one to be indexed under its own name and filename
+    for name in ("a", "b", "c"):
+        entity = indexer.entities_by_fqn[f"{name}.A.f"]
+        assert entity.source_location.filename == str(tmpdir.join(name, "__init__.py"))
+        assert indexer.entities_by_fqn[f"{name}.sibling"].target == f"{name}.sibling"
+
+    # And I expect only the first two to have been parsed
+    assert indexer.stats.counters["analyzer.modules"] == 2
+    assert indexer.stats.cache_hit_rates["templates"] == pytest.approx(1 / 3)
+
+
+def test_indexers_share_fqns_between_definitions_and_references(tmpdir):
+    # Given a module that refers to the same names many times
+    tmpdir.mkdir(".git")
+    tmpdir.join("a.py").write("x = 1\n\ndef f(y):\n    return x(y, y)\n\nf(x)\n")
+
+    # When I index it
+    indexer = Indexer()
+    indexer.index_file(str(tmpdir.join("a.py")))
+    definitions = {name: name for name in indexer.entities_by_fqn}
+
+    # Then I expect references within a scope to share its definition's FQN
+    assert all(reference.name is definitions["a.f.y"] for reference in indexer.references_by_fqn["a.f.y"])
+
+    # And I expect resolved names to share their definitions' FQNs
+    for name in indexer.references_by_fqn:
+        assert name is definitions[name]
+
+
+def test_indexers_can_look_up_callers_and_callees(tmpdir):
+    # Given a project where calls go through an import
+    tmpdir.mkdir(".git")
+    tmpdir.join("core.py").write("def helper():\n    pass\n")
+    tmpdir.join("app.py").write(
+        "from core import helper\n\n"
+        "def main():\n    helper()\n\n"
+        "def other():\n    main()\n    other()\n"
+    )
+    indexer = Indexer()
+    indexer.index_file(str(tmpdir.join("core.py")))
+    indexer.index_file(str(tmpdir.join("app.py")))
+
+    # When I look up the callers and callees of functions
+    # Then I expect them to be found up to the given depth, closest first
+    callers = lambda indexer, depth: [  # noqa: E731
+        (caller["name"], caller["depth"])
+        for caller in indexer.lookup_callers(str(tmpdir.join("core.py")), 1, 4, depth)
+    ]
+    assert callers(indexer, 1) == [("app.main", 1)]
+    assert callers(indexer, None) == [("app.main", 1), ("app.other", 2)]
+    assert [
+        (callee["name"], callee["depth"])
+        for callee in indexer.lookup_callees(str(tmpdir.join("app.py")), 6, 4, None)
+    ] == [("app.main", 1), ("core.helper", 2)]
+
+    # When I remove a call
+    snapshot = indexer.copy()
+    tmpdir.join("app.py").write("from core import helper\n\ndef main():\n    pass\n")
+    indexer.index_file(str(tmpdir.join("app.py")))
+
+    # Then I expect the call graph to be updated
+    assert callers(indexer, None) == []
+
+    # And I expect the copy to be unaffected
+    assert callers(snapshot, None) == [("app.main", 1), ("app.other", 2)]
+
+    # And I expect loaded indexes to have a call graph
+    snapshot.save(str(tmpdir.join("index")))
+    assert callers(Indexer.load(str(tmpdir.join("index")), refresh=False), 1) == [("app.main", 1)]
+
+
+def test_indexers_do_not_grow_call_graphs_when_files_change(tmpdir):
+    # Given an indexed module that calls a function
+    tmpdir.mkdir(".git")
+    module = tmpdir.join("a.py")
+    module.write("def f():\n    pass\n\ndef g0():\n    f()\n")
+    indexer = Indexer()
+    indexer.index_file(str(module))
+    size = len(indexer.calls.names)
+
+    # When I rename its caller over and over
+    for i in range(1, 10):
+        module.write(f"def f():\n    pass\n\ndef g{i}():\n    f()\n")
+        indexer.index_file(str(module))
+
+    # Then I expect the call graph's names not to grow
+    assert len(indexer.calls.names) == size
+    assert [caller["name"] for caller in indexer.lookup_callers(str(module), 1, 4)] == ["a.g9"]
+
+
+def test_lazy_indexers_read_each_file_once_when_searching_for_usages(tmpdir):
+    # Given a lazily-indexed module
+    tmpdir.mkdir(".git")
+    module = tmpdir.join("a.py")
+    module.write("def f():\n    pass\n\ndef g():\n    return 1\n")
+    indexer = Indexer(lazy=True)
+    indexer.index_file(str(module))
+
+    # When I search for usages of names its bodies don't mention several times
+    for _ in range(3):
+        indexer.lookup_references(str(module), 1, 4)
+
+    # Then I expect the file to have been read only once
+    assert indexer.stats.counters["cache.lazy_sources.misses"] == 1
+    assert indexer.stats.counters["cache.lazy_sources.hits"] == 2
+
+    # When the file changes
+    module.write("def f():\n    pass\n\ndef g():\n    return f()\n")
+
+    # Then I expect the change to be picked up
+    assert [reference["name"] for reference in indexer.lookup_references(str(module), 1, 4)] == ["a.f", "a.g.f"]
+
+
+class Planted:
+    def __reduce__(self):
+        return (os.remove, (self.path,))
+
+
+def test_indexers_refuse_to_load_code_from_index_files(tmpdir):
+    # Given an index file that would remove a file when unpickled
+    victim = tmpdir.join("victim")
+    victim.write("")
+    planted = Planted()
+    planted.path = str(victim)
+    with open(str(tmpdir.join("index")), "wb") as f:
+        f.write(INDEX_FORMAT_MAGIC + INDEX_FORMAT_VERSION.to_bytes(4, "big"))
+        pickle.dump({"lazy": planted}, f)
+
+    # When I load it
+    # Then I expect it to be rejected without running anything
+    with pytest.raises(ValueError):
+        Indexer.load(str(tmpdir.join("index")))
+    assert victim.exists()
+
+
+def test_indexers_refuse_to_load_index_files_other_users_own(tmpdir, monkeypatch):
+    # Given an index file that belongs to another user
+    Indexer().save(str(tmpdir.join("index")))
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(str(tmpdir.join("index"))).st_uid + 1)
+
+    # When I load it
+    # Then I expect it to be rejected
+    with pytest.raises(ValueError):
+        Indexer.load(str(tmpdir.join("index")))
@@ -0,0 +1,23 @@
+from kawa.__main__ import group_by_file
+
+
+def usage(filename, line_number, column_offset=0):
+    return {"location": {"filename": filename, "line_number": line_number, "column_offset": column_offset}}
+
+
+def test_usages_are_grouped_by_file_with_their_definition():
+    # Given a definition followed by its references, in file order
+    usages = [usage("b.py", 3), usage("a.py", 1), usage("b.py", 1), usage("b.py", 5), usage("c.py", 2)]
+
+    # When I group them by file
+    groups = list(group_by_file(usages))
+
+    # Then I expect every file to be grouped once, in order
+    assert groups == [
+        {"filename": "a.py", "references": [usage("a.py", 1)]},
+        {"filename": "b.py", "references": [usage("b.py", 1), usage("b.py", 3), usage("b.py", 5)]},
+        {"filename": "c.py", "references": [usage("c.py", 2)]},
+    ]
+
+    # And I expect nothing to be grouped when there are no usages
+    assert list(group_by_file([])) == []
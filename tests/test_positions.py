@@ -0,0 +1,50 @@
+import pytest
+
+from kawa.analyzer import Analyzer
+from kawa.positions import PositionIndex
+
+SOURCE = """\
+def f(a,
+      b):
+    return g(
+        a,
+        b,
+    )
+
+
+x = f
+"""
+
+
+@pytest.fixture
+def index():
+    return PositionIndex(Analyzer("<example>", "example", SOURCE).analyze().flatten())
+
+
+@pytest.mark.parametrize("line_number,column_offset,expected", [
+    (1, 0, "example.f"),
+    (1, 6, "example.f.a"),
+    (1, 7, "example.f"),
+    (2, 6, "example.f.b"),
+    (3, 11, "example.f.g"),
+    (3, 12, "example.f"),
+    (4, 8, "example.f.a"),
+    (5, 8, "example.f.b"),
+    (7, 0, "example"),
+    (9, 0, "example.x"),
+    (9, 4, "example.f"),
+    (8, 0, "example"),
+    (20, 0, None),
+])
+def test_position_indexes_find_the_innermost_entity(index, line_number, column_offset, expected):
+    entity = index.lookup(line_number, column_offset)
+    assert (entity and entity.name) == expected
+
+
+@pytest.mark.parametrize("first_line,last_line,expected", [
+    (4, 5, ["example", "example.f", "example.f.a", "example.f.b"]),
+    (9, 9, ["example", "example.x", "example.f"]),
+    (7, 8, ["example"]),
+])
+def test_position_indexes_find_entities_in_line_ranges(index, first_line, last_line, expected):
+    assert [entity.name for entity in index.lookup_range(first_line, last_line)] == expected
@@ -0,0 +1,56 @@
+import pytest
+
+from kawa.project import find_project_modules, index_project
+
+
+@pytest.fixture
+def project(tmpdir):
+    tmpdir.mkdir(".git")
+    package = tmpdir.mkdir("package")
+    package.join("__init__.py").write("")
+    package.join("a.py").write("def f():\n    pass\n")
+    package.join("b.py").write("def g():\n    return f()\n")
+    package.join("broken.py").write("def (:\n")
+    tmpdir.mkdir(".venv").join("ignored.py").write("x = 1\n")
+    return tmpdir
+
+
+def test_projects_can_be_discovered(project):
+    # Given a project
+    # When I look for its modules
+    modules = find_project_modules(str(project))
+
+    # Then I expect to get every module with its qualified name
+    assert [name for _, name in modules] == [
+        "package", "package.a", "package.b", "package.broken",
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_projects_can_be_indexed(project, jobs):
+    # Given a project
+    # When I index it
+    indexer, report = index_project(str(project), jobs=jobs)
+
+    # Then I expect every valid module to be indexed
+    assert sorted(indexer.modules) == ["package", "package.a", "package.b"]
+    assert "package.a.f" in indexer.entities_by_fqn
+
+    # And I expect the workers' stats to have been collected
+    assert indexer.stats.counters["analyzer.modules"] == 3
+
+    # And I expect the broken module to be reported
+    assert report.files == 3
+    assert [filename for filename, _ in report.failures] == [str(project.join("package", "broken.py"))]
+
+
+def test_projects_are_indexed_incrementally(project):
+    # Given an indexed project
+    indexer, _ = index_project(str(project), jobs=1)
+
+    # When I index it again
+    _, report = index_project(str(project), indexer, jobs=1)
+
+    # Then I expect only the broken module to have been reanalyzed
+    assert report.files == 0
+    assert len(report.failures) == 1
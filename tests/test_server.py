@@ -0,0 +1,150 @@
+import io
+import json
+import os
+
+from kawa.indexer import Indexer
+from kawa.server import METHOD_NOT_FOUND, INVALID_PARAMS, PARSE_ERROR, serve_stdio
+
+
+def rel(path):
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), path))
+
+
+def serve(*requests):
+    infile = io.StringIO("".join(
+        request if isinstance(request, str) else json.dumps(request) + "\n"
+        for request in requests
+    ))
+    outfile = io.StringIO()
+    serve_stdio(Indexer(), infile, outfile)
+    return [json.loads(line) for line in outfile.getvalue().splitlines()]
+
+
+def test_servers_can_answer_pipelined_requests():
+    # Given a couple of requests sent without waiting for replies
+    params = {"filename": rel("examples/reader.py"), "line": 18, "column": 10}
+
+    # When I serve them
+    responses = serve(
+        {"id": 1, "method": "describe", "params": params},
+        {"id": 2, "method": "find_definition", "params": params},
+    )
+
+    # Then I expect one response per request, in order
+    assert [response["id"] for response in responses] == [1, 2]
+    assert responses[0]["result"]["type"] == "reference"
+    assert responses[1]["result"]["name"] == "tests.examples.reader.read"
+
+
+def test_servers_accept_positional_params():
+    # Given a request with positional params
+    # When I serve it
+    responses = serve({"id": 1, "method": "find_usages", "params": [rel("examples/reader.py"), 12, 4]})
+
+    # Then I expect it to be answered
+    assert len(responses[0]["result"]) == 2
+
+
+def test_servers_can_describe_ranges():
+    # Given a request for the entities on a range of lines
+    # When I serve it
+    responses = serve({"id": 1, "method": "describe_range", "params": [rel("examples/reader.py"), 12, 12]})
+
+    # Then I expect every entity on those lines and those around them to be described
+    assert [entity["name"] for entity in responses[0]["result"]] == [
+        "tests.examples.reader",
+        "tests.examples.reader.read",
+        "tests.examples.reader.read.filename",
+        "tests.examples.reader.read.count",
+    ]
+
+
+def test_servers_report_errors():
+    # Given a set of invalid requests
+    # When I serve them
+    responses = serve(
+        "not json\n",
+        {"id": 1, "method": "frobnicate"},
+        {"id": 2, "method": "describe", "params": {"filename": rel("examples/reader.py")}},
+    )
+
+    # Then I expect each one to receive an appropriate error
+    assert [response["error"]["code"] for response in responses] == [PARSE_ERROR, METHOD_NOT_FOUND, INVALID_PARAMS]
+    assert [response["id"] for response in responses] == [None, 1, 2]
+
+
+def test_servers_stop_on_exit():
+    # Given an exit request followed by another request
+    # When I serve them
+    responses = serve(
+        {"id": 1, "method": "exit"},
+        {"id": 2, "method": "describe", "params": [rel("examples/reader.py"), 1, 0]},
+    )
+
+    # Then I expect no responses
+    assert responses == []
+
+
+def test_servers_reindex_files_that_changed(tmpdir):
+    # Given an indexer and a file it has indexed
+    module = tmpdir.join("example.py")
+    module.write("x = 1\n")
+    indexer = Indexer()
+    indexer.index_file(str(module), "example")
+
+    # When the file changes and I ensure it's indexed
+    module.write("y = 1\n")
+    os.utime(str(module), ns=(0, 0))
+    reindexed = indexer.ensure_indexed(str(module), "example")
+
+    # Then I expect it to have been reindexed
+    assert reindexed
+    assert "example.y" in indexer.entities_by_fqn
+
+
+def test_servers_can_report_stats():
+    # Given a lookup followed by a stats request
+    params = {"filename": rel("examples/reader.py"), "line": 18, "column": 10}
+
+    # When I serve them
+    responses = serve(
+        {"id": 1, "method": "find_definition", "params": params},
+        {"id": 2, "method": "stats", "params": {"reset": True}},
+        {"id": 3, "method": "stats"},
+    )
+
+    # Then I expect the stats to describe the work done for the lookup
+    stats = responses[1]["result"]
+    assert stats["counters"]["analyzer.modules"] == 1
+    assert stats["counters"]["calls.lookup.definition"] == 1
+    assert "parse" in stats["timings"]
+
+    # And I expect them to be reset once reported
+    assert responses[2]["result"]["counters"] == {}
+
+
+def test_servers_can_search_symbols():
+    # Given a file that has been indexed and a search request
+    filename = rel("examples/reader.py")
+
+    # When I serve them
+    responses = serve(
+        {"id": 1, "method": "index", "params": {"filename": filename}},
+        {"id": 2, "method": "search", "params": {"query": "Read", "limit": 2}},
+    )
+
+    # Then I expect the best matches to be returned
+    assert [data["name"] for data in responses[1]["result"]] == [
+        "tests.examples.reader.read", "tests.examples.reader.Reader.read",
+    ]
+
+
+def test_servers_can_limit_usages():
+    # Given a request for at most one usage
+    params = {"filename": rel("examples/reader.py"), "line": 12, "column": 9, "limit": 1}
+
+    # When I serve it
+    responses = serve({"id": 1, "method": "find_usages", "params": params})
+
+    # Then I expect only the definition to be returned
+    assert [usage["type"] for usage in responses[0]["result"]] == ["variable"]
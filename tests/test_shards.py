@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from kawa.indexer import Indexer
+from kawa.shards import ROOT_SHARD, ShardedIndex, index_shards, shard_key
+
+FILES = {
+    "billing/__init__.py": "from .core import charge\n",
+    "billing/core.py": "def charge(amount):\n    return amount\n",
+    "web/__init__.py": "from billing import charge\n\ncharge(1)\n",
+    "libs/common/__init__.py": "from web import charge\n\ndef f():\n    return charge(2)\n",
+    "libs/other/__init__.py": "from billing.core import charge\n\ncharge(3)\n",
+    "setup.py": "import web\n",
+    "helpers.py": "def run():\n    pass\n",
+    "tools/cli.py": "def main():\n    return helpers.run()\n",
+}
+
+
+@pytest.fixture
+def project(tmpdir):
+    tmpdir.mkdir(".git")
+    for filename, source in FILES.items():
+        tmpdir.join(filename).write(source, ensure=True)
+    return tmpdir
+
+
+@pytest.mark.parametrize("path,prefixes,expected", [
+    ("billing/core.py", [], "billing"),
+    ("setup.py", [], ROOT_SHARD),
+    ("libs/common/__init__.py", [], "libs"),
+    ("libs/common/__init__.py", ["libs/common"], "libs/common"),
+    ("libs/common/__init__.py", ["libs", "libs/common/"], "libs/common"),
+    ("libs/commons/__init__.py", ["libs/common"], "libs"),
+])
+def test_files_are_sharded_by_top_level_package_or_prefix(path, prefixes, expected):
+    # Given a file's path and a set of prefixes
+    # When I look up its shard
+    # Then I expect the longest matching prefix or else its top-level package
+    assert shard_key(path, prefixes) == expected
+
+
+def test_only_shards_whose_files_changed_are_rebuilt(project):
+    # Given a sharded project
+    directory = str(project.join(".kawa-shards"))
+    assert sorted(index_shards(directory, str(project), ["libs/common"], jobs=2)) == [
+        ROOT_SHARD, "billing", "libs", "libs/common", "tools", "web",
+    ]
+
+    # When I change a file in one shard and remove every file of another
+    project.join("billing", "core.py").write("def charge(amount, currency):\n    return amount\n")
+    project.join("libs", "other", "__init__.py").remove()
+    reports = index_shards(directory, str(project), ["libs/common"], jobs=1)
+
+    # Then I expect only the shard that changed to be rebuilt
+    assert list(reports) == ["billing"]
+    assert reports["billing"].files == 2
+
+    # And I expect the shard that has no files left to be removed
+    assert sorted(ShardedIndex(directory).paths) == [ROOT_SHARD, "billing", "libs/common", "tools", "web"]
+    assert len([name for name in os.listdir(directory) if name.endswith(".kawa-index")]) == 5
+
+
+@pytest.mark.parametrize("filename,line,column", [
+    ("web/__init__.py", 3, 0),
+    ("web/__init__.py", 1, 20),
+    ("libs/common/__init__.py", 4, 11),
+    ("libs/other/__init__.py", 3, 0),
+    ("billing/core.py", 1, 4),
+    ("tools/cli.py", 2, 11),
+])
+def test_sharded_indexes_answer_lookups_like_indexers(project, filename, line, column):
+    # Given a sharded project and an indexer of the whole project
+    directory = str(project.join(".kawa-shards"))
+    index_shards(directory, str(project), ["libs/common"], jobs=1)
+    sharded, indexer = ShardedIndex(directory), Indexer()
+    for name in FILES:
+        indexer.index_file(str(project.join(name)))
+
+    # When I run the same lookups against both
+    # Then I expect the same definitions and the same references, by file
+    filename = str(project.join(filename))
+    assert sharded.lookup_definition(filename, line, column) == indexer.lookup_definition(filename, line, column)
+    assert list(sharded.iter_references(filename, line, column, by_file=True)) == \
+        list(indexer.iter_references(filename, line, column, by_file=True))
+
+
+def test_sharded_indexes_only_load_the_shards_lookups_need(project):
+    # Given a sharded project
+    directory = str(project.join(".kawa-shards"))
+    index_shards(directory, str(project), jobs=1)
+    sharded = ShardedIndex(directory)
+
+    # When I look up the definition of a name imported from another shard
+    definition = sharded.lookup_definition(str(project.join("web", "__init__.py")), 3, 0)
+
+    # Then I expect it to be found in the shard that owns it
+    assert definition["name"] == "billing.core.charge"
+
+    # And I expect only the shards along the way to be loaded
+    assert sorted(sharded.shards) == ["billing", "web"]
+
+    # When I look up the references of a name some other shard refers to
+    references = sharded.lookup_references(str(project.join("tools", "cli.py")), 2, 11)
+
+    # Then I expect its definition to come from the shard that owns it
+    # and its references from the shards that refer to it
+    assert [(reference["name"], reference["location"]["filename"]) for reference in references] == [
+        ("helpers", str(project.join("helpers.py"))),
+        ("tools.cli.main.helpers", str(project.join("tools", "cli.py"))),
+    ]
+    assert sorted(sharded.shards) == [ROOT_SHARD, "billing", "tools", "web"]
@@ -0,0 +1,70 @@
+from kawa.indexer import Indexer
+from kawa.stats import Stats
+
+from .test_indexer import rel
+
+
+def test_stats_can_compute_cache_hit_rates():
+    # Given some stats with cache hits and misses
+    stats = Stats()
+    for _ in range(3):
+        stats.hit("names")
+    stats.miss("names")
+    stats.miss("stamps")
+
+    # When I compute their hit rates
+    # Then I expect one rate per cache
+    assert stats.cache_hit_rates == {"names": 0.75, "stamps": 0.0}
+
+
+def test_stats_can_be_merged():
+    # Given two sets of stats
+    a, b = Stats(), Stats()
+    a.count("x")
+    a.add_time("parse", 1.0)
+    b.count("x", 2)
+    b.add_time("parse", 0.5)
+
+    # When I merge one into the other, once directly and once via its dict form
+    a.merge(b)
+    a.merge(b.as_dict())
+
+    # Then I expect their counters and timings to be summed
+    assert a.counters["x"] == 5
+    assert a.timings["parse"] == 2.0
+
+
+def test_indexers_record_stats():
+    # Given an indexer
+    indexer = Indexer()
+
+    # When I index a file and look up the definition of a name twice
+    indexer.index_file(rel("examples/reader.py"))
+    indexer.lookup_definition(rel("examples/reader.py"), 18, 10)
+    indexer.lookup_definition(rel("examples/reader.py"), 18, 10)
+
+    # Then I expect the analysis to have been counted
+    counters = indexer.stats.counters
+    assert counters["analyzer.nodes.FunctionDef"] == 3
+    assert counters["analyzer.nodes.ClassDef"] == 1
+    assert counters["analyzer.references"] == 7
+    assert counters["resolver.probes"] > 0
+    assert counters["calls.lookup.definition"] == 2
+
+    # And I expect every phase to have been timed
+    assert {"parse", "walk", "index", "resolve", "lookup.definition"} <= indexer.stats.timings.keys()
+
+    # And I expect resolved names to have been memoized
+    assert counters["cache.resolved_names.hits"] > 0
+
+
+def test_indexer_copies_share_stats():
+    # Given an indexer and a copy of it
+    indexer = Indexer()
+    copy = indexer.copy()
+
+    # When I index a file using the copy
+    copy.index_file(rel("examples/reader.py"))
+
+    # Then I expect the original's stats to reflect that
+    assert indexer.stats.counters["analyzer.modules"] == 1
@@ -0,0 +1,95 @@
+import pytest
+
+from kawa.symbols import SymbolIndex
+
+NAMES = [
+    "app.files.get_file_name",
+    "app.files.GetFileName",
+    "app.http.HTTPServer",
+    "app.io.read",
+    "app.io.Reader",
+    "app.io.Reader.read",
+    "app.io.thread_local",
+    "app.io.unread",
+    "app.x",
+]
+
+
+@pytest.fixture
+def index():
+    index = SymbolIndex()
+    for name in NAMES:
+        index.add(name)
+    return index
+
+
+@pytest.mark.parametrize("query,expected", [
+    # Exact matches come first, then prefix matches, shorter names first
+    ("read", ["app.io.read", "app.io.Reader.read", "app.io.Reader", "app.io.unread", "app.io.thread_local"]),
+    ("READ", ["app.io.read", "app.io.Reader.read", "app.io.Reader", "app.io.unread", "app.io.thread_local"]),
+    ("re", ["app.io.read", "app.io.Reader.read", "app.io.Reader"]),
+    ("x", ["app.x"]),
+
+    # Substrings that start words rank above other substrings
+    ("local", ["app.io.thread_local"]),
+    ("Server", ["app.http.HTTPServer"]),
+
+    # Camel and snake case abbreviations
+    ("gfn", ["app.files.GetFileName", "app.files.get_file_name"]),
+    ("getname", ["app.files.GetFileName", "app.files.get_file_name"]),
+    ("hs", ["app.http.HTTPServer"]),
+
+    # Dotted queries match the scope of the name
+    ("Reader.read", ["app.io.Reader.read"]),
+    ("http.serv", ["app.http.HTTPServer"]),
+
+    # Nothing else
+    ("", []),
+    ("zzz", []),
+    ("fng", []),
+])
+def test_symbol_indexes_rank_matches(index, query, expected):
+    # Given a symbol index
+    # When I search for a query
+    # Then I expect the matching names in order
+    assert index.search(query) == expected
+
+
+def test_symbol_indexes_respect_limits(index):
+    # Given a symbol index
+    # When I search for a query with a limit
+    # Then I expect only the best matches to be returned
+    assert index.search("read", limit=2) == ["app.io.read", "app.io.Reader.read"]
+
+
+def test_symbol_indexes_can_remove_names(index):
+    # Given a symbol index and a copy of it
+    copy = index.copy()
+
+    # When I remove names from the copy
+    copy.remove("app.io.read")
+    copy.remove("app.io.Reader.read")
+    copy.remove("app.io.missing")
+
+    # Then I expect them to no longer be found in the copy
+    assert copy.search("read") == ["app.io.Reader", "app.io.unread", "app.io.thread_local"]
+    assert "read" not in copy.names
+    assert all("read" not in basenames for basenames in copy.postings.values())
+
+    # And I expect the original to be unaffected
+    assert index.search("read", limit=1) == ["app.io.read"]
+    assert len(index) == len(NAMES)
+
+
+def test_symbol_indexes_match_long_abbreviations_quickly():
+    # Given a name made up of many similar words
+    name = "app." + "_".join(["aa"] * 30 + ["cb"])
+    index = SymbolIndex()
+    index.add(name)
+
+    # When I search for an abbreviation of many of those words that can't be completed
+    # Then I expect the search to give up without trying every way of splitting it
+    assert index.search("a" * 40 + "b") == []
+
+    # And I expect an abbreviation that can be completed to be found
+    assert index.search("a" * 40 + "c") == [name]
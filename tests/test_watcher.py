@@ -0,0 +1,166 @@
+import time
+
+import pytest
+
+from kawa.indexer import Indexer
+from kawa.watcher import InotifyWatcher, PollingWatcher, ProjectWatcher, make_watcher
+
+
+@pytest.fixture
+def project(tmpdir):
+    tmpdir.mkdir(".git")
+    package = tmpdir.mkdir("package")
+    package.join("__init__.py").write("")
+    package.join("a.py").write("def f():\n    pass\n")
+    package.join("b.py").write("from package.a import f\n\nf()\n")
+    return tmpdir
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def read_until(watcher, expected, timeout=5):
+    changed, deadline = set(), time.monotonic() + timeout
+    while not expected <= changed and time.monotonic() < deadline:
+        changed |= watcher.read(timeout=0.1)
+    return changed
+
+
+@pytest.fixture(params=["inotify", "polling"])
+def watcher_factory(request):
+    if request.param == "inotify":
+        def factory(root):
+            try:
+                return InotifyWatcher(str(root))
+            except OSError:
+                pytest.skip("inotify is not available")
+        return factory
+
+    return lambda root: PollingWatcher(str(root), interval=0.01)
+
+
+def test_watchers_report_changed_files(project, watcher_factory):
+    # Given a watcher over a project
+    watcher = watcher_factory(project)
+    try:
+        # When I modify, create and delete files
+        project.join("package", "a.py").write("def g():\n    pass\n\n")
+        project.join("package", "c.py").write("x = 1\n")
+        project.join("package", "b.py").remove()
+        project.join("notes.txt").write("ignored")
+
+        # Then I expect the Python files to be reported
+        expected = {str(project.join("package", name)) for name in ("a.py", "b.py", "c.py")}
+        changed = read_until(watcher, expected)
+        assert expected <= changed
+        assert str(project.join("notes.txt")) not in changed
+    finally:
+        watcher.close()
+
+
+def test_watchers_report_files_in_new_directories(project, watcher_factory):
+    # Given a watcher over a project
+    watcher = watcher_factory(project)
+    try:
+        # When I create a new package and then add a module to it
+        subpackage = project.join("package").mkdir("sub")
+        read_until(watcher, {str(subpackage)}, timeout=0.5)
+        subpackage.join("d.py").write("y = 1\n")
+
+        # Then I expect the module to be reported
+        filename = str(subpackage.join("d.py"))
+        assert filename in read_until(watcher, {filename})
+    finally:
+        watcher.close()
+
+
+def test_make_watcher_can_fall_back_to_polling(project):
+    # Given a project
+    # When I ask for a polling watcher
+    watcher = make_watcher(str(project), polling=True)
+
+    # Then I expect to get one
+    assert isinstance(watcher, PollingWatcher)
+
+
+def test_project_watchers_reindex_batches_of_changes(project):
+    # Given an indexed project and a watcher keeping it up to date
+    indexer = Indexer()
+    for name in ("a", "b"):
+        indexer.index_file(str(project.join("package", f"{name}.py")))
+
+    batches = []
+
+    def apply(analyzed, removed):
+        batches.append((sorted(module.name for module, _ in analyzed), removed))
+        indexer.update_files(analyzed, removed)
+
+    watcher = ProjectWatcher(str(project), apply, PollingWatcher(str(project), 0.01), debounce=0.1, jobs=1)
+    with watcher:
+        # When a burst of files changes at once
+        project.join("package", "a.py").write("def g():\n    pass\n")
+        project.join("package", "c.py").write("from package.a import g\n")
+        project.join("package", "b.py").remove()
+
+        # Then I expect the index to catch up
+        wait_for(lambda: "package.a.g" in indexer.entities_by_fqn and "package.b" not in indexer.modules)
+
+    # And I expect the changes to have been applied in a single batch
+    assert batches == [(["package.a", "package.c"], [str(project.join("package", "b.py"))])]
+    assert "package.a.f" not in indexer.entities_by_fqn
+    assert "package.c.g" in indexer.entities_by_fqn
+
+
+def test_project_watchers_can_analyze_batches_in_worker_processes(project):
+    # Given an indexed project and a watcher that analyzes changes on two workers
+    indexer = Indexer()
+    indexer.index_file(str(project.join("package", "a.py")))
+    watcher = ProjectWatcher(
+        str(project), indexer.update_files, PollingWatcher(str(project), 0.01), debounce=0.5, jobs=2,
+    )
+
+    with watcher:
+        # When many files change at once
+        for name in ("c", "d", "e"):
+            project.join("package", f"{name}.py").write(f"def {name}():\n    pass\n")
+
+        # Then I expect the index to catch up
+        wait_for(lambda: all(f"package.{name}.{name}" in indexer.entities_by_fqn for name in "cde"), timeout=30)
+
+    # And I expect them to have been analyzed in a single batch
+    assert watcher.batches == 1
+    assert watcher.failures == []
+
+
+def test_project_watchers_skip_files_that_fail_to_analyze(project):
+    # Given a watcher over an indexed project
+    indexer = Indexer()
+    indexer.index_file(str(project.join("package", "a.py")))
+    watcher = ProjectWatcher(str(project), indexer.update_files, PollingWatcher(str(project), 0.01), jobs=1)
+
+    # When a file is changed to something that isn't valid Python
+    filename = str(project.join("package", "a.py"))
+    project.join("package", "a.py").write("def f(:\n")
+    watcher.process({filename})
+
+    # Then I expect its previous version to be kept
+    assert "package.a.f" in indexer.entities_by_fqn
+    assert [failed for failed, _ in watcher.failures] == [filename]
+
+
+def test_update_files_removes_modules_under_removed_directories(project):
+    # Given an indexed package
+    indexer = Indexer()
+    for name in ("__init__", "a", "b"):
+        indexer.index_file(str(project.join("package", f"{name}.py")))
+
+    # When the package is deleted
+    project.join("package").remove()
+    indexer.update_files([], [str(project.join("package"))])
+
+    # Then I expect all of its modules to be removed
+    assert indexer.modules == {}